@@ -0,0 +1,484 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+hpsspy.cache
+~~~~~~~~~~~~
+
+Read and write the file caches used by :mod:`hpsspy.scan`.
+
+Caches are normally CSV files, with columns ``Name``, ``Size`` and
+``Mtime``.  CSV caches are compressed if their names end with ``.gz``,
+``.bz2``, ``.xz`` or, if a zstd module is available, ``.zst``.  Compressed
+caches are read and written as a stream, and never decompressed to disk.
+
+Caches with names ending in ``.bin`` are written in a binary format instead,
+that can be memory-mapped, and so cannot be compressed:
+
+1. An 8-byte identifier, followed by the number of rows, `n`, as an
+   unsigned 64-bit integer.
+2. `n` sizes and `n` modification times, as signed 64-bit integers.
+3. `n` + 1 offsets of each name, relative to the start of the names, as
+   unsigned 64-bit integers.
+4. `n` row numbers, as unsigned 64-bit integers, that list the rows in
+   order of name.
+5. The names, encoded as UTF-8, with no separators.
+
+All integers are little-endian.
+"""
+import bz2
+import csv
+import gzip
+import heapq
+import lzma
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from contextlib import contextmanager
+from functools import lru_cache
+from tempfile import TemporaryFile
+
+
+#
+# Identifies binary cache files.
+#
+magic = b'HPSSPYC\x01'
+
+_header = struct.Struct('<8sQ')
+
+
+def is_binary_cache(filename):
+    """Determine whether an existing cache file is in the binary format.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        Name of the cache file.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if `filename` is a binary cache.
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+
+def _binary_name(filename):
+    """Determine whether a new cache file should use the binary format.
+
+    A trailing ``.tmp`` on `filename` is ignored.
+    """
+    if filename.endswith('.tmp'):
+        filename = filename[:-4]
+    return filename.endswith('.bin')
+
+
+def _zstd_open():
+    """Find a function that opens zstd-compressed files.
+
+    Returns
+    -------
+    callable
+        A function like :func:`gzip.open`, or ``None`` if neither
+        :mod:`compression.zstd` (Python 3.14) nor :mod:`zstandard` is
+        available.
+    """
+    try:
+        from compression.zstd import open as zstd_open
+    except ImportError:
+        try:
+            from zstandard import open as zstd_open
+        except ImportError:
+            zstd_open = None
+    return zstd_open
+
+
+#
+# Functions that open compressed files, by extension.
+#
+compressors = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+_zstd = _zstd_open()
+if _zstd is not None:
+    compressors['.zst'] = _zstd
+
+
+def open_cache(filename, mode='r'):
+    """Open a CSV cache file, compressed or not, as text.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        Name of the cache file.  The compression, if any, is chosen by the
+        extension, ignoring any trailing ``.tmp``.
+    mode : :class:`str`, optional
+        ``'r'`` to read or ``'w'`` to write.
+
+    Returns
+    -------
+    file-like
+        A text stream, suitable for :mod:`csv`.
+
+    Raises
+    ------
+    ValueError
+        If the extension is ``.zst``, but no zstd module is available.
+    """
+    base = filename[:-4] if filename.endswith('.tmp') else filename
+    extension = os.path.splitext(base)[1]
+    if extension == '.zst' and extension not in compressors:
+        raise ValueError("zstd compression is not available for {0}!".format(filename))
+    try:
+        compressor = compressors[extension]
+    except KeyError:
+        return open(filename, mode, newline='')
+    return compressor(filename, mode + 't', newline='')
+
+
+class BinaryCache(Mapping):
+    """Memory-mapped, read-only access to a binary cache file.
+
+    This is a mapping of names to a tuple of size and modification time.
+    Names are found by a binary search of the file, so nothing is read
+    until it is needed.  The results of recent searches are remembered,
+    since the same archive file is usually looked up for many disk files
+    in a row.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        Name of the cache file.
+
+    Attributes
+    ----------
+    size : :class:`memoryview`
+        Size of each row, in file order.
+    mtime : :class:`memoryview`
+        Modification time of each row, in file order.
+    found_size : :class:`int`
+        Remember the results of at most this many searches.
+
+    Raises
+    ------
+    ValueError
+        If `filename` is not a binary cache.
+    """
+    found_size = 4096
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        m, n = _header.unpack_from(self._mmap)
+        if m != magic:
+            self._mmap.close()
+            raise ValueError("{0} is not a binary cache file!".format(filename))
+        self._n = n
+        self._view = memoryview(self._mmap)
+        start = _header.size
+        self.size = self._array(start, n, 'q')
+        start += 8*n
+        self.mtime = self._array(start, n, 'q')
+        start += 8*n
+        self._offset = self._array(start, n + 1, 'Q')
+        start += 8*(n + 1)
+        self._order = self._array(start, n, 'Q')
+        self._names = start + 8*n
+        self._found = lru_cache(maxsize=self.found_size)(self._search)
+
+    def _array(self, start, n, typecode):
+        """Interpret part of the file as an array of integers.
+        """
+        v = self._view[start:start + 8*n]
+        if sys.byteorder == 'little':
+            return v.cast(typecode)
+        a = array(typecode, v.tobytes())
+        a.byteswap()
+        return a
+
+    def _key(self, i):
+        """Return the encoded name in row `i`.
+        """
+        return self._mmap[self._names + self._offset[i]:
+                          self._names + self._offset[i + 1]]
+
+    def name(self, i):
+        """Return the name in row `i`.
+
+        Parameters
+        ----------
+        i : :class:`int`
+            Row number.
+
+        Returns
+        -------
+        :class:`str`
+            The name.
+        """
+        return self._key(i).decode('utf-8')
+
+    def index(self, name):
+        """Find the row containing `name`.
+
+        Parameters
+        ----------
+        name : :class:`str`
+            Name to find.
+
+        Returns
+        -------
+        :class:`int`
+            Row number.
+
+        Raises
+        ------
+        KeyError
+            If `name` is not in the cache.
+        """
+        i = self._found(name)
+        if i is None:
+            raise KeyError(name)
+        return i
+
+    def _search(self, name):
+        """Binary search for `name`, returning ``None`` if it is not found.
+        """
+        try:
+            b = name.encode('utf-8')
+        except UnicodeEncodeError:
+            return None
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(self._order[mid]) < b:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n and self._key(self._order[lo]) == b:
+            return self._order[lo]
+        return None
+
+    def rows(self):
+        """Iterate over rows in file order.
+
+        Yields
+        ------
+        :func:`tuple`
+            Name, size and modification time.
+        """
+        for i in range(self._n):
+            yield (self.name(i), self.size[i], self.mtime[i])
+
+    def __getitem__(self, name):
+        i = self.index(name)
+        return (self.size[i], self.mtime[i])
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self.name(i)
+
+    def __len__(self):
+        return self._n
+
+    def __reduce__(self):
+        return (self.__class__, (self.filename,))
+
+    def close(self):
+        """Release the memory map.
+        """
+        for v in (self.size, self.mtime, self._offset, self._order,
+                  self._view):
+            if isinstance(v, memoryview):
+                v.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BinaryCacheWriter(object):
+    """Write a binary cache file, one row at a time.
+
+    Sizes and modification times are held in memory, and names are held
+    in a temporary file, until :meth:`close` is called.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        Name of the cache file.
+
+    Attributes
+    ----------
+    run_size : :class:`int`
+        Names are sorted in runs of this many rows, which are then merged,
+        so at most this many names are held in memory at once.
+    """
+    run_size = 1000000
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._names = TemporaryFile(dir=os.path.dirname(os.path.abspath(filename)))
+        self._size = array('q')
+        self._mtime = array('q')
+        self._offset = array('Q', [0])
+
+    def writerow(self, row):
+        """Add a row to the cache.
+
+        Parameters
+        ----------
+        row : :class:`list`
+            Name, size and modification time.
+
+        Raises
+        ------
+        UnicodeEncodeError
+            If the name cannot be encoded, in which case nothing is added.
+        """
+        name = row[0].encode('utf-8')
+        size, mtime = int(row[1]), int(row[2])
+        self._names.write(name)
+        self._size.append(size)
+        self._mtime.append(mtime)
+        self._offset.append(self._offset[-1] + len(name))
+
+    def close(self):
+        """Sort the names and write the cache file.
+        """
+        n = len(self._size)
+        self._names.flush()
+        if self._offset[-1] > 0:
+            names = mmap.mmap(self._names.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            names = b''
+        offset = self._offset
+
+        def key(i):
+            return names[offset[i]:offset[i + 1]]
+
+        runs = [array('Q', sorted(range(start, min(start + self.run_size, n)),
+                                  key=key))
+                for start in range(0, n, self.run_size)]
+        if len(runs) == 1:
+            order = runs[0]
+        else:
+            order = array('Q', heapq.merge(*runs, key=key))
+        del runs
+        if isinstance(names, mmap.mmap):
+            names.close()
+        with open(self.filename, 'wb') as f:
+            f.write(_header.pack(magic, n))
+            for a in (self._size, self._mtime, offset, order):
+                if sys.byteorder != 'little':
+                    a = array(a.typecode, a)
+                    a.byteswap()
+                a.tofile(f)
+            self._names.seek(0)
+            shutil.copyfileobj(self._names, f)
+        self._names.close()
+
+    def abort(self):
+        """Discard the cache without writing it.
+        """
+        self._names.close()
+
+
+@contextmanager
+def write_cache(filename):
+    """Write a cache file.
+
+    The format is chosen by the name of the file: binary if `filename`
+    ends with ``.bin``, ignoring any trailing ``.tmp``, otherwise CSV,
+    compressed as described in :func:`open_cache`.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        Name of the cache file.
+
+    Yields
+    ------
+    object
+        An object with a :meth:`writerow` method that accepts a name, size
+        and modification time, like :func:`csv.writer`.
+    """
+    if _binary_name(filename):
+        w = BinaryCacheWriter(filename)
+        try:
+            yield w
+        except BaseException:
+            w.abort()
+            raise
+        w.close()
+    else:
+        with open_cache(filename, 'w') as t:
+            w = csv.writer(t)
+            w.writerow(['Name', 'Size', 'Mtime'])
+            yield w
+
+
+def read_cache(filename):
+    """Read the rows of a cache file, in either format.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        Name of the cache file.
+
+    Yields
+    ------
+    :func:`tuple`
+        Name, size and modification time of each row, in file order.
+    """
+    if is_binary_cache(filename):
+        with BinaryCache(filename) as c:
+            yield from c.rows()
+    else:
+        with open_cache(filename) as t:
+            reader = csv.reader(t)
+            next(reader, None)
+            for row in reader:
+                yield (row[0], int(row[1]), int(row[2]))
+
+
+def load_cache(filename):
+    """Load a cache file as a mapping of names to size and modification time.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        Name of the cache file.
+
+    Returns
+    -------
+    :class:`~collections.abc.Mapping`
+        For a CSV cache, a :class:`dict` of the files.  For a binary cache,
+        a :class:`BinaryCache`, which also contains the directories,
+        with a trailing ``/`` on the name.
+    """
+    if is_binary_cache(filename):
+        return BinaryCache(filename)
+    return dict((row[0], (row[1], row[2])) for row in read_cache(filename)
+                if not row[0].endswith('/'))
+
+
+def convert_cache(source, destination):
+    """Convert a cache file to another format.
+
+    Parameters
+    ----------
+    source : :class:`str`
+        Name of an existing cache file, in either format.
+    destination : :class:`str`
+        Name of the new cache file.  The format is chosen as in
+        :func:`write_cache`.
+    """
+    with write_cache(destination) as w:
+        for row in read_cache(source):
+            w.writerow(row)
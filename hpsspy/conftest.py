@@ -5,6 +5,19 @@ import locale
 import warnings
 import importlib
 from platform import platform
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_hpss_caches():
+    """Prevent cached HPSS metadata from leaking between tests.
+    """
+    from .util import link_cache, metadata_cache
+    link_cache.clear()
+    metadata_cache.clear()
+    yield
+    link_cache.clear()
+    metadata_cache.clear()
 
 
 def pytest_report_header(config):
@@ -6,13 +6,23 @@ hpsspy.os._os
 
 Contains the actual functions in :mod:`hpsspy.os`.
 """
-from os.path import join
-from .path import islink
+from collections import deque
+from functools import partial
+from itertools import chain
+from os.path import dirname, join, normpath
+from queue import Queue
 from .. import HpssOSError
-from ..util import HpssFile, hsi
+from ..util import (HpssDirEntry, HpssFile, HpssFileTable, hsi, hsi_iter,
+                    link_cache, metadata_cache)
 import re
 
-__all__ = ['chmod', 'listdir', 'makedirs', 'mkdir', 'stat', 'lstat', 'walk']
+__all__ = ['chmod', 'iterdir', 'listdir', 'makedirs', 'mkdir', 'scandir',
+           'stat', 'lstat', 'lstat_many', 'walk']
+
+#
+# Follow at most this many symbolic links when resolving a path.
+#
+max_symlinks = 40
 
 linere = re.compile(r"""([dl-])           # file type
                         ([rwxsStT-]+)\s+  # file permissions
@@ -45,6 +55,8 @@ def chmod(path, mode):
         If the underlying :command:`hsi` reports an error.
     """
     out = hsi('chmod', str(mode), path)
+    metadata_cache.invalidate(path)
+    link_cache.invalidate(path)
     if out.startswith('**'):
         raise HpssOSError(out)
     return
@@ -70,31 +82,267 @@ def _ls(path, options=''):
     out = hsi('ls', '-D' + options, path)
     if out.startswith('**'):
         raise HpssOSError(out)
-    lines = out.split('\n')
+    return list(_parse_ls(out.split('\n'), path))
+
+
+def _ils(path, options='', headers=False):
+    """Perform :command:`hsi ls` and parse the results as they are produced.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Directory or file to examine.
+    options : :class:`str`, optional
+        Options to ``ls`` that will be appended to ``-D``.
+    headers : :class:`bool`, optional
+        If ``True``, also yield the directory names found in ``path:``
+        header lines.
+
+    Returns
+    -------
+    iterable
+        :class:`~hpsspy.util.HpssFile` objects, and possibly :class:`str`.
+
+    Raises
+    ------
+    :class:`~hpsspy.HpssOSError`
+        If the underlying :command:`hsi` reports an error.
+    """
+    lines = iter(hsi_iter('ls', '-D' + options, path))
+    for first in lines:
+        if first.startswith('**'):
+            raise HpssOSError(''.join([first] + list(lines)))
+        break
+    else:
+        return
+    for f in _parse_ls(chain([first], lines), path, headers):
+        yield f
+
+
+def _parse_ls(lines, path, headers=False):
+    """Parse the output of :command:`hsi ls -D`.
+
+    Parameters
+    ----------
+    lines : iterable
+        Lines of output.  Line endings are ignored.
+    path : :class:`str`
+        The path that was listed.
+    headers : :class:`bool`, optional
+        If ``True``, also yield the directory names found in ``path:``
+        header lines, and yield an :class:`~hpsspy.HpssOSError` for every
+        error message, such as a directory that could not be read, in
+        the listing.
+
+    Returns
+    -------
+    iterable
+        :class:`~hpsspy.util.HpssFile` objects, and possibly :class:`str`
+        and :class:`~hpsspy.HpssOSError`.
+
+    Raises
+    ------
+    :class:`~hpsspy.HpssOSError`
+        If a line could not be parsed.
+    """
     lspath = path  # sometimes you don't get the path echoed back.
-    files = list()
+    error = None
     for f in lines:
+        f = f.rstrip('\n')
+        if error is not None:
+            #
+            # Error messages may continue on indented lines.
+            #
+            if f[:1].isspace() and f.strip():
+                error.append(f)
+                continue
+            yield HpssOSError('\n'.join(error))
+            error = None
         if len(f) == 0:
             continue
-        m = linere.match(f)
-        if m is None:
-            if f.endswith(':'):
-                lspath = f.strip(': ')
-            else:
+        if headers and f.startswith('*'):
+            error = [f]
+            continue
+        hpss_file = None
+        g = _split_line(f)
+        if g is not None:
+            try:
+                hpss_file = HpssFile(lspath, *g)
+            except ValueError:
+                pass
+        if hpss_file is None:
+            m = linere.match(f)
+            if m is None:
+                if f.endswith(':'):
+                    lspath = f.strip(': ')
+                    if headers:
+                        yield lspath
+                    continue
+                raise HpssOSError("Could not match line!\n{0}".format(f))
+            try:
+                hpss_file = HpssFile(lspath, *m.groups())
+            except ValueError:
                 raise HpssOSError("Could not match line!\n{0}".format(f))
+        yield hpss_file
+    if error is not None:
+        yield HpssOSError('\n'.join(error))
+    return
+
+
+def _split_line(line):
+    """Split one line of :command:`hsi ls -D` output without a regular
+    expression.
+
+    Parameters
+    ----------
+    line : :class:`str`
+        A line of output, without line ending.
+
+    Returns
+    -------
+    :func:`tuple`
+        The same values as the groups matched by `linere`, or ``None`` if
+        the line is not a simple file entry, in which case `linere` should
+        be used instead.
+
+    Notes
+    -----
+    Numeric fields and dates are not checked here, because
+    :class:`~hpsspy.util.HpssFile` raises :exc:`ValueError` if they are
+    invalid.
+    """
+    if line[0] not in 'dl-':
+        return None
+    fields = line.split(None, 10)
+    if len(fields) != 11:
+        return None
+    mode = fields[0]
+    #
+    # The name must be separated from the year by exactly one character,
+    # otherwise leading whitespace in the name would be lost.
+    #
+    if (len(mode) < 2 or mode[1:].strip('rwxsStT-') or
+            not line[-len(fields[10]) - 2].isdigit()):
+        return None
+    return (mode[0], mode[1:]) + tuple(fields[1:])
+
+
+def iterdir(path):
+    """Iterate over the contents of an HPSS directory.
+
+    This is equivalent to :func:`listdir`, except that the listing is
+    parsed as it is produced, rather than held in memory.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Directory to examine.
+
+    Returns
+    -------
+    iterable
+        :class:`~hpsspy.util.HpssFile` objects.
+
+    Raises
+    ------
+    :class:`~hpsspy.HpssOSError`
+        If the underlying :command:`hsi` reports an error.
+
+    Notes
+    -----
+    To identify htar files, files ending in ``.tar`` are held back until
+    every following file that shares their name as a prefix, which
+    includes any ``.tar.idx`` file, has been read.  This relies on
+    :command:`hsi ls` sorting its output by name.
+
+    Listings are shared with :func:`listdir` through
+    :data:`hpsspy.util.metadata_cache`, if it is enabled.  In that case
+    a complete listing is also held in memory, so it can be stored.
+    """
+    files = metadata_cache.get('listdir', path)
+    if files is not None:
+        for f in files:
+            yield f
+        return
+    if not metadata_cache.enabled:
+        for f in _iterdir(path):
+            yield f
+        return
+    files = list()
+    for f in _iterdir(path):
+        files.append(f)
+        yield f
+    metadata_cache.set('listdir', path, files)
+    return
+
+
+def _iterdir(path):
+    """Implement :func:`iterdir` without a cache.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Directory to examine.
+
+    Returns
+    -------
+    iterable
+        :class:`~hpsspy.util.HpssFile` objects.
+    """
+    held = list()
+    for f in _ils(path, options='a'):
+        if held and not f.name.startswith(held[0].name):
+            _mark_htar(held)
+            for h in held:
+                yield h
+            held = list()
+        if held or f.name.endswith('.tar'):
+            held.append(f)
         else:
-            g = m.groups()
-            files.append(HpssFile(lspath, *g))
-    return files
+            yield f
+    _mark_htar(held)
+    for h in held:
+        yield h
+    return
 
 
-def listdir(path):
+def scandir(path):
+    """Iterate over an HPSS directory, similar to :func:`os.scandir`.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Directory to examine.
+
+    Returns
+    -------
+    iterable
+        :class:`~hpsspy.util.HpssDirEntry` objects.
+
+    Raises
+    ------
+    :class:`~hpsspy.HpssOSError`
+        If the underlying :command:`hsi` reports an error.
+
+    Notes
+    -----
+    The entire directory is obtained with a single :command:`hsi ls`.
+    Unlike :func:`os.scandir`, the result is not a context manager.
+    """
+    for f in iterdir(path):
+        yield HpssDirEntry(f)
+    return
+
+
+def listdir(path, table=False):
     """List the contents of an HPSS directory, similar to :func:`os.listdir`.
 
     Parameters
     ----------
     path : :class:`str`
         Directory to examine.
+    table : :class:`bool`, optional
+        If ``True``, return a :class:`~hpsspy.util.HpssFileTable`.
 
     Returns
     -------
@@ -105,8 +353,32 @@ def listdir(path):
     ------
     :class:`~hpsspy.HpssOSError`
         If the underlying :command:`hsi` reports an error.
+
+    Notes
+    -----
+    Results are stored in :data:`hpsspy.util.metadata_cache`, if it is
+    enabled.
+    """
+    files = metadata_cache.get('listdir', path)
+    if files is None:
+        files = _ls(path, options='a')
+        _mark_htar(files)
+        metadata_cache.set('listdir', path, files)
+    if table:
+        t = HpssFileTable()
+        t.extend(files)
+        return t
+    return list(files)
+
+
+def _mark_htar(files):
+    """Identify htar files in the contents of a single directory.
+
+    Parameters
+    ----------
+    files : :class:`list`
+        A list of :class:`~hpsspy.util.HpssFile` objects.
     """
-    files = _ls(path, options='a')
     #
     # Create a unique set of filenames for use below.
     #
@@ -117,7 +389,7 @@ def listdir(path):
     for f in files:
         if f.name.endswith('.tar') and f.name + '.idx' in fileset:
             f.ishtar = True
-    return files
+    return
 
 
 def makedirs(path, mode=None):
@@ -144,6 +416,8 @@ def makedirs(path, mode=None):
         out = hsi('mkdir', '-p', path)
     else:
         out = hsi('mkdir', '-p', '-m', mode, path)
+    metadata_cache.invalidate(path, parents=True)
+    link_cache.invalidate(path, parents=True)
     if out.startswith('**'):
         raise HpssOSError(out)
     return
@@ -173,6 +447,8 @@ def mkdir(path, mode=None):
         out = hsi('mkdir', path)
     else:
         out = hsi('mkdir', '-m', mode, path)
+    metadata_cache.invalidate(path)
+    link_cache.invalidate(path)
     if out.startswith('**'):
         raise HpssOSError(out)
     return
@@ -198,14 +474,68 @@ def stat(path, follow_symlinks=True):
     ------
     :class:`~hpsspy.HpssOSError`
         If the underlying :command:`hsi ls` reports an error.
+
+    Notes
+    -----
+    Results are stored in :data:`hpsspy.util.metadata_cache`, if it is
+    enabled.
     """
-    files = _ls(path, options='d')
-    if len(files) != 1:
-        raise HpssOSError("Non-unique response for {0}!".format(path))
-    if files[0].islink and follow_symlinks:
-        return stat(files[0].readlink)
+    f = metadata_cache.get('stat', path)
+    if f is None:
+        files = _ls(path, options='d')
+        if len(files) != 1:
+            raise HpssOSError("Non-unique response for {0}!".format(path))
+        f = files[0]
+        metadata_cache.set('stat', path, f)
+    if f.islink and follow_symlinks:
+        return _follow(path, f)
     else:
-        return files[0]
+        return f
+
+
+def _follow(path, f):
+    """Resolve a chain of symbolic links.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Path to a symbolic link.
+    f : :class:`~hpsspy.util.HpssFile`
+        The metadata of the link itself.
+
+    Returns
+    -------
+    :class:`~hpsspy.util.HpssFile`
+        The metadata of the final target.
+
+    Raises
+    ------
+    :class:`~hpsspy.HpssOSError`
+        If the chain of links contains a cycle or is too long.
+
+    Notes
+    -----
+    Only the path to the final target, and whether it is a directory, are
+    stored in :data:`hpsspy.util.link_cache`, so the metadata of the
+    target itself is always obtained with :func:`stat`.
+    """
+    links = list()
+    new_links = list()
+    while f.islink:
+        links.append(normpath(path))
+        resolved = link_cache.get('link', path)
+        if resolved is None:
+            new_links.append(links[-1])
+            path = join(dirname(path), f.readlink)
+        else:
+            path = resolved[0]
+        if normpath(path) in links or len(links) > max_symlinks:
+            raise HpssOSError(("Too many levels of symbolic links: " +
+                               "{0}").format(links[0]))
+        f = stat(path, follow_symlinks=False)
+    for link in new_links:
+        link_cache.set('link', link, (normpath(path), f.isdir))
+    return f
 
 
 def lstat(path):
@@ -230,7 +560,52 @@ def lstat(path):
     return stat(path, follow_symlinks=False)
 
 
-def walk(top, topdown=True, onerror=None, followlinks=False):
+def lstat_many(paths, chunk=100):
+    """Perform :func:`lstat` on many HPSS paths at once.
+
+    Parameters
+    ----------
+    paths : iterable
+        Paths to files or directories.
+    chunk : :class:`int`, optional
+        Pass at most this many paths to each :command:`hsi ls`.
+
+    Returns
+    -------
+    :class:`dict`
+        A mapping of normalized path to :class:`~hpsspy.util.HpssFile`.
+        Paths that do not exist are omitted.
+
+    Raises
+    ------
+    :class:`~hpsspy.HpssOSError`
+        If the output of :command:`hsi` could not be parsed.
+    """
+    paths = list(paths)
+    result = dict()
+    for i in range(0, len(paths), chunk):
+        out = hsi('ls', '-Dd', *paths[i:i + chunk])
+        #
+        # Each file is preceded by a header naming its directory.  Errors
+        # about missing paths are interleaved with the listing, and may
+        # continue on indented lines.
+        #
+        lines = list()
+        error = False
+        for line in out.split('\n'):
+            if line.startswith('*'):
+                error = True
+            elif not (error and line[:1].isspace()):
+                error = False
+                lines.append(line)
+        for f in _parse_ls(lines, ''):
+            result[normpath(f.path)] = f
+            metadata_cache.set('stat', f.path, f)
+    return result
+
+
+def walk(top, topdown=True, onerror=None, followlinks=False,
+         recursive=False, pool=None, ordered=True):
     """Traverse a directory tree on HPSS, similar to :func:`os.walk`.
 
     Parameters
@@ -243,12 +618,36 @@ def walk(top, topdown=True, onerror=None, followlinks=False):
         Call this function if an error is detected.
     followlinks : :class:`bool`, optional
         If ``True`` symlinks to directories are treated as directories.
+    recursive : :class:`bool`, optional
+        If ``True``, obtain the entire tree with a single recursive
+        :command:`hsi ls` instead of listing every directory separately.
+    pool : :class:`~hpsspy.util.HsiPool`, optional
+        If set, traverse the tree breadth-first, listing many directories
+        concurrently in this pool.  Ignored if `recursive` is set.
+    ordered : :class:`bool`, optional
+        If ``False``, and `pool` is set, yield directories in the order
+        their listings complete, rather than in breadth-first order.
 
     Returns
     -------
     iterable
         This function can be used in the same way as :func:`os.walk`.
+
+    Notes
+    -----
+    In parallel mode, a bottom-up traversal only yields results once the
+    entire tree has been listed.  Do not call :func:`walk` with a `pool`
+    from a function that is itself running in that `pool`.
     """
+    if recursive:
+        for x in _walk_recursive(top, topdown, onerror, followlinks):
+            yield x
+        return
+    if pool is not None:
+        for x in _walk_parallel(top, topdown, onerror, followlinks, pool,
+                                ordered):
+            yield x
+        return
     #
     # We may not have read permission for top, in which case we can't
     # get a list of the files the directory contains.  os.path.walk
@@ -257,23 +656,317 @@ def walk(top, topdown=True, onerror=None, followlinks=False):
     # left to visit.  That logic is copied here.
     #
     try:
-        names = listdir(top)
+        dirs, nondirs = _scandir_split(top)
     except HpssOSError as err:
         if onerror is not None:
             onerror(err)
         return
-    dirs, nondirs = [], []
-    for name in names:
-        if name.isdir:
-            dirs.append(name)
-        else:
-            nondirs.append(name)
     if topdown:
         yield top, dirs, nondirs
     for name in dirs:
         new_path = join(top, str(name))
-        if followlinks or not islink(new_path):
+        #
+        # The listing already tells us whether name is a link.
+        #
+        if followlinks or not name.islink:
             for x in walk(new_path, topdown, onerror, followlinks):
                 yield x
     if not topdown:
         yield top, dirs, nondirs
+
+
+def _split(names):
+    """Separate directories from other files.
+
+    Parameters
+    ----------
+    names : iterable
+        :class:`~hpsspy.util.HpssFile` objects.
+
+    Returns
+    -------
+    :func:`tuple`
+        A list of directories and a list of other files.
+    """
+    dirs, nondirs = [], []
+    for name in names:
+        if name.isdir:
+            dirs.append(name)
+        else:
+            nondirs.append(name)
+    return (dirs, nondirs)
+
+
+def _scandir_split(path):
+    """Scan `path` and separate directories from other files.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Directory to examine.
+
+    Returns
+    -------
+    :func:`tuple`
+        A list of directories and a list of other files.
+    """
+    dirs, nondirs = [], []
+    for entry in scandir(path):
+        if entry.is_dir():
+            dirs.append(entry.stat(follow_symlinks=False))
+        else:
+            nondirs.append(entry.stat(follow_symlinks=False))
+    return (dirs, nondirs)
+
+
+def _walk_parallel(top, topdown, onerror, followlinks, pool, ordered):
+    """Implement :func:`walk` as a breadth-first traversal in a pool.
+
+    Parameters
+    ----------
+    top : :class:`str`
+        Starting directory.
+    topdown : :class:`bool`
+        Direction to traverse the directory tree.
+    onerror : callable
+        Call this function if an error is detected.
+    followlinks : :class:`bool`
+        If ``True`` symlinks to directories are treated as directories.
+    pool : :class:`~hpsspy.util.HsiPool`
+        Pool in which to list directories.
+    ordered : :class:`bool`
+        If ``True`` yield results in breadth-first order.
+
+    Returns
+    -------
+    iterable
+        Tuples of the same form as :func:`walk`.
+    """
+    #
+    # Listings are taken from pending in the order they were submitted,
+    # or from finished in the order they complete.
+    #
+    pending = deque()
+    finished = Queue()
+    outstanding = 0
+    paths = [top]
+    results = list()
+    while paths or outstanding:
+        for path in paths:
+            future = pool.submit(_scandir_split, path)
+            if ordered:
+                pending.append((future, path))
+            else:
+                future.add_done_callback(partial(_put_done, finished, path))
+            outstanding += 1
+        paths = list()
+        if ordered:
+            future, root = pending.popleft()
+        else:
+            future, root = finished.get()
+        outstanding -= 1
+        try:
+            dirs, nondirs = future.result()
+        except HpssOSError as err:
+            if onerror is not None:
+                onerror(err)
+            continue
+        if topdown:
+            yield root, dirs, nondirs
+        else:
+            results.append((root, dirs, nondirs))
+        #
+        # In topdown mode, this happens after the caller has had a chance
+        # to prune dirs.
+        #
+        for name in dirs:
+            if followlinks or not name.islink:
+                paths.append(join(root, str(name)))
+    #
+    # In breadth-first order every directory precedes its subdirectories.
+    #
+    for x in reversed(results):
+        yield x
+
+
+def _put_done(finished, path, future):
+    """Report a completed listing to :func:`_walk_parallel`.
+
+    Parameters
+    ----------
+    finished : :class:`queue.Queue`
+        Queue of completed listings.
+    path : :class:`str`
+        Directory that was listed.
+    future : :class:`concurrent.futures.Future`
+        The completed listing.
+    """
+    finished.put((future, path))
+
+
+def _iterblocks(path, options=''):
+    """Perform :command:`hsi ls` and group the results by directory.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Directory to examine.
+    options : :class:`str`, optional
+        Options to ``ls`` that will be appended to ``-D``.
+
+    Returns
+    -------
+    iterable
+        Tuples containing a directory name and a list of
+        :class:`~hpsspy.util.HpssFile` objects in that directory.  Only one
+        directory's contents are held in memory at a time.  If an error
+        is reported for a directory, the tuple contains the
+        :class:`~hpsspy.HpssOSError` instead of a list, and the directory
+        is not otherwise reported unless it contains files.
+
+    Raises
+    ------
+    :class:`~hpsspy.HpssOSError`
+        If the underlying :command:`hsi` reports an error for `path`
+        itself, or the output could not be parsed.
+    """
+    current = path
+    started = False
+    failed = False
+    files = list()
+    for f in _ils(path, options, headers=True):
+        if isinstance(f, str):
+            if files or (started and not failed):
+                yield current, files
+            current = f
+            started = True
+            failed = False
+            files = list()
+        elif isinstance(f, HpssOSError):
+            failed = True
+            yield current, f
+        else:
+            files.append(f)
+    if files or (started and not failed):
+        yield current, files
+    return
+
+
+def _walk_recursive(top, topdown, onerror, followlinks):
+    """Implement :func:`walk` using a single recursive listing of `top`.
+
+    Parameters
+    ----------
+    top : :class:`str`
+        Starting directory.
+    topdown : :class:`bool`
+        Direction to traverse the directory tree.
+    onerror : callable
+        Call this function if an error is detected.
+    followlinks : :class:`bool`
+        If ``True`` symlinks to directories are treated as directories.
+
+    Returns
+    -------
+    iterable
+        Tuples of the same form as :func:`walk`.
+
+    Notes
+    -----
+    In topdown mode, the listing is parsed as it is read, so only
+    a few directories are held in memory at a time. Bottom-up mode
+    requires the entire listing.
+    """
+    ntop = normpath(top)
+    first = None
+    #
+    # Map normalized directory names to the names that will be yielded.
+    #
+    expected = {ntop: top}
+    deferred = dict()
+    links = list()
+    listing = dict()
+    failed = set()
+
+    def _visit(ready):
+        while ready:
+            d, files = ready.pop(0)
+            if d not in expected:
+                #
+                # Either the parent has not been seen yet, or it
+                # was pruned by the caller.
+                #
+                deferred[d] = files
+                continue
+            root = expected.pop(d)
+            dirs, nondirs = _split(files)
+            yield root, dirs, nondirs
+            for name in dirs:
+                new_path = join(root, str(name))
+                if not name.islink:
+                    n = normpath(new_path)
+                    expected[n] = new_path
+                    if n in deferred:
+                        ready.append((n, deferred.pop(n)))
+                elif followlinks:
+                    links.append(new_path)
+
+    try:
+        for d, files in _iterblocks(top, options='aR'):
+            d = normpath(d)
+            if first is None:
+                first = d
+            if first != ntop and (d == first or d.startswith(first + '/')):
+                #
+                # hsi may report the resolved path of a symlinked top.
+                #
+                d = ntop + d[len(first):]
+            if isinstance(files, HpssOSError):
+                failed.add(d)
+                if onerror is not None:
+                    onerror(files)
+                continue
+            _mark_htar(files)
+            if not topdown:
+                listing[d] = files
+                continue
+            for x in _visit([(d, files)]):
+                yield x
+    except HpssOSError as err:
+        if onerror is not None:
+            onerror(err)
+        return
+    if topdown:
+        #
+        # Directories that did not appear in the listing are empty.
+        #
+        for d in sorted(expected):
+            if d not in failed:
+                yield expected[d], [], []
+        for new_path in links:
+            for x in _walk_recursive(new_path, topdown, onerror,
+                                     followlinks):
+                yield x
+        return
+
+    def _tree(root):
+        if normpath(root) in failed and normpath(root) not in listing:
+            return
+        dirs, nondirs = _split(listing.get(normpath(root), []))
+        for name in dirs:
+            new_path = join(root, str(name))
+            if not name.islink:
+                for x in _tree(new_path):
+                    yield x
+            elif followlinks:
+                #
+                # The contents of linked directories are not part of
+                # the recursive listing.
+                #
+                for x in _walk_recursive(new_path, topdown, onerror,
+                                         followlinks):
+                    yield x
+        yield root, dirs, nondirs
+
+    for x in _tree(top):
+        yield x
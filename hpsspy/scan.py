@@ -11,12 +11,20 @@ import json
 import logging
 import os
 import re
+import stat
 import sys
+import time
 from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from contextlib import closing
 from pkg_resources import resource_exists, resource_stream
-from . import __version__ as hpsspyVersion
-from .os import makedirs, walk
-from .util import get_tmpdir, hsi, htar
+from . import HpssOSError, __version__ as hpsspyVersion
+from .cache import load_cache, open_cache, read_cache, write_cache
+from .os import listdir, lstat_many, makedirs, walk
+from .util import (HsiBatch, HsiPool, HsiSession, get_tmpdir, htar,
+                   link_cache, metadata_cache)
 
 
 def validate_configuration(config):
@@ -99,6 +107,143 @@ def compile_map(old_map, section):
     return new_map
 
 
+def literal_prefix(pattern):
+    """Find the literal text that must begin any match of a regular expression.
+
+    Parameters
+    ----------
+    pattern : :class:`str`
+        A regular expression, as passed to :func:`re.compile`.
+
+    Returns
+    -------
+    :class:`str`
+        The longest literal prefix that can be determined without fully
+        parsing `pattern`.  This may be shorter than the true prefix, and is
+        empty if `pattern` contains a top-level alternation.
+    """
+    depth = 0
+    in_class = False
+    escaped = False
+    for c in pattern:
+        if escaped:
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif in_class:
+            in_class = c != ']'
+        elif c == '[':
+            in_class = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return ''
+    prefix = list()
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                break
+            c = pattern[i + 1]
+            i += 2
+        elif c in '.^$*+?{}[]|()':
+            break
+        else:
+            i += 1
+        if i < len(pattern) and pattern[i] in '*?{':
+            break
+        prefix.append(c)
+        if i < len(pattern) and pattern[i] == '+':
+            break
+    return ''.join(prefix)
+
+
+class PatternDispatcher(object):
+    """Find the patterns of one section that match a file name.
+
+    Patterns are indexed in a trie by their literal prefix, so only
+    patterns that can possibly match are actually tried.  The candidates
+    for a file name only depend on as many characters as the longest
+    literal prefix, so they are cached by those characters.
+
+    Parameters
+    ----------
+    patterns : :func:`tuple`
+        Tuples of compiled regular expression and replacement, as returned
+        by :func:`compile_map` for one section.
+    maxsize : :class:`int`, optional
+        Maximum number of cached candidate lists.
+    """
+    def __init__(self, patterns, maxsize=10000):
+        self.patterns = patterns
+        self.maxsize = maxsize
+        self._trie = (dict(), list())
+        self._depth = 0
+        self._cache = dict()
+        for k, r in enumerate(patterns):
+            node = self._trie
+            prefix = literal_prefix(r[0].pattern)
+            self._depth = max(self._depth, len(prefix))
+            for c in prefix:
+                if c not in node[0]:
+                    node[0][c] = (dict(), list())
+                node = node[0][c]
+            node[1].append(k)
+
+    def candidates(self, name):
+        """Find patterns whose literal prefix matches `name`.
+
+        Parameters
+        ----------
+        name : :class:`str`
+            A file name.
+
+        Returns
+        -------
+        :func:`tuple`
+            Indexes of candidate patterns, in their original order.
+        """
+        key = name[:self._depth]
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        node = self._trie
+        found = list(node[1])
+        for c in key:
+            try:
+                node = node[0][c]
+            except KeyError:
+                break
+            found += node[1]
+        found = tuple(sorted(found))
+        if len(self._cache) >= self.maxsize:
+            self._cache.clear()
+        self._cache[key] = found
+        return found
+
+    def match(self, name):
+        """Find all patterns that match `name`.
+
+        Parameters
+        ----------
+        name : :class:`str`
+            A file name.
+
+        Returns
+        -------
+        :class:`list`
+            Tuples of compiled regular expression and replacement, in
+            their original order.
+        """
+        patterns = self.patterns
+        return [patterns[k] for k in self.candidates(name)
+                if patterns[k][0].match(name) is not None]
+
+
 def files_to_hpss(hpss_map_cache, section):
     """Create a map of files on disk to HPSS files.
 
@@ -147,7 +292,7 @@ def files_to_hpss(hpss_map_cache, section):
 
 
 def find_missing(hpss_map, hpss_files, disk_files_cache, missing_files,
-                 report=10000, limit=1024.0):
+                 report=10000, limit=1024.0, processes=1, chunksize=100000):
     """Compare HPSS files to disk files.
 
     Parameters
@@ -164,106 +309,48 @@ def find_missing(hpss_map, hpss_files, disk_files_cache, missing_files,
         Print an informational message when N files have been scanned.
     limit : :class:`float`, optional
         HPSS archive files should be smaller than this size (in GB).
+    processes : :class:`int`, optional
+        If greater than 1, compare files with this many processes.
+    chunksize : :class:`int`, optional
+        When using several `processes`, send this many files to each
+        process at a time.
 
     Returns
     -------
     :class:`bool`
         ``True`` if no serious problems were found.
+
+    Notes
+    -----
+    With several `processes`, the disk cache is split into chunks of
+    consecutive files.  Log messages from each chunk are recorded, and
+    replayed as the results of each chunk are merged, in order, so the
+    output is the same as with a single process.
     """
     logger = logging.getLogger(__name__ + '.find_missing')
+    log = _ChunkLog(logger)
     nfiles = 0
     nmissing = 0
     nmultiple = 0
     backups = dict()
     pattern_used = dict()
-    section_warning = set()
-    with open(disk_files_cache, newline='') as t:
-        reader = csv.DictReader(t)
-        for row in reader:
-            f = row['Name']
-            nfiles += 1
-            if (nfiles % report) == 0:
-                logger.info("%9d files scanned.", nfiles)
-            if f in hpss_map["__exclude__"]:
-                logger.info("%s is excluded.", f)
-                continue
-            section = f.split('/')[0]
-            if section == f:
-                #
-                # Top-level section containing no subdirectories.
-                #
-                section = '__top__'
-            try:
-                s = hpss_map[section]
-            except KeyError:
-                #
-                # If the section is not described, that's not
-                # good, but continue.
-                #
-                if section not in section_warning:
-                    section_warning.add(section)
-                    logger.warning("Directory %s is not " +
-                                   "described in the configuration!",
-                                   section)
-                continue
-            if not s:
-                #
-                # If the section is blank, that's OK.
-                #
-                if section not in section_warning:
-                    section_warning.add(section)
-                    logger.warning("Directory %s is not configured!", section)
-                continue
-            #
-            # Now check if it is mapped.
-            #
-            mapped = 0
-            for r in s:
-                if r[0].pattern not in pattern_used:
-                    pattern_used[r[0].pattern] = 0
-                m = r[0].match(f)
-                if m is not None:
-                    logger.debug("pattern_used[r'%s'] += 1", r[0].pattern)
-                    logger.debug("r[1] = r'%s'", r[1])
-                    pattern_used[r[0].pattern] += 1
-                    mapped += 1
-                    if r[1] == "EXCLUDE":
-                        logger.debug("%s is excluded from backups.", f)
-                    elif r[1] == "AUTOMATED":
-                        logger.debug("%s is backed up by some other " +
-                                     "automated process.", f)
-                    else:
-                        reName = r[0].sub(r[1], f)
-                        logger.debug("%s in %s.", f, reName)
-                        exists = reName in hpss_files
-                        if exists:
-                            newer = int(row['Mtime']) > hpss_files[reName][1]
-                        else:
-                            newer = False
-                        if newer:
-                            logger.warning("%s is newer than %s, " +
-                                           "marking as missing!",
-                                           f, reName)
-                        if reName in backups:
-                            backups[reName]['files'].append(f)
-                            backups[reName]['size'] += int(row['Size'])
-                            #
-                            # 'newer' can change from False to True, but
-                            # it should never change back to False.
-                            #
-                            if newer:
-                                backups[reName]['newer'] = newer
-                        else:
-                            backups[reName] = {'files': [f],
-                                               'size': int(row['Size']),
-                                               'newer': newer,
-                                               'exists': exists}
-            if mapped == 0:
-                logger.error("%s is not mapped to any file on HPSS!", f)
-                nmissing += 1
-            if mapped > 1:
-                logger.error("%s is mapped to multiple files on HPSS!", f)
-                nmultiple += 1
+    with closing(read_cache(disk_files_cache)) as reader:
+        if processes > 1:
+            results = _find_missing_parallel(hpss_map, hpss_files, reader,
+                                             report, processes, chunksize,
+                                             logger.getEffectiveLevel())
+        else:
+            results = [_find_missing_chunk(hpss_map, hpss_files, reader, 0,
+                                           report, log, dict())]
+        for result in results:
+            if processes > 1:
+                log.replay(result[5])
+            nfiles += result[0]
+            nmissing += result[1]
+            nmultiple += result[2]
+            _merge_backups(backups, result[3])
+            for p in result[4]:
+                pattern_used[p] = pattern_used.get(p, 0) + result[4][p]
     for p in pattern_used:
         if pattern_used[p] == 0:
             logger.info("Pattern '%s' was never used, " +
@@ -300,6 +387,286 @@ def find_missing(hpss_map, hpss_files, disk_files_cache, missing_files,
     return (nmissing == 0) and (nmultiple == 0)
 
 
+class _ChunkLog(object):
+    """Log messages from :func:`find_missing`, or record them for replay.
+
+    Parameters
+    ----------
+    logger : :class:`logging.Logger`, optional
+        Log messages here.  If not set, record them instead.
+    level : :class:`int`, optional
+        When recording, ignore messages below this level.
+    """
+    def __init__(self, logger=None, level=logging.NOTSET):
+        self.logger = logger
+        self.level = level
+        self.records = list()
+        self._once = set()
+
+    def log(self, level, msg, *args, once=None):
+        """Log or record a message.
+
+        Parameters
+        ----------
+        level : :class:`int`
+            Logging level.
+        msg : :class:`str`
+            Message, with ``%`` formatting.
+        args : :class:`tuple`
+            Message arguments.
+        once : :class:`str`, optional
+            If set, only log the first message with this key.
+        """
+        if once is not None:
+            if once in self._once:
+                return
+            self._once.add(once)
+        if self.logger is None:
+            if level >= self.level:
+                self.records.append((level, msg, args, once))
+        else:
+            self.logger.log(level, msg, *args)
+
+    def replay(self, records):
+        """Log messages that were previously recorded.
+
+        Parameters
+        ----------
+        records : :class:`list`
+            Messages recorded by another :class:`_ChunkLog`.
+        """
+        for level, msg, args, once in records:
+            self.log(level, msg, *args, once=once)
+
+
+def _find_missing_chunk(hpss_map, hpss_files, rows, start, report, log,
+                        dispatchers):
+    """Compare a consecutive set of disk files to HPSS files.
+
+    Parameters
+    ----------
+    hpss_map : :class:`dict`
+        A mapping of file names to HPSS files.
+    hpss_files : :class:`dict`
+        The list of actual HPSS files.
+    rows : iterable
+        Rows of the disk cache.
+    start : :class:`int`
+        Number of files that precede `rows`.
+    report : :class:`int`
+        Print an informational message when N files have been scanned.
+    log : :class:`_ChunkLog`
+        Log messages here.
+    dispatchers : :class:`dict`
+        :class:`PatternDispatcher` objects for each section, which will be
+        added if necessary.
+
+    Returns
+    -------
+    :func:`tuple`
+        The number of files, unmapped files and multiply-mapped files,
+        followed by the backups and pattern usage found in `rows`.
+    """
+    nfiles = 0
+    nmissing = 0
+    nmultiple = 0
+    backups = dict()
+    pattern_used = dict()
+    sections = set()
+    for row in rows:
+        f = row[0]
+        if f.endswith('/'):
+            #
+            # Directories are only used by incremental scans.
+            #
+            continue
+        nfiles += 1
+        if ((start + nfiles) % report) == 0:
+            log.log(logging.INFO, "%9d files scanned.", start + nfiles)
+        if f in hpss_map["__exclude__"]:
+            log.log(logging.INFO, "%s is excluded.", f)
+            continue
+        section = f.split('/')[0]
+        if section == f:
+            #
+            # Top-level section containing no subdirectories.
+            #
+            section = '__top__'
+        try:
+            s = hpss_map[section]
+        except KeyError:
+            #
+            # If the section is not described, that's not
+            # good, but continue.
+            #
+            log.log(logging.WARNING, "Directory %s is not " +
+                    "described in the configuration!", section,
+                    once=section)
+            continue
+        if not s:
+            #
+            # If the section is blank, that's OK.
+            #
+            log.log(logging.WARNING, "Directory %s is not configured!",
+                    section, once=section)
+            continue
+        if section not in dispatchers:
+            dispatchers[section] = PatternDispatcher(s)
+        if section not in sections:
+            sections.add(section)
+            for r in s:
+                if r[0].pattern not in pattern_used:
+                    pattern_used[r[0].pattern] = 0
+        #
+        # Now check if it is mapped.
+        #
+        mapped = 0
+        for r in dispatchers[section].match(f):
+            log.log(logging.DEBUG, "pattern_used[r'%s'] += 1", r[0].pattern)
+            log.log(logging.DEBUG, "r[1] = r'%s'", r[1])
+            pattern_used[r[0].pattern] += 1
+            mapped += 1
+            if r[1] == "EXCLUDE":
+                log.log(logging.DEBUG, "%s is excluded from backups.", f)
+            elif r[1] == "AUTOMATED":
+                log.log(logging.DEBUG, "%s is backed up by some other " +
+                        "automated process.", f)
+            else:
+                reName = r[0].sub(r[1], f)
+                log.log(logging.DEBUG, "%s in %s.", f, reName)
+                exists = reName in hpss_files
+                if exists:
+                    newer = int(row[2]) > hpss_files[reName][1]
+                else:
+                    newer = False
+                if newer:
+                    log.log(logging.WARNING, "%s is newer than %s, " +
+                            "marking as missing!", f, reName)
+                _merge_backups(backups, {reName: {'files': [f],
+                                                  'size': int(row[1]),
+                                                  'newer': newer,
+                                                  'exists': exists}})
+        if mapped == 0:
+            log.log(logging.ERROR, "%s is not mapped to any file on HPSS!", f)
+            nmissing += 1
+        if mapped > 1:
+            log.log(logging.ERROR, "%s is mapped to multiple files on HPSS!",
+                    f)
+            nmultiple += 1
+    return (nfiles, nmissing, nmultiple, backups, pattern_used)
+
+
+def _merge_backups(backups, new_backups):
+    """Add backups found in later files to `backups`.
+
+    Parameters
+    ----------
+    backups : :class:`dict`
+        Backups found so far.  This is modified in place.
+    new_backups : :class:`dict`
+        Backups found in later files.
+    """
+    for reName, v in new_backups.items():
+        if reName in backups:
+            backups[reName]['files'] += v['files']
+            backups[reName]['size'] += v['size']
+            #
+            # 'newer' can change from False to True, but
+            # it should never change back to False.
+            #
+            if v['newer']:
+                backups[reName]['newer'] = True
+        else:
+            backups[reName] = v
+    return
+
+
+#
+# Data shared by all chunks processed by one process.
+#
+_find_missing_state = dict()
+
+
+def _find_missing_init(hpss_map, hpss_files, report, level):
+    """Initialize a process used by :func:`find_missing`.
+    """
+    _find_missing_state['hpss_map'] = hpss_map
+    _find_missing_state['hpss_files'] = hpss_files
+    _find_missing_state['report'] = report
+    _find_missing_state['level'] = level
+    _find_missing_state['dispatchers'] = dict()
+
+
+def _find_missing_worker(start, rows):
+    """Process one chunk of the disk cache in a separate process.
+
+    Returns
+    -------
+    :func:`tuple`
+        The value returned by :func:`_find_missing_chunk`, followed by
+        the recorded log messages.
+    """
+    log = _ChunkLog(level=_find_missing_state['level'])
+    result = _find_missing_chunk(_find_missing_state['hpss_map'],
+                                 _find_missing_state['hpss_files'],
+                                 rows, start, _find_missing_state['report'],
+                                 log, _find_missing_state['dispatchers'])
+    return result + (log.records,)
+
+
+def _find_missing_parallel(hpss_map, hpss_files, reader, report, processes,
+                           chunksize, level):
+    """Compare disk files to HPSS files with a pool of processes.
+
+    Chunks of the disk cache are read as earlier chunks are completed,
+    so only a few chunks are in memory at any time.
+
+    Parameters
+    ----------
+    hpss_map : :class:`dict`
+        A mapping of file names to HPSS files.
+    hpss_files : :class:`dict`
+        The list of actual HPSS files.
+    reader : iterable
+        Rows of the disk cache.
+    report : :class:`int`
+        Print an informational message when N files have been scanned.
+    processes : :class:`int`
+        Number of processes.
+    chunksize : :class:`int`
+        Number of files in each chunk.
+    level : :class:`int`
+        Ignore log messages below this level.
+
+    Yields
+    ------
+    :func:`tuple`
+        The results of each chunk, in order.
+    """
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_find_missing_init,
+                             initargs=(hpss_map, hpss_files, report,
+                                       level)) as executor:
+        pending = deque()
+        start = 0
+        rows = list()
+        for row in reader:
+            if row[0].endswith('/'):
+                continue
+            rows.append(row)
+            if len(rows) == chunksize:
+                pending.append(executor.submit(_find_missing_worker,
+                                               start, rows))
+                start += len(rows)
+                rows = list()
+                if len(pending) >= 2*processes:
+                    yield pending.popleft().result()
+        if rows:
+            pending.append(executor.submit(_find_missing_worker, start, rows))
+        while pending:
+            yield pending.popleft().result()
+
+
 def process_missing(missing_cache, disk_root, hpss_root, dirmode='2770',
                     test=False):
     """Convert missing files into HPSS commands.
@@ -322,6 +689,8 @@ def process_missing(missing_cache, disk_root, hpss_root, dirmode='2770',
     with open(missing_cache) as fp:
         missing = json.load(fp)
     created_directories = set()
+    batched_directories = set()
+    batch = HsiBatch()
     start_directory = os.getcwd()
     for h in missing:
         h_file = os.path.join(hpss_root, h)
@@ -392,6 +761,10 @@ def process_missing(missing_cache, disk_root, hpss_root, dirmode='2770',
                 else:
                     out, err = htar('-cvf', h_file, '-H', 'crc:verify=all',
                                     '-L', Lfile)
+            metadata_cache.invalidate(h_file)
+            metadata_cache.invalidate(h_file + '.idx')
+            link_cache.invalidate(h_file)
+            link_cache.invalidate(h_file + '.idx')
             logger.debug(out)
             if err:
                 logger.warning(err)
@@ -400,22 +773,32 @@ def process_missing(missing_cache, disk_root, hpss_root, dirmode='2770',
                 if not test:
                     os.remove(Lfile)
         else:
+            #
+            # Single files are collected and sent in one batch at the end.
+            #
             d_h_file = os.path.dirname(h_file)
-            if d_h_file not in created_directories:
+            if (d_h_file not in created_directories and
+                    d_h_file not in batched_directories):
                 logger.debug("makedirs('%s', mode='%s')", d_h_file, dirmode)
                 if not test:
-                    makedirs(d_h_file, mode=dirmode)
-                created_directories.add(d_h_file)
+                    batch.makedirs(d_h_file, mode=dirmode)
+                batched_directories.add(d_h_file)
             logger.info("hsi('put', '%s', ':', '%s')",
                         os.path.join(disk_root, missing[h]['files'][0]),
                         h_file)
             if test:
-                out = "Test mode, skipping hsi command."
+                logger.debug("Test mode, skipping hsi command.")
             else:
-                out = hsi('put',
-                          os.path.join(disk_root, missing[h]['files'][0]),
-                          ':', h_file)
-            logger.debug(out)
+                batch.put(os.path.join(disk_root, missing[h]['files'][0]),
+                          h_file)
+    if len(batch) > 0:
+        logger.debug("Running %d batched hsi commands.", len(batch))
+        for result in batch.run():
+            if result.ok:
+                logger.debug(result.output)
+            else:
+                logger.error("hsi('%s') failed!", "', '".join(result.command))
+                logger.error(result.output)
     logger.debug("os.chdir('%s')", start_directory)
     os.chdir(start_directory)
     return
@@ -474,7 +857,8 @@ def iterrsplit(s, c):
     return
 
 
-def scan_disk(disk_roots, disk_files_cache, overwrite=False):
+def scan_disk(disk_roots, disk_files_cache, overwrite=False,
+              incremental=False, workers=1):
     """Scan a directory tree on disk and cache the files found there.
 
     Parameters
@@ -485,52 +869,361 @@ def scan_disk(disk_roots, disk_files_cache, overwrite=False):
         Name of a file to hold the cache.
     overwrite : :class:`bool`, optional
         If ``True``, ignore any existing cache files.
+    incremental : :class:`bool`, optional
+        If ``True``, update an existing cache, only examining files in
+        directories whose modification time has changed.
+    workers : :class:`int`, optional
+        If greater than 1, scan directories, in all of `disk_roots`, with
+        this many concurrent threads.
 
     Returns
     -------
     :class:`bool`
         Returns ``True`` if the cache is populated and ready to read.
+
+    Notes
+    -----
+    The cache contains a row for every directory, with a trailing ``/`` on
+    the name and the directory modification time.  Each of `disk_roots` is
+    recorded as an absolute path, followed by the contents of that root.
+    These rows are used by `incremental` scans, and are otherwise
+    ignored.
+
+    Modifying a file in place does not change the modification time of
+    its directory, so `incremental` scans only detect files that have been
+    added, removed or renamed.
     """
     logger = logging.getLogger(__name__ + '.scan_disk')
-    if os.path.exists(disk_files_cache) and not overwrite:
+    if os.path.exists(disk_files_cache) and not (overwrite or incremental):
         logger.debug("Using existing file cache: %s", disk_files_cache)
         return True
+    previous = dict()
+    if incremental and os.path.exists(disk_files_cache):
+        logger.info("Updating disk cache file %s.", disk_files_cache)
+        previous = _read_disk_cache(disk_files_cache)
     else:
         logger.info("No disk cache file, starting scan.")
-        with open(disk_files_cache, 'w', newline='') as t:
-            writer = csv.writer(t)
-            writer.writerow(['Name', 'Size', 'Mtime'])
+    #
+    # Never leave an incomplete cache where it could be reused.
+    #
+    cache = disk_files_cache + '.tmp'
+    try:
+        status = _scan_disk_roots(disk_roots, cache, previous, workers)
+    except BaseException:
+        if os.path.exists(cache):
+            os.remove(cache)
+        raise
+    if status:
+        os.replace(cache, disk_files_cache)
+    else:
+        os.remove(cache)
+    return status
+
+
+def _scan_disk_roots(disk_roots, cache, previous, workers):
+    """Scan every root on disk and write the cache.
+
+    Parameters
+    ----------
+    disk_roots : :class:`list`
+        Name(s) of a directory in which to start the scan.
+    cache : :class:`str`
+        Name of the cache file to write.
+    previous : :class:`dict`
+        The old cache, as returned by :func:`_read_disk_cache`.
+    workers : :class:`int`
+        Number of threads.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if all directories were scanned.
+    """
+    logger = logging.getLogger(__name__ + '.scan_disk')
+    with write_cache(cache) as writer:
+        if workers > 1:
+            status = _scan_disk_parallel(disk_roots, writer, cache, previous,
+                                         workers)
+        else:
+            status = True
             for disk_root in disk_roots:
-                logger.debug("Starting os.walk at %s.", disk_root)
+                writer.writerow([disk_root + '/', 0, 0])
                 try:
-                    for root, dirs, files in os.walk(disk_root):
-                        logger.debug("Scanning disk directory %s.", root)
-                        for f in files:
-                            fullname = os.path.join(root, f)
-                            if not os.path.islink(fullname):
-                                cachename = fullname.replace(disk_root+'/', '')
-                                try:
-                                    s = os.stat(fullname)
-                                except PermissionError as perr:
-                                    logger.error("%s: %s",
-                                                 perr.strerror, perr.filename)
-                                    continue
-                                try:
-                                    writer.writerow([cachename,
-                                                     s.st_size,
-                                                     int(s.st_mtime)])
-                                except UnicodeEncodeError as e:
-                                    logger.error("Could not write %s to cache file due to unusual characters!",
-                                                 fullname.encode(errors='surrogatepass'))
-                                    logger.error("Message was: %s.", str(e))
+                    _scan_disk_tree(disk_root, writer,
+                                    *previous.get(disk_root, (dict(), dict())))
                 except OSError as oerr:
                     logger.error('Exception encountered while traversing %s!', disk_root)
                     logger.error(oerr.strerror)
-                    return False
+                    status = False
+                    break
+    return status
+
+
+def _write_disk_row(writer, disk_root, row):
+    """Write one row of the disk cache.
+
+    Parameters
+    ----------
+    writer : :class:`csv.writer`
+        Cache file.
+    disk_root : :class:`str`
+        Directory containing the file, used in error messages.
+    row : :class:`list`
+        Name, size and modification time.
+    """
+    try:
+        writer.writerow(row)
+    except UnicodeEncodeError as e:
+        logger = logging.getLogger(__name__ + '.scan_disk')
+        fullname = os.path.join(disk_root, row[0])
+        logger.error("Could not write %s to cache file due to unusual characters!",
+                     fullname.encode(errors='surrogatepass'))
+        logger.error("Message was: %s.", str(e))
+    return
+
+
+def _read_disk_cache(disk_files_cache):
+    """Read a disk cache, organized by root and directory.
+
+    Parameters
+    ----------
+    disk_files_cache : :class:`str`
+        Name of the cache file.
+
+    Returns
+    -------
+    :class:`dict`
+        A mapping of each root to a :class:`dict` of directory modification
+        times and a :class:`dict` of the rows each directory contains.
+        Directory names are relative to the root, which is ``''``.
+        Rows that precede the first root are ignored.
+    """
+    roots = dict()
+    directories = contents = None
+    for row in read_cache(disk_files_cache):
+        name = row[0]
+        if name.startswith('/') and name.endswith('/'):
+            directories = dict()
+            contents = dict()
+            roots[name[:-1]] = (directories, contents)
+            continue
+        if directories is None:
+            continue
+        if name.endswith('/'):
+            name = name[:-1]
+            if name in directories:
+                #
+                # A directory that could not be read.
+                #
+                directories[name] = row[2]
+                continue
+            directories[name] = row[2]
+        parent = os.path.dirname(name)
+        if parent not in contents:
+            contents[parent] = list()
+        contents[parent].append(row)
+    return roots
+
+
+def _scan_disk_tree(disk_root, writer, directories, contents):
+    """Scan one root on disk, breadth-first.
+
+    Parameters
+    ----------
+    disk_root : :class:`str`
+        Name of a directory in which to start the scan.
+    writer : :class:`csv.writer`
+        New cache file.
+    directories : :class:`dict`
+        Modification times of directories in the old cache, which may
+        be empty.
+    contents : :class:`dict`
+        Rows of the old cache, grouped by directory.
+
+    Raises
+    ------
+    OSError
+        If an unchanged subdirectory could not be examined.
+    """
+    logger = logging.getLogger(__name__ + '.scan_disk')
+    logger.debug("Starting scan at %s.", disk_root)
+    queue = deque([('', True)])
+    while queue:
+        r, changed = queue.popleft()
+        rows, subdirectories = _scan_disk_directory(disk_root, r, changed,
+                                                    directories, contents)
+        for row in rows:
+            _write_disk_row(writer, disk_root, row)
+        queue.extend(subdirectories)
+    return
+
+
+def _scan_disk_parallel(disk_roots, writer, cache, previous, workers):
+    """Scan several roots on disk, listing directories concurrently.
+
+    Each root is written to a separate temporary CSV file, compressed
+    like `cache`, and these are copied to `writer` in the order of
+    `disk_roots`, once all directories have been scanned.
+
+    Parameters
+    ----------
+    disk_roots : :class:`list`
+        Name(s) of a directory in which to start the scan.
+    writer : :class:`csv.writer`
+        Cache file.
+    cache : :class:`str`
+        Name of the cache file, used to name the temporary files.
+    previous : :class:`dict`
+        The old cache, as returned by :func:`_read_disk_cache`.
+    workers : :class:`int`
+        Number of threads.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if all directories were scanned.
+    """
+    logger = logging.getLogger(__name__ + '.scan_disk')
+    #
+    # Keep the compression extension, so that the temporary files are
+    # compressed the same way as the cache.
+    #
+    base, extension = os.path.splitext(cache[:-4] if cache.endswith('.tmp')
+                                       else cache)
+    parts = ['{0}.{1:d}{2}.tmp'.format(base, i, extension)
+             for i in range(len(disk_roots))]
+    files = [open_cache(p, 'w') for p in parts]
+    try:
+        writers = [csv.writer(f) for f in files]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = dict()
+            for i, disk_root in enumerate(disk_roots):
+                writers[i].writerow([disk_root + '/', 0, 0])
+                logger.debug("Starting scan at %s.", disk_root)
+                directories, contents = previous.get(disk_root,
+                                                     (dict(), dict()))
+                f = executor.submit(_scan_disk_directory, disk_root, '', True,
+                                    directories, contents)
+                pending[f] = (i, directories, contents)
+            while pending:
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    i, directories, contents = pending.pop(f)
+                    disk_root = disk_roots[i]
+                    try:
+                        rows, subdirectories = f.result()
+                    except OSError as oerr:
+                        for p in pending:
+                            p.cancel()
+                        logger.error('Exception encountered while traversing %s!', disk_root)
+                        logger.error(oerr.strerror)
+                        return False
+                    for row in rows:
+                        _write_disk_row(writers[i], disk_root, row)
+                    for r, changed in subdirectories:
+                        f = executor.submit(_scan_disk_directory, disk_root,
+                                            r, changed, directories, contents)
+                        pending[f] = (i, directories, contents)
+        for f, p in zip(files, parts):
+            f.close()
+            with open_cache(p) as t:
+                for row in csv.reader(t):
+                    writer.writerow(row)
+    finally:
+        for f, p in zip(files, parts):
+            f.close()
+            os.remove(p)
     return True
 
 
-def scan_hpss(hpss_root, hpss_files_cache, overwrite=False):
+def _scan_disk_directory(disk_root, r, changed, directories, contents):
+    """Scan one directory on disk with :func:`os.scandir`.
+
+    The type, size and modification time of each entry are obtained
+    from the entry itself, with at most one :func:`os.lstat` call per entry.
+    If the directory is unchanged, its rows are copied from `contents`,
+    and only its subdirectories are examined.
+
+    Parameters
+    ----------
+    disk_root : :class:`str`
+        Name of the root directory.
+    r : :class:`str`
+        Name of the directory, relative to `disk_root`.
+    changed : :class:`bool`
+        ``True`` if the modification time of the directory differs from
+        `directories`.
+    directories : :class:`dict`
+        Modification times of directories in the old cache, which may
+        be empty.
+    contents : :class:`dict`
+        Rows of the old cache, grouped by directory.
+
+    Returns
+    -------
+    :func:`tuple`
+        A tuple containing the rows of the new cache and a list of
+        subdirectories to scan, with a flag indicating whether they
+        have changed.  If the directory could not be read, the error is
+        logged and the rows end with the directory itself, with a
+        modification time of zero.
+    """
+    logger = logging.getLogger(__name__ + '.scan_disk')
+    rows = list()
+    subdirectories = list()
+    path = os.path.join(disk_root, r) if r else disk_root
+    if not changed:
+        logger.debug("Reusing cache for disk directory %s.", path)
+        for row in contents.get(r, []):
+            if not row[0].endswith('/'):
+                rows.append(row)
+                continue
+            d = row[0][:-1]
+            try:
+                s = os.lstat(os.path.join(disk_root, d))
+            except FileNotFoundError:
+                continue
+            except PermissionError as perr:
+                logger.error("%s: %s", perr.strerror, perr.filename)
+                continue
+            if stat.S_ISDIR(s.st_mode):
+                rows.append([row[0], 0, int(s.st_mtime)])
+                subdirectories.append((d, directories.get(d) !=
+                                       int(s.st_mtime)))
+        return (rows, subdirectories)
+    logger.debug("Scanning disk directory %s.", path)
+    prefix = r + '/' if r else ''
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_symlink():
+                    continue
+                cachename = prefix + entry.name
+                try:
+                    s = entry.stat(follow_symlinks=False)
+                except PermissionError as perr:
+                    logger.error("%s: %s", perr.strerror, perr.filename)
+                    continue
+                if stat.S_ISDIR(s.st_mode):
+                    rows.append([cachename + '/', 0, int(s.st_mtime)])
+                    subdirectories.append((cachename,
+                                           directories.get(cachename) !=
+                                           int(s.st_mtime)))
+                else:
+                    rows.append([cachename, s.st_size, int(s.st_mtime)])
+    except OSError as oerr:
+        #
+        # Skip the directory, like os.walk.  Recording a modification
+        # time of zero ensures that the next incremental scan tries again.
+        #
+        logger.error("%s: %s", oerr.strerror, oerr.filename)
+        if r:
+            rows.append([prefix, 0, 0])
+    return (rows, subdirectories)
+
+
+def scan_hpss(hpss_root, hpss_files_cache, overwrite=False, recursive=False,
+              pool=None, incremental=False):
     """Scan a directory on HPSS and return the files found there.
 
     Parameters
@@ -541,35 +1234,212 @@ def scan_hpss(hpss_root, hpss_files_cache, overwrite=False):
         Name of a file to hold the cache.
     overwrite : :class:`bool`, optional
         If ``True``, ignore any existing cache files.
+    recursive : :class:`bool`, optional
+        If ``True``, list the entire tree with a single recursive
+        :command:`hsi ls`.
+    pool : :class:`~hpsspy.util.HsiPool`, optional
+        If set, list directories concurrently in this pool.
+    incremental : :class:`bool`, optional
+        If ``True``, update an existing cache, only listing directories
+        whose modification time has changed.
 
     Returns
     -------
     :class:`dict`
         The set of files found on HPSS, with size and modification time.
+
+    Notes
+    -----
+    The cache contains a row for every directory below `hpss_root`, with
+    a trailing ``/`` on the name and the directory modification time.
+    These rows are used by `incremental` scans, and are otherwise
+    ignored.
     """
     logger = logging.getLogger(__name__ + '.scan_hpss')
     hpss_files = dict()
-    if os.path.exists(hpss_files_cache) and not overwrite:
+    if os.path.exists(hpss_files_cache) and not (overwrite or incremental):
         logger.info("Found cache file %s.", hpss_files_cache)
-        with open(hpss_files_cache, newline='') as t:
-            reader = csv.DictReader(t)
-            for row in reader:
-                hpss_files[row['Name']] = (int(row['Size']), int(row['Mtime']))
+        hpss_files = load_cache(hpss_files_cache)
+    elif os.path.exists(hpss_files_cache) and incremental:
+        logger.info("Updating cache file %s, starting at %s.",
+                    hpss_files_cache, hpss_root)
+        directories, contents = _read_hpss_cache(hpss_files_cache)
+        with write_cache(hpss_files_cache + '.tmp') as w:
+            _scan_hpss_incremental(hpss_root, w, hpss_files, directories,
+                                   contents, pool)
+        os.replace(hpss_files_cache + '.tmp', hpss_files_cache)
     else:
         logger.info("No HPSS cache file, starting scan at %s.", hpss_root)
-        with open(hpss_files_cache, 'w', newline='') as t:
-            w = csv.writer(t)
-            w.writerow(['Name', 'Size', 'Mtime'])
-            for root, dirs, files in walk(hpss_root):
-                logger.debug("Scanning HPSS directory %s.", root)
-                for f in files:
-                    if not f.path.endswith('.idx'):
-                        ff = f.path.replace(hpss_root+'/', '')
-                        hpss_files[ff] = (f.st_size, f.st_mtime)
-                        w.writerow([ff, f.st_size, f.st_mtime])
+
+        def onerror(err):
+            logger.error(str(err))
+
+        #
+        # Never leave an incomplete cache where it could be reused.
+        #
+        try:
+            with write_cache(hpss_files_cache + '.tmp') as w:
+                for root, dirs, files in walk(hpss_root, onerror=onerror,
+                                              recursive=recursive, pool=pool):
+                    logger.debug("Scanning HPSS directory %s.", root)
+                    _write_hpss_directory(hpss_root, w, hpss_files, dirs,
+                                          files)
+        except BaseException:
+            if os.path.exists(hpss_files_cache + '.tmp'):
+                os.remove(hpss_files_cache + '.tmp')
+            raise
+        os.replace(hpss_files_cache + '.tmp', hpss_files_cache)
     return hpss_files
 
 
+def _write_hpss_directory(hpss_root, writer, hpss_files, dirs, files):
+    """Write the contents of one HPSS directory to the cache.
+
+    Parameters
+    ----------
+    hpss_root : :class:`str`
+        Cache entries are relative to this directory.
+    writer : :class:`csv.writer`
+        Cache file.
+    hpss_files : :class:`dict`
+        Add files to this set.
+    dirs : :class:`list`
+        Subdirectories, as :class:`~hpsspy.util.HpssFile` objects.
+    files : :class:`list`
+        Files, as :class:`~hpsspy.util.HpssFile` objects.
+    """
+    for d in dirs:
+        if not d.islink:
+            writer.writerow([d.path.replace(hpss_root+'/', '') + '/', 0,
+                             d.st_mtime])
+    for f in files:
+        if not f.path.endswith('.idx'):
+            ff = f.path.replace(hpss_root+'/', '')
+            hpss_files[ff] = (f.st_size, f.st_mtime)
+            writer.writerow([ff, f.st_size, f.st_mtime])
+    return
+
+
+def _read_hpss_cache(hpss_files_cache):
+    """Read an HPSS cache, organized by directory.
+
+    Parameters
+    ----------
+    hpss_files_cache : :class:`str`
+        Name of the cache file.
+
+    Returns
+    -------
+    :func:`tuple`
+        A :class:`dict` mapping directory names to modification times, and
+        a :class:`dict` mapping directory names to a list of the
+        subdirectory and file rows they contain.  Directory names are
+        relative to the top of the scan, which is ``''``.
+    """
+    directories = dict()
+    contents = dict()
+    for row in read_cache(hpss_files_cache):
+        name = row[0]
+        if name.endswith('/'):
+            name = name[:-1]
+            directories[name] = row[2]
+        parent = os.path.dirname(name)
+        if parent not in contents:
+            contents[parent] = list()
+        contents[parent].append(row)
+    return (directories, contents)
+
+
+def _scan_hpss_incremental(hpss_root, writer, hpss_files, directories,
+                           contents, pool):
+    """Update an HPSS cache, breadth-first.
+
+    Directories are listed only if their modification time has changed,
+    otherwise their contents are copied from the old cache.  The
+    modification times of the subdirectories of unchanged directories are
+    obtained in batches, one batch per level of the tree.
+
+    Parameters
+    ----------
+    hpss_root : :class:`str`
+        Name of a directory in which to start the scan.
+    writer : :class:`csv.writer`
+        New cache file.
+    hpss_files : :class:`dict`
+        Add files to this set.
+    directories : :class:`dict`
+        Modification times of directories in the old cache, which may
+        be empty.
+    contents : :class:`dict`
+        Rows of the old cache, grouped by directory.
+    pool : :class:`~hpsspy.util.HsiPool`
+        If not ``None``, list directories concurrently in this pool.
+    """
+    logger = logging.getLogger(__name__ + '.scan_hpss')
+
+    def _relative(path):
+        return path.replace(hpss_root+'/', '')
+
+    changed = [hpss_root]
+    unchanged = list()
+    while changed or unchanged:
+        next_changed = list()
+        next_unchanged = list()
+        if pool is None:
+            listings = [(d, d) for d in changed]
+        else:
+            listings = [(d, pool.listdir(d)) for d in changed]
+        for d, listing in listings:
+            logger.debug("Scanning HPSS directory %s.", d)
+            try:
+                if pool is None:
+                    names = listdir(listing)
+                else:
+                    names = listing.result()
+            except HpssOSError as err:
+                logger.error(str(err))
+                continue
+            dirs = [n for n in names if n.isdir]
+            files = [n for n in names if not n.isdir]
+            _write_hpss_directory(hpss_root, writer, hpss_files, dirs, files)
+            for s in dirs:
+                if not s.islink:
+                    r = _relative(s.path)
+                    if directories.get(r) == s.st_mtime:
+                        next_unchanged.append(r)
+                    else:
+                        next_changed.append(s.path)
+        subdirectories = list()
+        for r in unchanged:
+            logger.debug("Reusing cache for HPSS directory %s.",
+                         os.path.join(hpss_root, r))
+            for row in contents.get(r, []):
+                if row[0].endswith('/'):
+                    subdirectories.append(row[0][:-1])
+                else:
+                    hpss_files[row[0]] = (row[1], row[2])
+                    writer.writerow(row)
+        if subdirectories:
+            found = lstat_many([os.path.join(hpss_root, r)
+                                for r in subdirectories])
+            for r in subdirectories:
+                try:
+                    s = found[os.path.normpath(os.path.join(hpss_root, r))]
+                except KeyError:
+                    logger.debug("HPSS directory %s has been removed.",
+                                 os.path.join(hpss_root, r))
+                    continue
+                if s.islink or not s.isdir:
+                    continue
+                writer.writerow([r + '/', 0, s.st_mtime])
+                if directories.get(r) == s.st_mtime:
+                    next_unchanged.append(r)
+                else:
+                    next_changed.append(os.path.join(hpss_root, r))
+        changed, unchanged = next_changed, next_unchanged
+    return
+
+
 def physical_disks(release_root, config):
     """Convert a root path into a list of physical disks containing data.
 
@@ -626,6 +1496,10 @@ def _options():
     """
     desc = 'Verify the presence of files on HPSS.'
     parser = ArgumentParser(prog=os.path.basename(sys.argv[0]), description=desc)
+    parser.add_argument('-B', '--binary-cache', action='store_true',
+                        dest='binary',
+                        help=('Write disk and HPSS cache files in a binary ' +
+                              'format that can be read much faster.'))
     parser.add_argument('-c', '--cache-dir', action='store', dest='cache',
                         metavar='DIR',
                         default=os.path.join(os.environ['HOME'], 'cache'),
@@ -640,6 +1514,18 @@ def _options():
     parser.add_argument('-H', '--overwrite-hpss', action='store_true',
                         dest='overwrite_hpss',
                         help='Ignore any existing HPSS cache files.')
+    parser.add_argument('-I', '--incremental-disk', action='store_true',
+                        dest='incremental_disk',
+                        help=('Update an existing disk cache file, only ' +
+                              'examining directories that have changed.'))
+    parser.add_argument('-i', '--incremental-hpss', action='store_true',
+                        dest='incremental_hpss',
+                        help=('Update an existing HPSS cache file, only ' +
+                              'listing directories that have changed.'))
+    parser.add_argument('-j', '--jobs', action='store', type=int,
+                        dest='jobs', metavar='N', default=1,
+                        help=("Compare disk files to HPSS files with N " +
+                              "processes (Default: %(default)s)."))
     parser.add_argument('-l', '--size-limit', action='store', type=float,
                         dest='limit', metavar='N', default=1024.0,
                         help=("Do not allow archive files larger than " +
@@ -648,23 +1534,89 @@ def _options():
                         dest='process',
                         help=('Process the list of missing files to produce ' +
                               'HPSS commands.'))
+    parser.add_argument('-R', '--recursive-hpss', action='store_true',
+                        dest='recursive_hpss',
+                        help=('Scan HPSS with a single recursive listing ' +
+                              'instead of one listing per directory.'))
     parser.add_argument('-r', '--report', action='store', type=int,
                         dest='report', metavar='N', default=10000,
                         help=("Print an informational message after " +
                               "every N files (Default: %(default)s)."))
+    parser.add_argument('-s', '--hpss-sessions', action='store', type=int,
+                        dest='sessions', metavar='N', default=1,
+                        help=("List HPSS directories with N concurrent " +
+                              "hsi sessions, at most " +
+                              str(HsiPool.session_limit) + ". If N is 0, " +
+                              "start a new hsi process for every " +
+                              "command (Default: %(default)s)."))
     parser.add_argument('-t', '--test', action='store_true',
                         dest='test',
                         help="Test mode. Try not to make any changes.")
     parser.add_argument('-v', '--verbose', action='store_true',
                         dest='verbose',
                         help="Increase verbosity. Increase it a lot.")
+    parser.add_argument('-w', '--disk-workers', action='store', type=int,
+                        dest='disk_workers', metavar='N', default=1,
+                        help=("Scan disk directories with N concurrent " +
+                              "threads (Default: %(default)s)."))
+    parser.add_argument('-z', '--compress', action='store', dest='compress',
+                        metavar='EXT', choices=('gz', 'bz2', 'xz', 'zst'),
+                        help=('Compress disk and HPSS cache files; EXT is ' +
+                              'one of %(choices)s.'))
     parser.add_argument('-V', '--version', action='version',
                         version="%(prog)s " + hpsspyVersion)
     parser.add_argument('config', metavar='FILE',
                         help="Read configuration from FILE.")
     parser.add_argument('release', metavar='SECTION',
                         help="Read SECTION from the configuration file.")
-    return parser.parse_args()
+    options = parser.parse_args()
+    if not 0 <= options.sessions <= HsiPool.session_limit:
+        parser.error(("argument -s/--hpss-sessions: must be between 0 " +
+                      "and {0:d}").format(HsiPool.session_limit))
+    return options
+
+
+def scan_concurrently(scans, interval=60.0):
+    """Run several scans at the same time, reporting progress.
+
+    Parameters
+    ----------
+    scans : :class:`dict`
+        A mapping of a descriptive name to a function that takes no
+        arguments and performs the scan.
+    interval : :class:`float`, optional
+        Report which scans are still running every `interval` seconds.
+
+    Returns
+    -------
+    :class:`dict`
+        A mapping of each name to the value returned by its function.
+
+    Raises
+    ------
+    Exception
+        Any exception raised by a scan is raised again, once all scans
+        have finished.
+    """
+    logger = logging.getLogger(__name__ + '.scan_concurrently')
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(scans)) as executor:
+        futures = dict()
+        for name in scans:
+            logger.info("Starting %s scan.", name)
+            futures[executor.submit(scans[name])] = name
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=interval)
+            elapsed = time.monotonic() - start
+            for f in done:
+                logger.info("Finished %s scan after %.1f s.", futures[f],
+                            elapsed)
+            if pending:
+                logger.info("Still running %s scan(s) after %.1f s.",
+                            ', '.join(sorted(futures[f] for f in pending)),
+                            elapsed)
+    return dict((name, f.result()) for f, name in futures.items())
 
 
 def main():
@@ -701,29 +1653,60 @@ def main():
     release_root = os.path.join(config['root'], options.release)
     hpss_release_root = os.path.join(config['hpss_root'], options.release)
     #
-    # Read HPSS files and cache.
+    # Read HPSS files and disk files, and cache them.  The two scans
+    # are run concurrently.
     #
+    logger.debug("Cache files will be written to %s.", options.cache)
     if options.test:
         logger.info("Test mode. Pretending no files exist on HPSS.")
-        hpss_files = dict()
-    else:
-        logger.debug("Cache files will be written to %s.", options.cache)
-        hpss_files_cache = os.path.join(options.cache,
-                                        ('hpss_files_' +
-                                         '{0}.csv').format(options.release))
-        logger.debug("hpss_files_cache = '%s'", hpss_files_cache)
-        hpss_files = scan_hpss(hpss_release_root, hpss_files_cache,
-                               overwrite=options.overwrite_hpss)
-    #
-    # Read disk files and cache.
-    #
+    extension = 'bin' if options.binary else 'csv'
+    if options.compress is not None:
+        if options.binary:
+            logger.warning("Binary cache files cannot be compressed.")
+        else:
+            extension += '.' + options.compress
+    hpss_files_cache = os.path.join(options.cache,
+                                    ('hpss_files_' +
+                                     '{0}.{1}').format(options.release,
+                                                       extension))
+    logger.debug("hpss_files_cache = '%s'", hpss_files_cache)
     disk_files_cache = os.path.join(options.cache,
                                     ('disk_files_' +
-                                     '{0}.csv').format(options.release))
+                                     '{0}.{1}').format(options.release,
+                                                       extension))
     logger.debug("disk_files_cache = '%s'", disk_files_cache)
     disk_roots = physical_disks(release_root, config)
-    status = scan_disk(disk_roots, disk_files_cache,
-                       overwrite=options.overwrite_disk)
+
+    def hpss_scan():
+        if options.test:
+            return dict()
+        if options.sessions > 1:
+            with HsiPool(workers=options.sessions) as pool:
+                return scan_hpss(hpss_release_root, hpss_files_cache,
+                                 overwrite=options.overwrite_hpss,
+                                 recursive=options.recursive_hpss,
+                                 pool=pool,
+                                 incremental=options.incremental_hpss)
+        if options.sessions == 0:
+            return scan_hpss(hpss_release_root, hpss_files_cache,
+                             overwrite=options.overwrite_hpss,
+                             recursive=options.recursive_hpss,
+                             incremental=options.incremental_hpss)
+        with HsiSession():
+            return scan_hpss(hpss_release_root, hpss_files_cache,
+                             overwrite=options.overwrite_hpss,
+                             recursive=options.recursive_hpss,
+                             incremental=options.incremental_hpss)
+
+    def disk_scan():
+        return scan_disk(disk_roots, disk_files_cache,
+                         overwrite=options.overwrite_disk,
+                         incremental=options.incremental_disk,
+                         workers=options.disk_workers)
+
+    results = scan_concurrently({'HPSS': hpss_scan, 'disk': disk_scan})
+    hpss_files = results['HPSS']
+    status = results['disk']
     if options.errexit and not status:
         return 1
     #
@@ -734,7 +1717,8 @@ def main():
                                         '{0}.json').format(options.release))
     logger.debug("missing_files_cache = '%s'", missing_files_cache)
     status = find_missing(hpss_map, hpss_files, disk_files_cache,
-                          missing_files_cache, options.report, options.limit)
+                          missing_files_cache, options.report, options.limit,
+                          processes=options.jobs)
     if options.errexit and not status:
         return 1
     #
@@ -0,0 +1,123 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+hpsspy.test.benchmark_disk
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Measure how quickly :func:`hpsspy.scan.scan_disk` can scan a synthetic
+directory tree.
+
+Run with ``python -m hpsspy.test.benchmark_disk``.  This is not part of the
+test suite.
+"""
+import csv
+import gc
+import os
+import time
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from ..scan import scan_disk
+
+
+def fake_tree(root, directories, files):
+    """Create a synthetic tree of empty files.
+
+    Parameters
+    ----------
+    root : :class:`str`
+        Top-level directory.
+    directories : :class:`int`
+        Number of subdirectories, split between two levels.
+    files : :class:`int`
+        Number of files in each subdirectory.
+
+    Returns
+    -------
+    :class:`int`
+        Number of files created.
+    """
+    n = 0
+    for d in range(directories):
+        path = os.path.join(root, 'd{0:03d}'.format(d % 10),
+                            'e{0:04d}'.format(d))
+        os.makedirs(path)
+        for f in range(files):
+            open(os.path.join(path, 'f{0:05d}.fits'.format(f)), 'w').close()
+            n += 1
+    return n
+
+
+def walk_disk(disk_roots, disk_files_cache):
+    """Scan with :func:`os.walk`, :func:`os.path.islink` and :func:`os.stat`.
+
+    This is the method used by :func:`~hpsspy.scan.scan_disk` before it
+    was rebuilt on :func:`os.scandir`, for comparison.
+    """
+    with open(disk_files_cache, 'w', newline='') as t:
+        writer = csv.writer(t)
+        writer.writerow(['Name', 'Size', 'Mtime'])
+        for disk_root in disk_roots:
+            for root, dirs, files in os.walk(disk_root):
+                for f in files:
+                    fullname = os.path.join(root, f)
+                    if not os.path.islink(fullname):
+                        cachename = fullname.replace(disk_root+'/', '')
+                        s = os.stat(fullname)
+                        writer.writerow([cachename, s.st_size,
+                                         int(s.st_mtime)])
+    return True
+
+
+def _rate(function, root, cache, n, repeat):
+    """Return the best files-per-second rate of `function` on `root`.
+    """
+    best = None
+    for r in range(repeat):
+        gc.collect()
+        gc.disable()
+        start = time.perf_counter()
+        function([root], cache)
+        elapsed = time.perf_counter() - start
+        gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return n / best
+
+
+def main():
+    """Entry-point for command-line scripts.
+
+    Returns
+    -------
+    :class:`int`
+        An integer suitable for passing to :func:`sys.exit`.
+    """
+    parser = ArgumentParser(description="Benchmark disk scanning.")
+    parser.add_argument('-d', '--directories', type=int, default=200,
+                        metavar='D',
+                        help='Create D directories (default %(default)s).')
+    parser.add_argument('-f', '--files', type=int, default=500, metavar='F',
+                        help='Create F files per directory (default %(default)s).')
+    parser.add_argument('-w', '--workers', type=int, default=8, metavar='N',
+                        help='Also scan with N threads (default %(default)s).')
+    parser.add_argument('-r', '--repeat', type=int, default=3, metavar='R',
+                        help='Report the best of R runs (default %(default)s).')
+    options = parser.parse_args()
+    with TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, 'root')
+        n = fake_tree(root, options.directories, options.files)
+        cache = os.path.join(tmp, 'disk_cache.csv')
+        results = (('os.walk', walk_disk),
+                   ('scan_disk', lambda x, y: scan_disk(x, y, overwrite=True)),
+                   ('workers={0:d}'.format(options.workers),
+                    lambda x, y: scan_disk(x, y, overwrite=True,
+                                           workers=options.workers)))
+        for name, function in results:
+            rate = _rate(function, root, cache, n, options.repeat)
+            print("{0:>14s}: {1:12,.0f} files/s".format(name, rate))
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
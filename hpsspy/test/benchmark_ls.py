@@ -0,0 +1,84 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+hpsspy.test.benchmark_ls
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Measure how quickly :command:`hsi ls -D` output can be parsed.
+
+Run with ``python -m hpsspy.test.benchmark_ls``.  This is not part of the
+test suite.
+"""
+import gc
+import time
+from argparse import ArgumentParser
+from ..os._os import _parse_ls, _split_line, linere
+from ..util import HpssFile
+
+
+def fake_listing(n):
+    """Create `n` lines of :command:`hsi ls -D` output.
+
+    Parameters
+    ----------
+    n : :class:`int`
+        Number of lines.
+
+    Returns
+    -------
+    :class:`list`
+        Lines of output, including line endings.
+    """
+    template = ('-rw-rw----    1 bweaver   desi     {0:11d} Thu May 15 ' +
+                '07:{1:02d}:{2:02d} 2014 desi-{3:08d}.fits\n')
+    return [template.format(i * 1000, i % 60, (i // 60) % 60, i)
+            for i in range(n)]
+
+
+def _rate(function, lines, repeat):
+    """Return the best lines-per-second rate of `function` over `lines`.
+    """
+    best = None
+    for r in range(repeat):
+        gc.collect()
+        gc.disable()
+        start = time.perf_counter()
+        function(lines)
+        elapsed = time.perf_counter() - start
+        gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(lines) / best
+
+
+def main():
+    """Entry-point for command-line scripts.
+
+    Returns
+    -------
+    :class:`int`
+        An integer suitable for passing to :func:`sys.exit`.
+    """
+    parser = ArgumentParser(description="Benchmark ls output parsing.")
+    parser.add_argument('-n', '--lines', type=int, default=200000,
+                        metavar='N', help='Parse N lines (default %(default)s).')
+    parser.add_argument('-r', '--repeat', type=int, default=3, metavar='R',
+                        help='Report the best of R runs (default %(default)s).')
+    options = parser.parse_args()
+    lines = fake_listing(options.lines)
+    stripped = [line.rstrip('\n') for line in lines]
+    path = '/home/b/bweaver'
+    results = (('linere', lambda x: [HpssFile(path, *linere.match(line).groups())
+                                     for line in x], stripped),
+               ('_split_line', lambda x: [HpssFile(path, *_split_line(line))
+                                          for line in x], stripped),
+               ('_parse_ls', lambda x: list(_parse_ls(x, path)), lines))
+    for name, function, data in results:
+        rate = _rate(function, data, options.repeat)
+        print("{0:>14s}: {1:12,.0f} lines/s".format(name, rate))
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,272 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+hpsspy.test.test_cache
+~~~~~~~~~~~~~~~~~~~~~~
+
+Test the functions in the cache module.
+"""
+import json
+import os
+import pickle
+import pytest
+from logging import DEBUG
+from pkg_resources import resource_filename
+from ..cache import (BinaryCache, BinaryCacheWriter, compressors, convert_cache, is_binary_cache,
+                     load_cache, open_cache, read_cache, write_cache)
+from ..scan import compile_map, find_missing, scan_disk
+
+
+rows = [('d2/spectro/', 0, 1552494004),
+        ('d2/spectro/b.fits', 1234, 1552494001),
+        ('README.html', 10, 1552494002),
+        ('d2/spectro/a.fits', 2**40, 1552494003),
+        ('d2/spectro/é.fits', 5, -1)]
+
+
+def test_write_cache(tmp_path):
+    """Test writing caches in both formats.
+    """
+    for name in ('cache.csv', 'cache.bin', 'cache.bin.tmp'):
+        cache = tmp_path / name
+        with write_cache(str(cache)) as w:
+            for row in rows:
+                w.writerow(row)
+        assert is_binary_cache(str(cache)) == ('.bin' in name)
+        assert list(read_cache(str(cache))) == rows
+
+
+def test_BinaryCache(monkeypatch, tmp_path):
+    """Test memory-mapped access to a binary cache.
+    """
+    monkeypatch.setattr(BinaryCache, 'found_size', 4)
+    cache = tmp_path / 'cache.bin'
+    with write_cache(str(cache)) as w:
+        for row in rows:
+            w.writerow(row)
+    with BinaryCache(str(cache)) as c:
+        assert len(c) == 5
+        assert list(c) == [r[0] for r in rows]
+        assert c.name(3) == 'd2/spectro/a.fits'
+        assert c.size[3] == 2**40
+        assert c.mtime[4] == -1
+        assert c.index('README.html') == 2
+        for r in rows:
+            assert c[r[0]] == (r[1], r[2])
+        assert 'd2/spectro/c.fits' not in c
+        assert 'd2/spectro/\udcec.fits' not in c
+        with pytest.raises(KeyError):
+            c['zzz']
+        assert c._found.cache_info().currsize == c.found_size
+        d = pickle.loads(pickle.dumps(c))
+        assert d['README.html'] == (10, 1552494002)
+        d.close()
+    csv = tmp_path / 'cache.csv'
+    with csv.open('w') as t:
+        t.write('Name,Size,Mtime\n')
+    with pytest.raises(ValueError):
+        BinaryCache(str(csv))
+
+
+def test_BinaryCache_empty(tmp_path):
+    """Test a binary cache with no rows.
+    """
+    cache = tmp_path / 'cache.bin'
+    with write_cache(str(cache)):
+        pass
+    with BinaryCache(str(cache)) as c:
+        assert len(c) == 0
+        assert 'foo' not in c
+        assert list(c.rows()) == []
+
+
+def test_read_cache_empty(tmp_path):
+    """Test reading a CSV cache with no header, such as an interrupted write.
+    """
+    for name in ('cache.csv', 'cache.csv.gz'):
+        cache = tmp_path / name
+        with open_cache(str(cache), 'w'):
+            pass
+        assert list(read_cache(str(cache))) == []
+
+
+def test_BinaryCacheWriter_runs(monkeypatch, tmp_path):
+    """Test sorting names in several runs.
+    """
+    monkeypatch.setattr(BinaryCacheWriter, 'run_size', 2)
+    names = ['d{0:d}/f{1:d}'.format(i % 3, 7 - i) for i in range(7)]
+    cache = tmp_path / 'cache.bin'
+    with write_cache(str(cache)) as w:
+        for i, name in enumerate(names):
+            w.writerow((name, i, i))
+    with BinaryCache(str(cache)) as c:
+        assert [c.name(i) for i in c._order] == sorted(names)
+        for i, name in enumerate(names):
+            assert c[name] == (i, i)
+
+
+def test_BinaryCacheWriter_errors(tmp_path):
+    """Test rows that cannot be written, and abandoning a cache.
+    """
+    cache = tmp_path / 'cache.bin'
+    with write_cache(str(cache)) as w:
+        w.writerow(rows[0])
+        with pytest.raises(UnicodeEncodeError):
+            w.writerow(('d2/\udcec.fits', 1, 1))
+        w.writerow(rows[1])
+    assert list(read_cache(str(cache))) == rows[0:2]
+    other = tmp_path / 'other.bin'
+    with pytest.raises(ZeroDivisionError):
+        with write_cache(str(other)) as w:
+            w.writerow(rows[0])
+            1/0
+    assert not other.exists()
+
+
+def test_convert_cache(tmp_path):
+    """Test converting between formats.
+    """
+    csv = tmp_path / 'cache.csv'
+    with write_cache(str(csv)) as w:
+        for row in rows:
+            w.writerow(row)
+    binary = tmp_path / 'cache.bin'
+    convert_cache(str(csv), str(binary))
+    assert is_binary_cache(str(binary))
+    csv2 = tmp_path / 'cache2.csv'
+    convert_cache(str(binary), str(csv2))
+    assert csv2.read_text() == csv.read_text()
+
+
+def test_load_cache(tmp_path):
+    """Test loading caches as a mapping.
+    """
+    csv = tmp_path / 'cache.csv'
+    with write_cache(str(csv)) as w:
+        for row in rows:
+            w.writerow(row)
+    binary = tmp_path / 'cache.bin'
+    convert_cache(str(csv), str(binary))
+    c = load_cache(str(csv))
+    assert isinstance(c, dict)
+    assert 'd2/spectro/' not in c
+    b = load_cache(str(binary))
+    assert isinstance(b, BinaryCache)
+    assert 'd2/spectro/' in b
+    for k in c:
+        assert b[k] == c[k]
+    b.close()
+
+
+def test_binary_scan(tmp_path, caplog):
+    """Test scanning and comparing files with binary caches.
+    """
+    root = tmp_path / 'root'
+    (root / 'd1' / 'batch').mkdir(parents=True)
+    (root / 'd1' / 'batch' / 'a.txt').write_bytes(b'x' * 10)
+    (root / 'd1' / 'SINGLE_FILE.txt').write_bytes(b'x' * 20)
+    csv = tmp_path / 'disk.csv'
+    binary = tmp_path / 'disk.bin'
+    assert scan_disk([str(root)], str(csv))
+    assert scan_disk([str(root)], str(binary))
+    assert is_binary_cache(str(binary))
+    assert list(read_cache(str(binary))) == list(read_cache(str(csv)))
+    caplog.set_level(DEBUG)
+    with open(resource_filename('hpsspy.test', 't/test_scan.json')) as j:
+        config = json.load(j)
+    hpss_map = compile_map(config, 'data')
+    hpss_files = {'d1/batch.tar': (1000, 1552494004)}
+    results = list()
+    for cache in (csv, binary):
+        caplog.clear()
+        missing_files = tmp_path / 'missing_{0}.json'.format(cache.suffix[1:])
+        status = find_missing(hpss_map, hpss_files, str(cache),
+                              str(missing_files))
+        results.append((status, missing_files.read_text(),
+                        [r.message for r in caplog.records]))
+    assert results[1] == results[0]
+
+
+@pytest.mark.parametrize('extension,header', [('.gz', b'\x1f\x8b'),
+                                              ('.bz2', b'BZh'),
+                                              ('.xz', b'\xfd7zXZ')])
+def test_compressed_cache(tmp_path, extension, header):
+    """Test reading and writing compressed caches.
+    """
+    for name in ('cache.csv' + extension, 'cache.csv' + extension + '.tmp'):
+        cache = tmp_path / name
+        with write_cache(str(cache)) as w:
+            for row in rows:
+                w.writerow(row)
+        assert cache.read_bytes().startswith(header)
+        assert not is_binary_cache(str(cache))
+        assert list(read_cache(str(cache))) == rows
+    csv = tmp_path / 'cache.csv'
+    convert_cache(str(cache), str(csv))
+    assert csv.read_text().startswith('Name,Size,Mtime\n')
+
+
+def test_open_cache_zstd(monkeypatch, tmp_path):
+    """Test opening zstd-compressed caches.
+    """
+    monkeypatch.delitem(compressors, '.zst', raising=False)
+    with pytest.raises(ValueError):
+        open_cache(str(tmp_path / 'cache.csv.zst'), 'w')
+    calls = list()
+
+    def mock_open(filename, mode, newline=None):
+        calls.append((filename, mode, newline))
+        return open(filename, mode[0], newline=newline)
+
+    monkeypatch.setitem(compressors, '.zst', mock_open)
+    with open_cache(str(tmp_path / 'cache.csv.zst'), 'w') as t:
+        t.write('Name,Size,Mtime\n')
+    assert calls == [(str(tmp_path / 'cache.csv.zst'), 'wt', '')]
+
+
+def test_compressed_scan(tmp_path):
+    """Test incremental scans and comparisons with a compressed cache.
+    """
+    root = tmp_path / 'root'
+    (root / 'd1' / 'batch').mkdir(parents=True)
+    (root / 'd1' / 'batch' / 'a.txt').write_bytes(b'x' * 10)
+    cache = tmp_path / 'disk.csv.gz'
+    assert scan_disk([str(root)], str(cache))
+    (root / 'd1' / 'b.txt').write_bytes(b'x' * 20)
+    os.utime(root / 'd1', (1000, 1000))
+    assert scan_disk([str(root)], str(cache), incremental=True)
+    assert cache.read_bytes().startswith(b'\x1f\x8b')
+    assert sorted(r[0] for r in read_cache(str(cache))) == [str(root) + '/',
+                                                            'd1/',
+                                                            'd1/b.txt',
+                                                            'd1/batch/',
+                                                            'd1/batch/a.txt']
+
+
+def test_compressed_scan_parallel(monkeypatch, tmp_path):
+    """Test a scan with several threads and a compressed cache.
+    """
+    roots = [tmp_path / 'foo', tmp_path / 'bar']
+    for root in roots:
+        (root / 'd1').mkdir(parents=True)
+        (root / 'd1' / 'a.txt').write_bytes(b'x' * 10)
+    opened = list()
+    gzip_open = compressors['.gz']
+
+    def mock_open(filename, mode, newline=None):
+        opened.append((os.path.basename(filename), mode))
+        return gzip_open(filename, mode, newline=newline)
+
+    monkeypatch.setitem(compressors, '.gz', mock_open)
+    cache = tmp_path / 'disk.csv.gz'
+    assert scan_disk([str(r) for r in roots], str(cache), workers=2)
+    assert sorted(opened) == [('disk.csv.0.gz.tmp', 'rt'),
+                              ('disk.csv.0.gz.tmp', 'wt'),
+                              ('disk.csv.1.gz.tmp', 'rt'),
+                              ('disk.csv.1.gz.tmp', 'wt'),
+                              ('disk.csv.gz.tmp', 'wt')]
+    assert sorted(tmp_path.glob('*.tmp')) == []
+    assert [r[0] for r in read_cache(str(cache))] == [str(roots[0]) + '/',
+                                                      'd1/', 'd1/a.txt',
+                                                      str(roots[1]) + '/',
+                                                      'd1/', 'd1/a.txt']
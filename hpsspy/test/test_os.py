@@ -7,17 +7,21 @@ hpsspy.test.test_os
 Test the functions in the os subpackage.
 """
 import pytest
-from ..os._os import chmod, listdir, makedirs, mkdir, lstat, stat, walk
+from ..os._os import (chmod, iterdir, listdir, makedirs, mkdir, lstat, lstat_many,
+                      scandir, stat, walk, linere, _parse_ls, _split_line)
 from ..os.path import isdir, isfile, islink
+from ..util import HpssFile, HsiPool, link_cache, metadata_cache
 from .. import HpssOSError
 
 
 class MockFile(object):
     """Simple mock object for use with testing walk().
     """
-    def __init__(self, isdir, string):
+    def __init__(self, isdir, string, islink=False):
         self.isdir = isdir
+        self.islink = islink
         self.string = string
+        self.name = string
         self.path = f'/path/{string}'
         self.st_size = 12345
         self.st_mtime = 54321
@@ -58,6 +62,17 @@ def mock_call():
     return SaveArgs
 
 
+@pytest.fixture
+def enable_cache():
+    """Temporarily enable the process-wide metadata cache.
+    """
+    metadata_cache.clear()
+    metadata_cache.configure(enabled=True, ttl=None)
+    yield metadata_cache
+    metadata_cache.configure(enabled=False, ttl=60.0)
+    metadata_cache.clear()
+
+
 def test_chmod(monkeypatch, mock_call):
     """Test the chmod() function.
     """
@@ -112,6 +127,36 @@ def test_listdir(monkeypatch, mock_call):
     files = listdir('/home/b/bweaver')
     assert files[0].ishtar
     assert m.args[0] == ('ls', '-Da', '/home/b/bweaver')
+    m = mock_call([foo])
+    monkeypatch.setattr('hpsspy.os._os.hsi', m)
+    t = listdir('/home/b/bweaver', table=True)
+    assert len(t) == 2
+    assert list(t.ishtar) == [1, 0]
+    assert t[1] == ('/home/b/bweaver/cosmos_nvo.tar.idx', 61184, files[1].st_mtime)
+
+
+@pytest.mark.parametrize('line', ['-rw-rw----    1 bweaver   desi     29956061184 Thu May 15 07:44:21 2014 cosmos_nvo.tar',
+                                  'lrwxrwxrwx    1 bweaver   bweaver           21 Fri Aug 22 11:32:09 2014 cosmo@ -> /nersc/projects/cosmo',
+                                  'drwxrws--T    6 nugent    cosmo            512 Tue Jun  4 11:06:43 2019 two  spaces ',
+                                  '-rw-rw----    1 bweaver   desi              12 Thu May 15 07:49:34 2014  leading space',
+                                  '-rw-rw----    1 bweaver   desi              12 Thu May 15 07:49:34 2014 ',
+                                  '-rw-rw----    1 bweaver   desi             1.2 Thu May 15 07:49:34 2014 bad.size',
+                                  '-rw-rw----    1 bweaver   desi              12 Thu Mai 15 07:49:34 2014 bad.month'])
+def test_split_line(line):
+    """Test the fast parser against the regular expression.
+    """
+    m = linere.match(line)
+    g = _split_line(line)
+    if 'leading' in line or line.endswith('2014 '):
+        assert g is None
+    elif m is not None:
+        assert g == m.groups()
+    if m is None or 'bad' in line:
+        with pytest.raises(HpssOSError):
+            list(_parse_ls([line], '/home/b/bweaver'))
+    else:
+        f = list(_parse_ls([line + '\n'], '/home/b/bweaver'))
+        assert repr(f[0]) == repr(HpssFile('/home/b/bweaver', *m.groups()))
 
 
 def test_makedirs_error(monkeypatch, mock_call):
@@ -250,6 +295,46 @@ def test_stat_different_symlink(monkeypatch, mock_call):
     assert m.args[1] == ('ls', '-Dd', 'cosmo.old')
 
 
+def test_stat_symlink_chain(monkeypatch, mock_call):
+    """Test the stat() function with a chain of symlinks.
+    """
+    m = mock_call(['lrwxrwxrwx    1 bweaver   bweaver           21 Fri Aug 22 11:32:09 2014 a@ -> b',
+                   'lrwxrwxrwx    1 bweaver   bweaver           21 Fri Aug 22 11:32:09 2014 b@ -> /nersc/c',
+                   'drwxrws---    6 nugent    cosmo            512 Tue Jun  4 11:06:43 2019 c',
+                   'lrwxrwxrwx    1 bweaver   bweaver           21 Fri Aug 22 11:32:09 2014 b@ -> /nersc/c',
+                   'drwxrws---    6 nugent    cosmo           1024 Wed Jun  5 11:06:43 2019 c'])
+    monkeypatch.setattr('hpsspy.os._os.hsi', m)
+    s = stat('/home/a')
+    assert s.isdir
+    assert m.args == [('ls', '-Dd', '/home/a'), ('ls', '-Dd', '/home/b'),
+                      ('ls', '-Dd', '/nersc/c')]
+    assert link_cache.get('link', '/home/a') == ('/nersc/c', True)
+    assert link_cache.get('link', '/home/b') == ('/nersc/c', True)
+    #
+    # The path to the target is remembered, but not its metadata.
+    #
+    s = stat('/home/b')
+    assert s.st_size == 1024
+    assert m.args[3:] == [('ls', '-Dd', '/home/b'), ('ls', '-Dd', '/nersc/c')]
+    chmod_m = mock_call(['All good!'])
+    monkeypatch.setattr('hpsspy.os._os.hsi', chmod_m)
+    chmod('/home/b', '755')
+    assert link_cache.get('link', '/home/b') is None
+    assert link_cache.get('link', '/home/a') == ('/nersc/c', True)
+
+
+def test_stat_symlink_loop(monkeypatch, mock_call):
+    """Test the stat() function with a cycle of symlinks.
+    """
+    m = mock_call(['lrwxrwxrwx    1 bweaver   bweaver           21 Fri Aug 22 11:32:09 2014 a@ -> b',
+                   'lrwxrwxrwx    1 bweaver   bweaver           21 Fri Aug 22 11:32:09 2014 b@ -> ./a'])
+    monkeypatch.setattr('hpsspy.os._os.hsi', m)
+    with pytest.raises(HpssOSError) as err:
+        stat('/home/a')
+    assert err.value.args[0] == "Too many levels of symbolic links: /home/a"
+    assert len(m.args) == 2
+
+
 def test_lstat_is_link(monkeypatch, mock_call):
     """Test the lstat() function.
     """
@@ -272,6 +357,28 @@ def test_lstat_not_link(monkeypatch, mock_call):
     assert m.args[0] == ('ls', '-Dd', 'test')
 
 
+def test_lstat_many(monkeypatch, mock_call):
+    """Test the lstat_many() function.
+    """
+    m = mock_call(['/home/b:\n' +
+                   'drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 a\n' +
+                   '*** hpss_Lstat: No such file or directory [-2: HPSS_ENOENT]\n' +
+                   '    /home/b/missing\n' +
+                   '/home/x/y:\n' +
+                   'drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 z\n',
+                   '/home/b/c:\n' +
+                   '-rw-rw----    1 bweaver   desi              12 Thu May 15 07:49:34 2014 d\n'])
+    monkeypatch.setattr('hpsspy.os._os.hsi', m)
+    s = lstat_many(['/home/b/a', '/home/b/missing', '/home/x/y/z',
+                    '/home/b/c/d'], chunk=3)
+    assert m.args == [('ls', '-Dd', '/home/b/a', '/home/b/missing',
+                       '/home/x/y/z'),
+                      ('ls', '-Dd', '/home/b/c/d')]
+    assert sorted(s) == ['/home/b/a', '/home/b/c/d', '/home/x/y/z']
+    assert s['/home/b/a'].isdir
+    assert not s['/home/b/c/d'].isdir
+
+
 def test_isdir(monkeypatch, mock_call):
     """Test the isdir() function.
     """
@@ -304,13 +411,44 @@ def test_islink(monkeypatch, mock_call):
     # assert m.args[1] == ('ls', '-Dd', '/nersc/projects/cosmo')
 
 
+def test_metadata_cache(monkeypatch, mock_call, enable_cache):
+    """Test caching stat() and listdir() results.
+    """
+    m = mock_call(['drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 /home/b/bweaver/sub',
+                   '-rw-rw----    1 bweaver   desi              12 Thu May 15 07:49:34 2014 b.txt',
+                   'All good!',
+                   '-rw-rw----    1 bweaver   desi              12 Thu May 15 07:49:34 2014 b.txt',
+                   'drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 /home/b/bweaver/sub',
+                   'All good!',
+                   'drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 /home/b/bweaver/sub'])
+    monkeypatch.setattr('hpsspy.os._os.hsi', m)
+    s = stat('/home/b/bweaver/sub')
+    assert stat('/home/b/bweaver/sub/') is s
+    assert isdir('/home/b/bweaver/sub')
+    files = listdir('/home/b/bweaver/sub')
+    files.append('junk')
+    assert [str(f) for f in listdir('/home/b/bweaver/sub')] == ['b.txt']
+    assert len(m.args) == 2
+    assert enable_cache.hits == 3
+    assert enable_cache.misses == 2
+    chmod('/home/b/bweaver/sub/b.txt', '664')
+    assert len(listdir('/home/b/bweaver/sub')) == 1
+    s = stat('/home/b/bweaver/sub')
+    assert len(m.args) == 5
+    stat('/home/b/bweaver/sub')
+    assert len(m.args) == 5
+    makedirs('/home/b/bweaver/sub/new/dir')
+    assert stat('/home/b/bweaver/sub') is not s
+    assert len(m.args) == 7
+
+
 def test_walk_error(monkeypatch, mock_call):
     """Test the walk() function throwing an error.
     """
     r = HpssOSError('foobar')
     m = mock_call(['Error message'], raises=r)
     e = mock_call(['Return value'])
-    monkeypatch.setattr('hpsspy.os._os.listdir', m)
+    monkeypatch.setattr('hpsspy.os._os.iterdir', m)
     w = walk('/home/b/bweaver', onerror=e)
     try:
         n = next(w)
@@ -326,9 +464,7 @@ def test_walk(monkeypatch, mock_call):
     d = MockFile(True, 'subdir')
     f = MockFile(False, 'name')
     ld = mock_call([[d, f], []])
-    i = mock_call([False])
-    monkeypatch.setattr('hpsspy.os._os.listdir', ld)
-    monkeypatch.setattr('hpsspy.os._os.islink', i)
+    monkeypatch.setattr('hpsspy.os._os.iterdir', ld)
     w = walk('/home/b/bweaver')
     n = next(w)
     assert n == ('/home/b/bweaver', [d], [f])
@@ -336,7 +472,25 @@ def test_walk(monkeypatch, mock_call):
     n = next(w)
     assert n == ('/home/b/bweaver/subdir', [], [])
     assert ld.args[1] == ('/home/b/bweaver/subdir', )
-    assert i.args[0] == ('/home/b/bweaver/subdir', )
+
+
+def test_walk_links(monkeypatch, mock_call):
+    """Test the walk() function with symlinks to directories.
+    """
+    d = MockFile(True, 'subdir')
+    l = MockFile(True, 'linkdir', islink=True)
+    f = MockFile(False, 'name')
+    ld = mock_call([[d, l, f], [], []])
+    monkeypatch.setattr('hpsspy.os._os.iterdir', ld)
+    w = list(walk('/home/b/bweaver'))
+    assert w == [('/home/b/bweaver', [d, l], [f]),
+                 ('/home/b/bweaver/subdir', [], [])]
+    assert len(ld.args) == 2
+    ld = mock_call([[d, l, f], [], []])
+    monkeypatch.setattr('hpsspy.os._os.iterdir', ld)
+    w = list(walk('/home/b/bweaver', followlinks=True))
+    assert w[2] == ('/home/b/bweaver/linkdir', [], [])
+    assert ld.args[2] == ('/home/b/bweaver/linkdir', )
 
 
 def test_walk_topdown(monkeypatch, mock_call):
@@ -345,14 +499,260 @@ def test_walk_topdown(monkeypatch, mock_call):
     d = MockFile(True, 'subdir')
     f = MockFile(False, 'name')
     ld = mock_call([[d, f], []])
-    i = mock_call([False])
-    monkeypatch.setattr('hpsspy.os._os.listdir', ld)
-    monkeypatch.setattr('hpsspy.os._os.islink', i)
+    monkeypatch.setattr('hpsspy.os._os.iterdir', ld)
     w = walk('/home/b/bweaver', topdown=False)
     n = next(w)
     assert n == ('/home/b/bweaver/subdir', [], [])
-    assert i.args[0] == ('/home/b/bweaver/subdir', )
     n = next(w)
     assert n == ('/home/b/bweaver', [d], [f])
     assert ld.args[0] == ('/home/b/bweaver', )
     assert ld.args[1] == ('/home/b/bweaver/subdir', )
+
+
+recursive_listing = '''/home/b/bweaver:
+-rw-rw----    1 bweaver   desi           61184 Thu May 15 07:49:34 2014 a.tar
+-rw-rw----    1 bweaver   desi            6118 Thu May 15 07:49:34 2014 a.tar.idx
+lrwxrwxrwx    1 bweaver   bweaver           21 Fri Aug 22 11:32:09 2014 cosmo@ -> /nersc/projects/cosmo
+drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 sub
+
+/home/b/bweaver/sub:
+drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 empty
+-rw-rw----    1 bweaver   desi              12 Thu May 15 07:49:34 2014 b.txt
+
+/home/b/bweaver/sub/empty:
+'''
+
+
+def test_walk_recursive(monkeypatch, mock_call):
+    """Test the walk() function with a single recursive listing.
+    """
+    i = mock_call([recursive_listing.splitlines(keepends=True)])
+    m = mock_call(['drwxrws---    6 nugent    cosmo            512 Tue Jun  4 11:06:43 2019 cosmo'])
+    monkeypatch.setattr('hpsspy.os._os.hsi_iter', i)
+    monkeypatch.setattr('hpsspy.os._os.hsi', m)
+    w = list(walk('/home/b/bweaver', recursive=True))
+    assert i.args[0] == ('ls', '-DaR', '/home/b/bweaver')
+    assert m.args[0] == ('ls', '-Dd', '/nersc/projects/cosmo')
+    assert len(i.args) == 1
+    assert len(m.args) == 1
+    assert [x[0] for x in w] == ['/home/b/bweaver',
+                                 '/home/b/bweaver/sub',
+                                 '/home/b/bweaver/sub/empty']
+    assert [str(d) for d in w[0][1]] == ['cosmo', 'sub']
+    assert [str(f) for f in w[0][2]] == ['a.tar', 'a.tar.idx']
+    assert w[0][2][0].ishtar
+    assert [str(d) for d in w[1][1]] == ['empty']
+    assert [str(f) for f in w[1][2]] == ['b.txt']
+    assert w[2][1:] == ([], [])
+
+
+def test_walk_recursive_prune(monkeypatch, mock_call):
+    """Test the walk() function with a single recursive listing and pruning.
+    """
+    listing = recursive_listing.replace('/home/b/bweaver/sub/empty:\n', '')
+    i = mock_call([listing.splitlines(keepends=True)])
+    m = mock_call(['drwxrws---    6 nugent    cosmo            512 Tue Jun  4 11:06:43 2019 cosmo'])
+    monkeypatch.setattr('hpsspy.os._os.hsi_iter', i)
+    monkeypatch.setattr('hpsspy.os._os.hsi', m)
+    w = list()
+    for root, dirs, files in walk('/home/b/bweaver', recursive=True):
+        w.append(root)
+        if root.endswith('sub'):
+            del dirs[:]
+    assert w == ['/home/b/bweaver', '/home/b/bweaver/sub']
+
+
+def test_walk_recursive_bottomup(monkeypatch, mock_call):
+    """Test the walk() function with a single recursive listing, bottom-up.
+    """
+    i = mock_call([recursive_listing.splitlines(keepends=True),
+                   ['/nersc/projects/cosmo:\n',
+                    '-rw-rw----    1 nugent    cosmo          12 Thu May 15 07:49:34 2014 c.txt\n']])
+    m = mock_call(['drwxrws---    6 nugent    cosmo            512 Tue Jun  4 11:06:43 2019 cosmo'])
+    monkeypatch.setattr('hpsspy.os._os.hsi_iter', i)
+    monkeypatch.setattr('hpsspy.os._os.hsi', m)
+    w = list(walk('/home/b/bweaver', topdown=False, followlinks=True,
+                  recursive=True))
+    assert i.args[1] == ('ls', '-DaR', '/home/b/bweaver/cosmo')
+    assert [x[0] for x in w] == ['/home/b/bweaver/cosmo',
+                                 '/home/b/bweaver/sub/empty',
+                                 '/home/b/bweaver/sub',
+                                 '/home/b/bweaver']
+    assert w[0][1] == []
+    assert [str(f) for f in w[0][2]] == ['c.txt']
+
+
+def test_walk_recursive_error(monkeypatch, mock_call):
+    """Test the walk() function with a single recursive listing and an error.
+    """
+    i = mock_call([['** Error!\n', 'More detail.\n']])
+    e = mock_call(['Return value'])
+    monkeypatch.setattr('hpsspy.os._os.hsi_iter', i)
+    w = list(walk('/home/b/bweaver', onerror=e, recursive=True))
+    assert w == []
+    assert e.args[0][0].args[0] == '** Error!\nMore detail.\n'
+
+
+def test_walk_recursive_error_block(monkeypatch, mock_call):
+    """Test the walk() function with an unreadable directory in a recursive
+    listing.
+    """
+    listing = """/top:
+drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 a
+drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 b
+drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 c
+
+/top/a:
+*** hpss_Opendir: Access denied [-13: HPSS_EACCES]
+    /top/a
+
+/top/b:
+-rw-rw----    1 bweaver   desi              12 Thu May 15 07:49:34 2014 b.txt
+
+/top/c:
+-rw-rw----    1 bweaver   desi              12 Thu May 15 07:49:34 2014 c.txt
+"""
+    for topdown in (True, False):
+        i = mock_call([listing.splitlines(keepends=True)])
+        e = mock_call(['Return value'])
+        monkeypatch.setattr('hpsspy.os._os.hsi_iter', i)
+        w = list(walk('/top', topdown=topdown, onerror=e, recursive=True))
+        w = [(r, [str(d) for d in ds], [str(f) for f in fs])
+             for r, ds, fs in w]
+        expected = [('/top', ['a', 'b', 'c'], []),
+                    ('/top/b', [], ['b.txt']),
+                    ('/top/c', [], ['c.txt'])]
+        if topdown:
+            assert w == expected
+        else:
+            assert w == expected[1:] + expected[:1]
+        assert len(e.args) == 1
+        assert e.args[0][0].args[0] == ('*** hpss_Opendir: Access denied ' +
+                                        '[-13: HPSS_EACCES]\n    /top/a')
+
+
+def test_iterdir(monkeypatch, mock_call):
+    """Test the iterdir() function.
+    """
+    listing = recursive_listing.split('\n\n')[0] + '\n'
+    listing += '-rw-rw----    1 bweaver   desi              12 Thu May 15 07:49:34 2014 z.txt\n'
+    i = mock_call([listing.splitlines(keepends=True)])
+    monkeypatch.setattr('hpsspy.os._os.hsi_iter', i)
+    files = list(iterdir('/home/b/bweaver'))
+    assert i.args[0] == ('ls', '-Da', '/home/b/bweaver')
+    assert [str(f) for f in files] == ['a.tar', 'a.tar.idx', 'cosmo',
+                                       'sub', 'z.txt']
+    assert files[0].ishtar
+    assert not files[1].ishtar
+    i = mock_call([['** Error!\n']])
+    monkeypatch.setattr('hpsspy.os._os.hsi_iter', i)
+    with pytest.raises(HpssOSError) as err:
+        list(iterdir('/home/b/bweaver'))
+    assert err.value.args[0] == '** Error!\n'
+
+
+def test_iterdir_cache(monkeypatch, mock_call, enable_cache):
+    """Test sharing the listing cache between iterdir() and listdir().
+    """
+    listing = recursive_listing.split('\n\n')[0] + '\n'
+    i = mock_call([listing.splitlines(keepends=True)])
+    monkeypatch.setattr('hpsspy.os._os.hsi_iter', i)
+    m = mock_call([])
+    monkeypatch.setattr('hpsspy.os._os.hsi', m)
+    it = iterdir('/home/b/bweaver')
+    next(it)
+    assert enable_cache.get('listdir', '/home/b/bweaver') is None
+    files = list(it)
+    assert len(files) == 3
+    files = list(iterdir('/home/b/bweaver/'))
+    assert [str(f) for f in files] == ['a.tar', 'a.tar.idx', 'cosmo', 'sub']
+    assert files[0].ishtar
+    assert [str(f) for f in listdir('/home/b/bweaver')] == ['a.tar', 'a.tar.idx', 'cosmo', 'sub']
+    assert [e.name for e in scandir('/home/b/bweaver')] == ['a.tar', 'a.tar.idx', 'cosmo', 'sub']
+    assert len(i.args) == 1
+    assert len(m.args) == 0
+
+
+def test_scandir(monkeypatch, mock_call):
+    """Test the scandir() function.
+    """
+    listing = recursive_listing.split('\n\n')[0] + '\n'
+    i = mock_call([listing.splitlines(keepends=True)])
+    m = mock_call(['drwxrws---    6 nugent    cosmo            512 Tue Jun  4 11:06:43 2019 cosmo'])
+    monkeypatch.setattr('hpsspy.os._os.hsi_iter', i)
+    monkeypatch.setattr('hpsspy.os._os.hsi', m)
+    entries = list(scandir('/home/b/bweaver'))
+    assert [e.name for e in entries] == ['a.tar', 'a.tar.idx', 'cosmo', 'sub']
+    assert entries[0].path == '/home/b/bweaver/a.tar'
+    assert entries[0].is_file()
+    assert not entries[0].is_dir()
+    assert entries[0].stat().ishtar
+    assert entries[0].stat() is entries[0].stat(follow_symlinks=False)
+    assert entries[3].is_dir()
+    assert not entries[3].is_symlink()
+    assert len(m.args) == 0
+    assert entries[2].is_symlink()
+    assert not entries[2].is_dir(follow_symlinks=False)
+    assert not entries[2].is_file(follow_symlinks=False)
+    assert entries[2].stat(follow_symlinks=False).islink
+    assert entries[2].stat().st_uid == 'nugent'
+    assert entries[2].stat().st_uid == 'nugent'
+    assert m.args == [('ls', '-Dd', '/nersc/projects/cosmo')]
+
+
+@pytest.fixture
+def mock_tree():
+    """Provide a thread-safe replacement for iterdir() on a fake tree.
+    """
+    tree = {'/top': [MockFile(True, 'a'), MockFile(True, 'b'),
+                     MockFile(True, 'l', islink=True), MockFile(False, 'f0')],
+            '/top/a': [MockFile(True, 'c'), MockFile(False, 'f1')],
+            '/top/b': [MockFile(False, 'f2')],
+            '/top/a/c': [MockFile(False, 'f3')],
+            '/top/l': [MockFile(False, 'f4')]}
+
+    def fake_listdir(path):
+        try:
+            return tree[path]
+        except KeyError:
+            raise HpssOSError(f"** {path} not found!")
+
+    return fake_listdir
+
+
+def test_walk_parallel(monkeypatch, mock_tree):
+    """Test the walk() function with a pool of workers.
+    """
+    monkeypatch.setattr('hpsspy.os._os.iterdir', mock_tree)
+    with HsiPool(workers=3) as pool:
+        w = [(r, [str(d) for d in ds], [str(f) for f in fs])
+             for r, ds, fs in walk('/top', pool=pool)]
+        assert w == [('/top', ['a', 'b', 'l'], ['f0']),
+                     ('/top/a', ['c'], ['f1']),
+                     ('/top/b', [], ['f2']),
+                     ('/top/a/c', [], ['f3'])]
+        w = [r for r, ds, fs in walk('/top', pool=pool, followlinks=True,
+                                     ordered=False)]
+        assert sorted(w) == ['/top', '/top/a', '/top/a/c', '/top/b', '/top/l']
+        assert w[0] == '/top'
+        w = [r for r, ds, fs in walk('/top', pool=pool, topdown=False)]
+        assert w == ['/top/a/c', '/top/b', '/top/a', '/top']
+        #
+        # Pruning.
+        #
+        w = list()
+        for r, ds, fs in walk('/top', pool=pool):
+            w.append(r)
+            ds[:] = [d for d in ds if str(d) != 'a']
+        assert w == ['/top', '/top/b']
+
+
+def test_walk_parallel_error(monkeypatch, mock_call, mock_tree):
+    """Test the walk() function with a pool of workers and an error.
+    """
+    monkeypatch.setattr('hpsspy.os._os.iterdir', mock_tree)
+    e = mock_call(['Return value'])
+    with HsiPool(workers=2) as pool:
+        w = list(walk('/missing', pool=pool, onerror=e))
+    assert w == []
+    assert e.args[0][0].args[0] == '** /missing not found!'
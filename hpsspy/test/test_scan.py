@@ -8,12 +8,20 @@ Test the functions in the scan subpackage.
 """
 import pytest
 import json
+import os
 import re
+import stat
+from contextlib import nullcontext
+import threading
 from logging import DEBUG
+from types import SimpleNamespace
 from pkg_resources import resource_filename, resource_stream
 from ..scan import (validate_configuration, compile_map, files_to_hpss,
                     find_missing, process_missing, extract_directory_name,
-                    iterrsplit, scan_disk, scan_hpss, physical_disks, _options)
+                    iterrsplit, scan_disk, scan_hpss, scan_concurrently,
+                    physical_disks, literal_prefix, PatternDispatcher,
+                    _options)
+from .. import HpssOSError
 from .test_os import mock_call, MockFile
 
 
@@ -248,9 +256,32 @@ def test_options(monkeypatch):
     options = _options()
     assert options.test
     assert options.verbose
+    assert not options.recursive_hpss
+    assert not options.incremental_disk
+    assert not options.incremental_hpss
+    assert options.sessions == 1
+    assert options.disk_workers == 1
+    assert options.jobs == 1
+    assert not options.binary
+    assert options.compress is None
     assert options.config == 'config'
 
 
+def test_options_sessions(monkeypatch, capsys):
+    """Test parsing the number of hsi sessions.
+    """
+    monkeypatch.setattr('sys.argv', ['missing_from_hpss', '--hpss-sessions',
+                                     '0', 'config', 'release'])
+    options = _options()
+    assert options.sessions == 0
+    monkeypatch.setattr('sys.argv', ['missing_from_hpss', '--hpss-sessions',
+                                     '17', 'config', 'release'])
+    with pytest.raises(SystemExit):
+        _options()
+    captured = capsys.readouterr()
+    assert captured.err.endswith("argument -s/--hpss-sessions: must be between 0 and 16\n")
+
+
 def test_scan_hpss_cached(caplog):
     """Test scan_hpss() using an existing cache.
     """
@@ -270,9 +301,7 @@ def test_scan_hpss(monkeypatch, caplog, tmp_path, mock_call):
     f = MockFile(False, 'name')
     ff = MockFile(False, 'subname')
     ld = mock_call([[d, f], [ff]])
-    i = mock_call([False])
-    monkeypatch.setattr('hpsspy.os._os.listdir', ld)
-    monkeypatch.setattr('hpsspy.os._os.islink', i)
+    monkeypatch.setattr('hpsspy.os._os.iterdir', ld)
     caplog.set_level(DEBUG)
     cache = tmp_path / 'temp_hpss_cache.csv'
     # cache = resource_filename('hpsspy.test', 't/hpss_cache.csv')
@@ -287,6 +316,7 @@ def test_scan_hpss(monkeypatch, caplog, tmp_path, mock_call):
     assert caplog.records[2].levelname == 'DEBUG'
     assert caplog.records[2].message == "Scanning HPSS directory /hpss/root/subdir."
     expected_csv = """Name,Size,Mtime
+/path/subdir/,0,54321
 /path/name,12345,54321
 /path/subname,12345,54321
 """
@@ -295,7 +325,84 @@ def test_scan_hpss(monkeypatch, caplog, tmp_path, mock_call):
     assert data == expected_csv
     assert ld.args[0] == ('/hpss/root', )
     assert ld.args[1] == ('/hpss/root/subdir', )
-    assert i.args[0] == ('/hpss/root/subdir', )
+
+
+def test_scan_hpss_error(monkeypatch, caplog, tmp_path, mock_call):
+    """Test scan_hpss() with directories that can't be listed.
+    """
+    d = MockFile(True, 'subdir')
+    f = MockFile(False, 'name')
+    ld = mock_call([[d, f], []], raises=[None, HpssOSError('** Error!')])
+    monkeypatch.setattr('hpsspy.os._os.iterdir', ld)
+    cache = tmp_path / 'temp_hpss_cache.csv'
+    hpss_files = scan_hpss('/hpss/root', str(cache))
+    assert list(hpss_files) == ['/path/name']
+    assert caplog.records[-1].levelname == 'ERROR'
+    assert caplog.records[-1].message == '** Error!'
+    assert cache.exists()
+    #
+    # An unexpected failure leaves no cache behind.
+    #
+    ld = mock_call([[d, f], []], raises=[None, RuntimeError('unexpected')])
+    monkeypatch.setattr('hpsspy.os._os.iterdir', ld)
+    cache = tmp_path / 'new_hpss_cache.csv'
+    with pytest.raises(RuntimeError):
+        scan_hpss('/hpss/root', str(cache))
+    assert not cache.exists()
+    assert not (tmp_path / 'new_hpss_cache.csv.tmp').exists()
+
+
+def test_scan_hpss_incremental(monkeypatch, caplog, tmp_path, mock_call):
+    """Test updating an existing HPSS cache.
+    """
+    def entry(path, isdir, size, mtime):
+        return SimpleNamespace(path=path, isdir=isdir, islink=False,
+                               st_size=size, st_mtime=mtime)
+
+    cache = tmp_path / 'hpss_cache.csv'
+    cache.write_text("""Name,Size,Mtime
+a/,0,100
+c/,0,300
+gone/,0,500
+top.txt,4,4
+a/b/,0,200
+a/f1,1,1
+c/f3,3,3
+a/b/f2,2,2
+""")
+    ld = mock_call([[entry('/hpss/root/a', True, 0, 100),
+                     entry('/hpss/root/c', True, 0, 301),
+                     entry('/hpss/root/new.txt', False, 5, 5),
+                     entry('/hpss/root/top.txt', False, 4, 4)],
+                    [entry('/hpss/root/c/f3', False, 30, 30),
+                     entry('/hpss/root/c/f3.idx', False, 1, 30)]])
+    ls = mock_call([{'/hpss/root/a/b': entry('/hpss/root/a/b', True, 0, 200)}])
+    monkeypatch.setattr('hpsspy.scan.listdir', ld)
+    monkeypatch.setattr('hpsspy.scan.lstat_many', ls)
+    caplog.set_level(DEBUG)
+    hpss_files = scan_hpss('/hpss/root', str(cache), incremental=True)
+    assert ld.args == [('/hpss/root', ), ('/hpss/root/c', )]
+    assert ls.args == [(['/hpss/root/a/b'], )]
+    assert hpss_files == {'top.txt': (4, 4), 'new.txt': (5, 5),
+                          'c/f3': (30, 30), 'a/f1': (1, 1),
+                          'a/b/f2': (2, 2)}
+    assert caplog.records[0].message == f"Updating cache file {cache}, starting at /hpss/root."
+    assert caplog.records[3].message == "Reusing cache for HPSS directory /hpss/root/a."
+    assert cache.read_text() == """Name,Size,Mtime
+a/,0,100
+c/,0,301
+new.txt,5,5
+top.txt,4,4
+c/f3,30,30
+a/f1,1,1
+a/b/,0,200
+a/b/f2,2,2
+"""
+    assert not (tmp_path / 'hpss_cache.csv.tmp').exists()
+    #
+    # Without incremental, directories are not returned.
+    #
+    assert scan_hpss('/hpss/root', str(cache)) == hpss_files
 
 
 def test_scan_disk_cached(monkeypatch, caplog, mock_call):
@@ -310,48 +417,90 @@ def test_scan_disk_cached(monkeypatch, caplog, mock_call):
     assert caplog.records[0].message == "Using existing file cache: cache_file"
 
 
-def test_scan_disk(monkeypatch, caplog, tmp_path, mock_call):
+class MockDirEntry(object):
+    """Simple mock of :class:`os.DirEntry` for use with testing scan_disk().
+    """
+    def __init__(self, path, isdir=False, islink=False, raises=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.isdir = isdir
+        self.islink = islink
+        self.raises = raises
+
+    def is_symlink(self):
+        return self.islink
+
+    def stat(self, follow_symlinks=True):
+        if self.raises is not None:
+            raise self.raises
+        if self.isdir:
+            return SimpleNamespace(st_mode=stat.S_IFDIR | 0o755,
+                                   st_size=4096, st_mtime=54321)
+        return SimpleNamespace(st_mode=stat.S_IFREG | 0o644,
+                               st_size=12345, st_mtime=54321)
+
+
+class MockScandir(object):
+    """Replace :func:`os.scandir` with a fixed tree of entries.
+    """
+    def __init__(self, tree, raises=None):
+        self.tree = tree
+        self.raises = raises
+        self.args = []
+
+    def __call__(self, path):
+        self.args.append(path)
+        if self.raises is not None:
+            raise self.raises
+        if isinstance(self.tree[path], Exception):
+            raise self.tree[path]
+        return nullcontext(iter(self.tree[path]))
+
+
+def mock_tree(subname='subname', raises=None):
+    """Create a two-root tree for testing scan_disk().
+    """
+    return MockScandir({'/foo': [MockDirEntry('/foo/subdir', isdir=True),
+                                 MockDirEntry('/foo/name'),
+                                 MockDirEntry('/foo/link', islink=True)],
+                        '/foo/subdir': [MockDirEntry('/foo/subdir/subname')],
+                        '/bar': [MockDirEntry('/bar/subdir', isdir=True),
+                                 MockDirEntry('/bar/name')],
+                        '/bar/subdir': [MockDirEntry('/bar/subdir/' + subname,
+                                                     raises=raises)]})
+
+
+def test_scan_disk(monkeypatch, caplog, tmp_path):
     """Test the scan_disk() function.
     """
-    f = MockFile(False, 'name')
-    ff = MockFile(False, 'subname')
-    m = mock_call([[('/foo', ['subdir'], ['name']),
-                    ('/foo/subdir', [], ['subname'])],
-                   [('/bar', ['subdir'], ['name']),
-                    ('/bar/subdir', [], ['subname'])]])
-    # i = mock_call([False, False, False, False])
-    s = mock_call([f, f, ff, f, ff])
-    monkeypatch.setattr('os.walk', m)
-    # monkeypatch.setattr('os.path.islink', i)
-    monkeypatch.setattr('os.stat', s)
+    m = mock_tree()
+    monkeypatch.setattr('os.scandir', m)
     caplog.set_level(DEBUG)
     cache = tmp_path / 'cache_file.csv'
     foo = scan_disk(['/foo', '/bar'], str(cache), overwrite=True)
     assert foo
-    assert m.args[0] == ('/foo', )
-    assert m.args[1] == ('/bar', )
-    assert s.args[0] == (str(cache), )
-    assert s.args[1] == ('/foo/name', )
-    assert s.args[2] == ('/foo/subdir/subname', )
-    assert s.args[3] == ('/bar/name', )
-    assert s.args[4] == ('/bar/subdir/subname', )
+    assert m.args == ['/foo', '/foo/subdir', '/bar', '/bar/subdir']
     assert caplog.records[0].levelname == 'INFO'
     assert caplog.records[0].message == "No disk cache file, starting scan."
     assert caplog.records[1].levelname == 'DEBUG'
-    assert caplog.records[1].message == "Starting os.walk at /foo."
+    assert caplog.records[1].message == "Starting scan at /foo."
     assert caplog.records[2].levelname == 'DEBUG'
     assert caplog.records[2].message == "Scanning disk directory /foo."
     assert caplog.records[3].levelname == 'DEBUG'
     assert caplog.records[3].message == "Scanning disk directory /foo/subdir."
     assert caplog.records[4].levelname == 'DEBUG'
-    assert caplog.records[4].message == "Starting os.walk at /bar."
+    assert caplog.records[4].message == "Starting scan at /bar."
     assert caplog.records[5].levelname == 'DEBUG'
     assert caplog.records[5].message == "Scanning disk directory /bar."
     assert caplog.records[6].levelname == 'DEBUG'
     assert caplog.records[6].message == "Scanning disk directory /bar/subdir."
     expected_csv = """Name,Size,Mtime
+/foo/,0,0
+subdir/,0,54321
 name,12345,54321
 subdir/subname,12345,54321
+/bar/,0,0
+subdir/,0,54321
 name,12345,54321
 subdir/subname,12345,54321
 """
@@ -360,50 +509,86 @@ subdir/subname,12345,54321
     assert data == expected_csv
 
 
-def test_scan_disk_exception(monkeypatch, caplog, tmp_path, mock_call):
+def test_scan_disk_exception(monkeypatch, caplog, tmp_path):
     """Test the scan_disk() function, throwing an exception.
     """
     err = OSError(12345, 'foobar', 'foo.txt')
-    f = MockFile(False, 'name')
-    ff = MockFile(False, 'subname')
-    m = mock_call([[('/foo', ['subdir'], ['name']),
-                    ('/foo/subdir', [], ['subname'])],
-                   [('/bar', ['subdir'], ['name']),
-                    ('/bar/subdir', [], ['subname'])]], raises=err)
-    # i = mock_call([False, False, False, False])
-    s = mock_call([f, f, ff, f, ff])
-    monkeypatch.setattr('os.walk', m)
-    # monkeypatch.setattr('os.path.islink', i)
-    monkeypatch.setattr('os.stat', s)
+    m = MockScandir(dict(), raises=err)
+    monkeypatch.setattr('os.scandir', m)
     caplog.set_level(DEBUG)
     cache = tmp_path / 'cache_file.csv'
     foo = scan_disk(['/foo', '/bar'], str(cache), overwrite=True)
-    assert not foo
+    assert foo
+    assert m.args == ['/foo', '/bar']
     assert caplog.records[0].levelname == 'INFO'
     assert caplog.records[0].message == "No disk cache file, starting scan."
     assert caplog.records[1].levelname == 'DEBUG'
-    assert caplog.records[1].message == "Starting os.walk at /foo."
-    assert caplog.records[2].levelname == 'ERROR'
-    assert caplog.records[2].message == "Exception encountered while traversing /foo!"
+    assert caplog.records[1].message == "Starting scan at /foo."
+    assert caplog.records[2].levelname == 'DEBUG'
+    assert caplog.records[2].message == "Scanning disk directory /foo."
     assert caplog.records[3].levelname == 'ERROR'
-    assert caplog.records[3].message == "foobar"
+    assert caplog.records[3].message == "foobar: foo.txt"
+    assert caplog.records[4].levelname == 'DEBUG'
+    assert caplog.records[4].message == "Starting scan at /bar."
+    with cache.open() as csv:
+        data = csv.read()
+    assert data == 'Name,Size,Mtime\n/foo/,0,0\n/bar/,0,0\n'
+
+
+def test_scan_disk_unreadable_directory(monkeypatch, caplog, tmp_path):
+    """Test the scan_disk() function, with a directory that can't be read.
+    """
+    m = mock_tree()
+    err = PermissionError(13, 'Permission denied', '/foo/subdir')
+    m.tree['/foo/subdir'] = err
+    monkeypatch.setattr('os.scandir', m)
+    caplog.set_level(DEBUG)
+    cache = tmp_path / 'cache_file.csv'
+    foo = scan_disk(['/foo', '/bar'], str(cache), overwrite=True)
+    assert foo
+    assert m.args == ['/foo', '/foo/subdir', '/bar', '/bar/subdir']
+    assert caplog.records[4].levelname == 'ERROR'
+    assert caplog.records[4].message == "Permission denied: /foo/subdir"
+    with cache.open() as csv:
+        data = csv.read()
+    assert data == """Name,Size,Mtime
+/foo/,0,0
+subdir/,0,54321
+name,12345,54321
+subdir/,0,0
+/bar/,0,0
+subdir/,0,54321
+name,12345,54321
+subdir/subname,12345,54321
+"""
+    assert not (tmp_path / 'cache_file.csv.tmp').exists()
+    #
+    # The unreadable directory is scanned again by an incremental scan.
+    #
+    m = mock_tree()
+    monkeypatch.setattr('os.scandir', m)
+    assert scan_disk(['/foo', '/bar'], str(cache), incremental=True)
+    assert m.args == ['/foo', '/foo/subdir', '/bar']
+    with cache.open() as csv:
+        data = csv.read()
+    assert 'subdir/subname,12345,54321\n/bar/' in data
+    #
+    # An unexpected failure leaves no cache behind.
+    #
+    m = mock_tree(raises=RuntimeError('unexpected'))
+    monkeypatch.setattr('os.scandir', m)
+    with pytest.raises(RuntimeError):
+        scan_disk(['/foo', '/bar'], str(tmp_path / 'new.csv'))
+    assert not (tmp_path / 'new.csv').exists()
+    assert not (tmp_path / 'new.csv.tmp').exists()
 
 
-def test_scan_disk_stat_exception(monkeypatch, caplog, tmp_path, mock_call):
-    """Test the scan_disk() function, throwing an exception on os.stat.
+def test_scan_disk_stat_exception(monkeypatch, caplog, tmp_path):
+    """Test the scan_disk() function, throwing an exception on stat.
     """
     err = PermissionError(13, 'Permission denied', '/bar/subdir/subname')
-    f = MockFile(False, 'name')
-    ff = MockFile(False, 'subname')
-    m = mock_call([[('/foo', ['subdir'], ['name']),
-                    ('/foo/subdir', [], ['subname'])],
-                   [('/bar', ['subdir'], ['name']),
-                    ('/bar/subdir', [], ['subname'])]])
-    # i = mock_call([False, False, False, False])
-    s = mock_call([f, f, ff, f, ff], raises=[None, None, None, None, err])
-    monkeypatch.setattr('os.walk', m)
-    # monkeypatch.setattr('os.path.islink', i)
-    monkeypatch.setattr('os.stat', s)
+    m = mock_tree(raises=err)
+    monkeypatch.setattr('os.scandir', m)
     caplog.set_level(DEBUG)
     cache = tmp_path / 'cache_file.csv'
     foo = scan_disk(['/foo', '/bar'], str(cache), overwrite=True)
@@ -411,35 +596,29 @@ def test_scan_disk_stat_exception(monkeypatch, caplog, tmp_path, mock_call):
     assert caplog.records[0].levelname == 'INFO'
     assert caplog.records[0].message == "No disk cache file, starting scan."
     assert caplog.records[1].levelname == 'DEBUG'
-    assert caplog.records[1].message == "Starting os.walk at /foo."
+    assert caplog.records[1].message == "Starting scan at /foo."
     assert caplog.records[2].levelname == 'DEBUG'
     assert caplog.records[2].message == "Scanning disk directory /foo."
     assert caplog.records[3].levelname == 'DEBUG'
     assert caplog.records[3].message == "Scanning disk directory /foo/subdir."
     assert caplog.records[4].levelname == 'DEBUG'
-    assert caplog.records[4].message == "Starting os.walk at /bar."
+    assert caplog.records[4].message == "Starting scan at /bar."
     assert caplog.records[5].levelname == 'DEBUG'
     assert caplog.records[5].message == "Scanning disk directory /bar."
     assert caplog.records[6].levelname == 'DEBUG'
     assert caplog.records[6].message == "Scanning disk directory /bar/subdir."
     assert caplog.records[7].levelname == 'ERROR'
     assert caplog.records[7].message == "Permission denied: /bar/subdir/subname"
+    with cache.open() as csv:
+        data = csv.read()
+    assert data.endswith('/bar/,0,0\nsubdir/,0,54321\nname,12345,54321\n')
 
 
-def test_scan_disk_weird_filename(monkeypatch, caplog, tmp_path, mock_call):
+def test_scan_disk_weird_filename(monkeypatch, caplog, tmp_path):
     """Test the scan_disk() function, with an oddball filename.
     """
-    f = MockFile(False, 'name')
-    ff = MockFile(False, 'subname')
-    m = mock_call([[('/foo', ['subdir'], ['name']),
-                    ('/foo/subdir', [], ['subname'])],
-                   [('/bar', ['subdir'], ['name']),
-                    ('/bar/subdir', [], ['Vpeak60_subhalos_id-\udcecd-upid.h5'])]])
-    # i = mock_call([False, False, False, False])
-    s = mock_call([f, f, ff, f, ff])
-    monkeypatch.setattr('os.walk', m)
-    # monkeypatch.setattr('os.path.islink', i)
-    monkeypatch.setattr('os.stat', s)
+    m = mock_tree(subname='Vpeak60_subhalos_id-\udcecd-upid.h5')
+    monkeypatch.setattr('os.scandir', m)
     caplog.set_level(DEBUG)
     cache = tmp_path / 'cache_file.csv'
     foo = scan_disk(['/foo', '/bar'], str(cache), overwrite=True)
@@ -447,13 +626,13 @@ def test_scan_disk_weird_filename(monkeypatch, caplog, tmp_path, mock_call):
     assert caplog.records[0].levelname == 'INFO'
     assert caplog.records[0].message == "No disk cache file, starting scan."
     assert caplog.records[1].levelname == 'DEBUG'
-    assert caplog.records[1].message == "Starting os.walk at /foo."
+    assert caplog.records[1].message == "Starting scan at /foo."
     assert caplog.records[2].levelname == 'DEBUG'
     assert caplog.records[2].message == "Scanning disk directory /foo."
     assert caplog.records[3].levelname == 'DEBUG'
     assert caplog.records[3].message == "Scanning disk directory /foo/subdir."
     assert caplog.records[4].levelname == 'DEBUG'
-    assert caplog.records[4].message == "Starting os.walk at /bar."
+    assert caplog.records[4].message == "Starting scan at /bar."
     assert caplog.records[5].levelname == 'DEBUG'
     assert caplog.records[5].message == "Scanning disk directory /bar."
     assert caplog.records[6].levelname == 'DEBUG'
@@ -464,6 +643,182 @@ def test_scan_disk_weird_filename(monkeypatch, caplog, tmp_path, mock_call):
     assert caplog.records[8].message == r"Message was: 'utf-8' codec can't encode character '\udcec' in position 27: surrogates not allowed."
 
 
+def test_scan_disk_parallel(tmp_path, caplog):
+    """Test the scan_disk() function with several threads.
+    """
+    roots = [tmp_path / 'foo', tmp_path / 'bar']
+    for root in roots:
+        for d in range(5):
+            (root / 'a{0:d}'.format(d) / 'b').mkdir(parents=True)
+            for f in ('a{0:d}/x.txt'.format(d), 'a{0:d}/b/y.txt'.format(d)):
+                (root / f).write_bytes(b'x' * (d + 1))
+    serial = tmp_path / 'serial.csv'
+    parallel = tmp_path / 'parallel.csv'
+    assert scan_disk([str(r) for r in roots], str(serial))
+    caplog.set_level(DEBUG)
+    assert scan_disk([str(r) for r in roots], str(parallel), workers=4)
+    messages = [r.message for r in caplog.records]
+    assert "Starting scan at {0}.".format(str(roots[0])) in messages
+    assert "Scanning disk directory {0}.".format(str(roots[1] / 'a4' / 'b')) in messages
+    assert sorted(tmp_path.glob('*.tmp')) == []
+
+    def split(cache):
+        with cache.open() as csv:
+            lines = csv.readlines()
+        i = lines.index(str(roots[1]) + '/,0,0\n')
+        return (lines[0], lines[1], sorted(lines[2:i]), lines[i],
+                sorted(lines[i+1:]))
+
+    assert split(parallel) == split(serial)
+    assert len(split(parallel)[2]) == 20
+
+
+def test_scan_disk_parallel_exception(monkeypatch, caplog, tmp_path):
+    """Test the scan_disk() function with several threads, throwing an exception.
+    """
+    err = OSError(12345, 'foobar', 'foo.txt')
+    m = MockScandir(dict(), raises=err)
+    monkeypatch.setattr('os.scandir', m)
+    caplog.set_level(DEBUG)
+    cache = tmp_path / 'cache_file.csv'
+    foo = scan_disk(['/foo'], str(cache), overwrite=True, workers=2)
+    assert foo
+    messages = [(r.levelname, r.message) for r in caplog.records]
+    assert ('ERROR', "foobar: foo.txt") in messages
+    assert [p for p in os.listdir(tmp_path) if p.endswith('.tmp')] == []
+
+
+def test_scan_disk_incremental(tmp_path, caplog):
+    """Test the scan_disk() function, updating an existing cache.
+    """
+    root = tmp_path / 'root'
+    (root / 'a' / 'b').mkdir(parents=True)
+    (root / 'c').mkdir()
+    for f, size in (('top.txt', 1), ('a/a.txt', 2),
+                    ('a/b/b.txt', 3), ('c/c.txt', 4)):
+        (root / f).write_bytes(b'x' * size)
+        os.utime(root / f, (1000, 1000))
+    for d in ('a/b', 'a', 'c', '.'):
+        os.utime(root / d, (2000, 2000))
+    cache = tmp_path / 'cache_file.csv'
+    assert scan_disk([str(root)], str(cache))
+    with cache.open() as csv:
+        original = sorted(csv.readlines())
+    assert original == sorted(['Name,Size,Mtime\n',
+                               str(root) + '/,0,0\n',
+                               'a/,0,2000\n',
+                               'a/b/,0,2000\n',
+                               'c/,0,2000\n',
+                               'top.txt,1,1000\n',
+                               'a/a.txt,2,1000\n',
+                               'a/b/b.txt,3,1000\n',
+                               'c/c.txt,4,1000\n'])
+    #
+    # Unchanged directories are not scanned, so a file modified in
+    # place is not noticed.
+    #
+    (root / 'c' / 'c.txt').write_bytes(b'x' * 40)
+    os.utime(root / 'c', (2000, 2000))
+    (root / 'a' / 'b' / 'new.txt').write_bytes(b'x' * 5)
+    os.utime(root / 'a' / 'b' / 'new.txt', (3000, 3000))
+    os.utime(root / 'a' / 'b', (3000, 3000))
+    caplog.set_level(DEBUG)
+    assert scan_disk([str(root)], str(cache), incremental=True)
+    assert caplog.records[0].message == "Updating disk cache file {0}.".format(str(cache))
+    messages = [r.message for r in caplog.records]
+    assert "Reusing cache for disk directory {0}.".format(str(root / 'a')) in messages
+    assert "Reusing cache for disk directory {0}.".format(str(root / 'c')) in messages
+    assert "Scanning disk directory {0}.".format(str(root / 'a' / 'b')) in messages
+    assert not (tmp_path / 'cache_file.csv.tmp').exists()
+    with cache.open() as csv:
+        updated = sorted(csv.readlines())
+    expected = [line for line in original if line != 'a/b/,0,2000\n']
+    expected += ['a/b/,0,3000\n', 'a/b/new.txt,5,3000\n']
+    assert updated == sorted(expected)
+
+
+def test_scan_concurrently(caplog):
+    """Test running scans at the same time.
+    """
+    caplog.set_level(DEBUG)
+    barrier = threading.Barrier(2, timeout=5)
+    finished = threading.Event()
+
+    def first():
+        barrier.wait()
+        return 'first'
+
+    def second():
+        barrier.wait()
+        finished.wait(5)
+        return 'second'
+
+    def third():
+        raise ValueError('third')
+
+    def report(record):
+        if record.getMessage().startswith('Still running'):
+            finished.set()
+        return True
+
+    caplog.handler.addFilter(report)
+    results = scan_concurrently({'HPSS': first, 'disk': second},
+                                interval=0.01)
+    assert results == {'HPSS': 'first', 'disk': 'second'}
+    messages = [r.message for r in caplog.records]
+    assert messages[0] == 'Starting HPSS scan.'
+    assert messages[1] == 'Starting disk scan.'
+    assert [m for m in messages if m.startswith('Finished HPSS scan after')]
+    assert [m for m in messages if m.startswith('Still running')]
+    assert messages[-1].startswith('Finished disk scan after')
+    with pytest.raises(ValueError):
+        scan_concurrently({'HPSS': lambda: 'first', 'disk': third})
+
+
+@pytest.mark.parametrize('pattern,prefix', [
+    (r'd2/spectro/redux/([0-9a-zA-Z_-]+)/[^/]+$', 'd2/spectro/redux/'),
+    (r'd1/batch/.*$', 'd1/batch/'),
+    (r'[^/]+$', ''),
+    (r'd2/(batch|fiberassign)/.*$', 'd2/'),
+    (r'd2/batch|d2/fiberassign', ''),
+    (r'd2/[a|b]c', 'd2/'),
+    (r'd2/foo\.bar/\d+', 'd2/foo.bar/'),
+    (r'abc?', 'ab'),
+    (r'ab*c', 'a'),
+    (r'ab+c', 'ab'),
+    (r'ab{2}c', 'a'),
+    (r'(?i)abc', ''),
+])
+def test_literal_prefix(pattern, prefix):
+    """Test finding the literal prefix of a regular expression.
+    """
+    assert literal_prefix(pattern) == prefix
+
+
+def test_PatternDispatcher(test_config):
+    """Test finding matching patterns with a trie.
+    """
+    hpss_map = compile_map(test_config.config, 'data')
+    d = PatternDispatcher(hpss_map['d2'])
+    assert d.candidates('d2/README.txt') == (0, 1)
+    assert d.candidates('d2/spectro/redux/v1/foo.fits') == (0, 1, 2, 3, 4, 5, 6)
+    assert d.candidates('d2/targets/1234/foo.fits') == (0, 1, 8, 9)
+    assert d.candidates('d2/targets/1234/f.fits') is d.candidates('d2/targets/1234/foo.fits')
+    names = ['d2/README.txt',
+             'd2/batch/foo.sh',
+             'd2/spectro/redux/v1/preproc/foo.fits',
+             'd2/spectro/redux/v1/foo.fits',
+             'd2/spectro/redux/v1/exposures/20240101/foo.fits',
+             'd2/spectro/redux/v1/spectra-64/1234/foo.fits',
+             'd2/spectro/sim/v1/20240101/foo.fits',
+             'd2/targets/1234/foo.fits',
+             'd2/unknown/foo.fits']
+    for name in names:
+        assert d.match(name) == [r for r in hpss_map['d2']
+                                 if r[0].match(name) is not None]
+    assert d.match('d2/unknown/foo.fits') == []
+
+
 def test_find_missing(test_config, tmpdir, caplog):
     """Test comparison of disk files to HPSS files.
     """
@@ -648,6 +1003,33 @@ def test_find_missing_multiple_files(test_config, tmpdir, caplog):
     assert caplog.records[11].message == "Some files would be backed up more than once with this configuration!"
 
 
+@pytest.mark.parametrize('cache', ['t/test_scan_disk_cache.csv',
+                                   't/test_scan_disk_cache_missing.csv',
+                                   't/test_scan_disk_cache_multiple.csv'])
+def test_find_missing_parallel(test_config, tmpdir, caplog, cache):
+    """Test comparison of disk files to HPSS files with several processes.
+    """
+    caplog.set_level(DEBUG)
+    hpss_map = compile_map(test_config.config, 'data')
+    hpss_files = {'data_files.tar': (1000, 1552494004),
+                  'd1/batch.tar': (1000, 1552494004),
+                  'd1/SINGLE_FILE.txt': (100, 1552494004)}
+    disk_files_cache = resource_filename('hpsspy.test', cache)
+    results = list()
+    for processes in (1, 2):
+        caplog.clear()
+        missing_files = tmpdir.join('missing_files_{0:d}.json'.format(processes))
+        status = find_missing(hpss_map, hpss_files, disk_files_cache,
+                              str(missing_files), report=2, limit=1,
+                              processes=processes, chunksize=3)
+        with missing_files.open() as j:
+            missing = j.read()
+        results.append((status, missing,
+                        [(r.levelname, r.message) for r in caplog.records]))
+    assert results[1] == results[0]
+    assert ('INFO', '        2 files scanned.') in results[1][2]
+
+
 def test_process_missing(monkeypatch, caplog, mock_call):
     """Test conversion of missing files into HPSS commands.
     """
@@ -658,6 +1040,19 @@ def test_process_missing(monkeypatch, caplog, mock_call):
     htar = mock_call([('out', ''), ('out', 'err'), ('out', ''), ('out', '')])
     hsi = mock_call(['OK', 'OK', 'OK', 'OK', 'OK', 'OK'])
     listdir = mock_call([('01', '02')])
+    batches = list()
+
+    def batch_call(command, stdout, stderr):
+        with open(command[-1]) as c:
+            lines = c.read().splitlines()
+        batches.append((command, lines))
+        for line in lines:
+            if line.startswith('!echo '):
+                stdout.write((line[6:] + '\n').encode())
+            else:
+                stdout.write(b'OK\n')
+        return 0
+
     monkeypatch.setenv('HPSS_DIR', '/usr/local')
     monkeypatch.setattr('os.getcwd', getcwd)
     monkeypatch.setattr('os.chdir', chdir)
@@ -665,7 +1060,7 @@ def test_process_missing(monkeypatch, caplog, mock_call):
     monkeypatch.setattr('os.listdir', listdir)
     monkeypatch.setattr('hpsspy.scan.htar', htar)
     monkeypatch.setattr('hpsspy.os._os.hsi', hsi)
-    monkeypatch.setattr('hpsspy.scan.hsi', hsi)
+    monkeypatch.setattr('hpsspy.util.call', batch_call)
     caplog.set_level(DEBUG)
     process_missing(missing_cache, '/disk/root', '/hpss/root')
     assert chdir.args[0] == ('/disk/root/files', )
@@ -715,20 +1110,27 @@ def test_process_missing(monkeypatch, caplog, mock_call):
     assert caplog.records[16].message == "makedirs('/hpss/root/big_file', mode='2770')"
     assert caplog.records[17].levelname == 'INFO'
     assert caplog.records[17].message == "hsi('put', '/disk/root/big_file/test_basic_file.dump', ':', '/hpss/root/big_file/test_basic_file.dump')"
-    assert caplog.records[18].levelname == 'DEBUG'
-    assert caplog.records[18].message == "OK"
-
-    assert caplog.records[19].levelname == 'ERROR'
-    assert caplog.records[19].message == "Could not find directories corresponding to bad_dir/test_basic_htar.tar!"
+    assert caplog.records[18].levelname == 'ERROR'
+    assert caplog.records[18].message == "Could not find directories corresponding to bad_dir/test_basic_htar.tar!"
 
+    assert caplog.records[19].levelname == 'DEBUG'
+    assert caplog.records[19].message == "Running 2 batched hsi commands."
     assert caplog.records[20].levelname == 'DEBUG'
-    assert caplog.records[20].message == "os.chdir('/working/directory')"
+    assert caplog.records[20].message == "OK\n"
+    assert caplog.records[21].levelname == 'DEBUG'
+    assert caplog.records[21].message == "OK\n"
+
+    assert caplog.records[22].levelname == 'DEBUG'
+    assert caplog.records[22].message == "os.chdir('/working/directory')"
 
     assert hsi.args[0] == ('mkdir', '-p', '-m', '2770', '/hpss/root/files')
     assert hsi.args[1] == ('mkdir', '-p', '-m', '2770', '/hpss/root')
     assert hsi.args[2] == ('mkdir', '-p', '-m', '2770', '/hpss/root/dir_set')
-    assert hsi.args[3] == ('mkdir', '-p', '-m', '2770', '/hpss/root/big_file')
-    assert hsi.args[4] == ('put', '/disk/root/big_file/test_basic_file.dump', ':', '/hpss/root/big_file/test_basic_file.dump')
+    assert len(hsi.args) == 3
+    assert len(batches) == 1
+    assert batches[0][0][:4] == ['/usr/local/bin/hsi', '-s', 'archive', 'in']
+    assert batches[0][1][0] == 'mkdir -p -m 2770 /hpss/root/big_file'
+    assert batches[0][1][2] == 'put /disk/root/big_file/test_basic_file.dump : /hpss/root/big_file/test_basic_file.dump'
 
     assert htar.args[0] == ('-cvf', '/hpss/root/files/test_basic_htar.tar', '-H', 'crc:verify=all', 'test_basic_htar')
     assert htar.args[1] == ('-cvf', '/hpss/root/test_basic_files.tar', '-H', 'crc:verify=all', '-L', Lfile)
@@ -752,7 +1154,6 @@ def test_process_missing_test_mode(monkeypatch, caplog, mock_call):
     monkeypatch.setattr('os.listdir', listdir)
     monkeypatch.setattr('hpsspy.scan.htar', htar)
     monkeypatch.setattr('hpsspy.os._os.hsi', hsi)
-    monkeypatch.setattr('hpsspy.scan.hsi', hsi)
     caplog.set_level(DEBUG)
     process_missing(missing_cache, '/disk/root', '/hpss/root', dirmode='2775', test=True)
     assert chdir.args[0] == ('/disk/root/files', )
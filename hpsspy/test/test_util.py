@@ -7,12 +7,61 @@ hpsspy.test.test_util
 Test the functions in the util subpackage.
 """
 import pytest
+import json
 import os
 import stat
+import sys
+import threading
 from datetime import datetime
-from .. import HpssOSError
-from ..util import HpssFile, get_hpss_dir, get_tmpdir, hsi, htar
-from .test_os import mock_call, MockFile
+from .. import HpssError, HpssOSError
+from ..util import (HpssFile, HpssFileTable, HsiBatch, HsiPool, HsiSession,
+                    MetadataCache, _file_mode, current_session, get_hpss_dir,
+                    get_tmpdir, hsi, hsi_iter, htar)
+from ..os import stat as hpss_stat, walk
+from .test_os import mock_call, MockFile, recursive_listing
+
+
+@pytest.fixture
+def fake_hsi(monkeypatch, tmp_path):
+    """Install a fake, interactive :command:`hsi` in a temporary HPSS_DIR.
+
+    The fake prints a login banner, echoes shell-escape ``echo`` commands,
+    prints the canned output of any command found in ``listings.json``
+    in the same directory, and otherwise just reports the command it
+    received.
+    """
+    script = f"""#!{sys.executable}
+import json
+import os
+import sys
+listings = os.path.join(os.path.dirname(sys.argv[0]), 'listings.json')
+if os.path.exists(listings):
+    with open(listings) as j:
+        listings = json.load(j)
+else:
+    listings = dict()
+print('Fake HPSS login banner.', flush=True)
+for line in sys.stdin:
+    command = line.strip()
+    if command == 'quit':
+        break
+    elif command == 'crash':
+        sys.exit(1)
+    elif command.startswith('!echo '):
+        print(command[6:], flush=True)
+    elif command in listings:
+        print(listings[command], end='', flush=True)
+    else:
+        print('[HSI]/home/b/bweaver->' + command, flush=True)
+        print('fake: ' + command, file=sys.stderr, flush=True)
+"""
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    hsi_path = bindir / 'hsi'
+    hsi_path.write_text(script)
+    hsi_path.chmod(0o755)
+    monkeypatch.setenv('HPSS_DIR', str(tmp_path))
+    return hsi_path
 
 
 def test_HpssFile():
@@ -24,13 +73,13 @@ def test_HpssFile():
     links = ('/nersc/projects/boss', '/nersc/projects/cosmo',
              '/nersc/projects/desi', True, False, False, False)
     modes = (511, 511, 511, 1517, 432, 432, 432)
-    mtimes = (datetime(2008, 4, 3, 13, 4, 5, tzinfo=HpssFile._pacific),
-              datetime(2014, 8, 22, 11, 32, 9, tzinfo=HpssFile._pacific),
-              datetime(2013, 12, 16, 15, 12, 59, tzinfo=HpssFile._pacific),
-              datetime(2022, 4, 4, 13, 14, 15, tzinfo=HpssFile._pacific),
-              datetime(2021, 7, 3, 12, 34, 56, tzinfo=HpssFile._pacific),
-              datetime(2016, 2, 2, 9, 2, 7, tzinfo=HpssFile._pacific),
-              datetime(2016, 2, 2, 9, 2, 13, tzinfo=HpssFile._pacific))
+    mtimes = (HpssFile._pacific.localize(datetime(2008, 4, 3, 13, 4, 5)),
+              HpssFile._pacific.localize(datetime(2014, 8, 22, 11, 32, 9)),
+              HpssFile._pacific.localize(datetime(2013, 12, 16, 15, 12, 59)),
+              HpssFile._pacific.localize(datetime(2022, 4, 4, 13, 14, 15)),
+              HpssFile._pacific.localize(datetime(2021, 7, 3, 12, 34, 56)),
+              HpssFile._pacific.localize(datetime(2016, 2, 2, 9, 2, 7)),
+              HpssFile._pacific.localize(datetime(2016, 2, 2, 9, 2, 13)))
     data = (('l', 'rwxrwxrwx', 1, 'bweaver', 'bweaver', 20, 'Thu', 'Apr', 3, '13:04:05', 2008, 'boss@ -> /nersc/projects/boss'),
             ('l', 'rwxrwxrwx', 1, 'bweaver', 'bweaver', 21, 'Fri', 'Aug', 22, '11:32:09', 2014, 'cosmo@ -> /nersc/projects/cosmo'),
             ('l', 'rwxrwxrwx', 1, 'bweaver', 'bweaver', 20, 'Mon', 'Dec', 16, '15:12:59', 2013, 'desi@ -> /nersc/projects/desi'),
@@ -74,7 +123,38 @@ def test_HpssFile():
                 assert f.htar_contents() == htar_data
             else:
                 assert f.htar_contents() is None
-        assert f.st_mtime == int(mtimes[i].strftime('%s'))
+        assert f.st_mtime == int(mtimes[i].timestamp())
+
+
+def test_HpssFile_compact():
+    """Test the compact representation of HpssFile.
+    """
+    f = HpssFile('/home/b/' + 'bweaver', '-', 'rw-rw----', 1, 'bwea' + 'ver',
+                 'bweaver', 100, 'Sun', 'Dec', 31, '23:59:59', 2023, 'a.txt')
+    g = HpssFile('/home/b/bweaver', '-', 'rw-rw----', 1, 'bweaver',
+                 'bweaver', 100, 'Mon', 'Jan', 1, '00:00:00', 2024, 'b.txt')
+    assert not hasattr(f, '__dict__')
+    assert f.hpss_path is g.hpss_path
+    assert f.st_uid is g.st_gid
+    assert (f.raw_dow, f.raw_month, f.raw_day, f.raw_hms, f.raw_year) == ('Sun', 'Dec', 31, '23:59:59', 2023)
+    assert (g.raw_dow, g.raw_month, g.raw_day, g.raw_hms, g.raw_year) == ('Mon', 'Jan', 1, '00:00:00', 2024)
+    with pytest.raises(AttributeError):
+        f.foo = 'bar'
+
+
+def test_HpssFile_st_mtime(monkeypatch):
+    """Test modification times around daylight saving transitions.
+    """
+    monkeypatch.setenv('TZ', 'UTC')
+    times = (('Sun', 'Mar', 10, '01:59:59', 2024, 1710064799),
+             ('Sun', 'Mar', 10, '03:00:00', 2024, 1710064800),
+             ('Sun', 'Nov', 3, '00:30:00', 2024, 1730619000),
+             ('Sun', 'Nov', 3, '02:30:00', 2024, 1730629800),
+             ('Thu', 'Jan', 1, '00:00:00', 1970, 28800))
+    for dow, month, day, hms, year, mtime in times:
+        f = HpssFile('/home/b/bweaver', '-', 'rw-rw----', 1, 'bweaver',
+                     'bweaver', 100, dow, month, day, hms, year, 'a.txt')
+        assert f.st_mtime == mtime
 
 
 def test_HpssFile_unusual_mode():
@@ -130,6 +210,11 @@ def test_HpssFile_st_mode():
     f = HpssFile(lspath, '-', 'rwsrwSrwT', 1, 'bweaver', 'bweaver',
                  1000, 'Tue', 'Feb', 2, '09:02:07', 2016, 'fake.file')
     assert f.st_mode == 36854
+    hits = _file_mode.cache_info().hits
+    g = HpssFile(lspath, '-', 'rwsrwSrwT', 1, 'bweaver', 'bweaver',
+                 1000, 'Tue', 'Feb', 2, '09:02:07', 2016, 'other.file')
+    assert g.st_mode == 36854
+    assert _file_mode.cache_info().hits == hits + 1
 
 
 def test_HpssFile_isdir(monkeypatch, mock_call):
@@ -138,7 +223,7 @@ def test_HpssFile_isdir(monkeypatch, mock_call):
     lspath = '/home/b/bweaver'
     m = MockFile(True, 'foo')
     s = mock_call([m])
-    monkeypatch.setattr('hpsspy.os.stat', s)
+    monkeypatch.setattr('hpsspy.os._os.stat', s)
     f = HpssFile(lspath, 'l', 'rwxrwxrwx', 1, 'bweaver', 'bweaver',
                  21, 'Fri', 'Aug', 22, '11:32:09', 2014, 'cosmo@ -> /nersc/projects/cosmo')
     assert f.islink
@@ -146,13 +231,29 @@ def test_HpssFile_isdir(monkeypatch, mock_call):
     assert s.args[0] == ('/nersc/projects/cosmo', )
 
 
+def test_HpssFile_isdir_cached(monkeypatch, mock_call):
+    """Test that symbolic links are only resolved once.
+    """
+    lspath = '/home/b/bweaver'
+    s = mock_call([MockFile(True, 'foo')])
+    monkeypatch.setattr('hpsspy.os._os.stat', s)
+    args = (lspath, 'l', 'rwxrwxrwx', 1, 'bweaver', 'bweaver',
+            21, 'Fri', 'Aug', 22, '11:32:09', 2014, 'cosmo@ -> ../cosmo')
+    f = HpssFile(*args)
+    assert f.isdir
+    assert f.isdir
+    g = HpssFile(*args)
+    assert g.isdir
+    assert s.args == [('/home/b/bweaver/../cosmo', )]
+
+
 def test_HpssFile_isdir_file(monkeypatch, mock_call):
     """Test the isdir property on symbolic link pointing to a file.
     """
     lspath = '/home/b/bweaver'
     m = MockFile(False, 'foo')
     s = mock_call([m])
-    monkeypatch.setattr('hpsspy.os.stat', s)
+    monkeypatch.setattr('hpsspy.os._os.stat', s)
     f = HpssFile(lspath, 'l', 'rwxrwxrwx', 1, 'bweaver', 'bweaver',
                  21, 'Fri', 'Aug', 22, '11:32:09', 2014, 'cosmo@ -> cosmo.txt')
     assert f.islink
@@ -160,6 +261,73 @@ def test_HpssFile_isdir_file(monkeypatch, mock_call):
     assert s.args[0] == ('/home/b/bweaver/cosmo.txt', )
 
 
+def test_HpssFileTable(monkeypatch, mock_call):
+    """Test columnar storage of file metadata.
+    """
+    d = HpssFile('/top', 'd', 'rwxr-sr-x', 3, 'bweaver', 'bweaver',
+                 512, 'Mon', 'Apr', 4, '13:14:15', 2022, 'sub')
+    l = HpssFile('/top', 'l', 'rwxrwxrwx', 1, 'bweaver', 'bweaver',
+                 20, 'Thu', 'Apr', 3, '13:04:05', 2008, 'boss@ -> /boss')
+    f = HpssFile('/top/sub', '-', 'rw-rw----', 1, 'bweaver', 'bweaver',
+                 100, 'Sat', 'Jul', 3, '12:34:56', 2021, 'README.rst')
+    w = mock_call([[('/top', [d, l], []), ('/top/sub', [], [f])]])
+    monkeypatch.setattr('hpsspy.os.walk', w)
+    t = HpssFileTable.from_walk('/top', followlinks=True)
+    assert w.args[0] == ('/top', )
+    assert w.kwargs[0] == {'followlinks': True}
+    assert len(t) == 3
+    assert t.directories == ['/top', '/top/sub']
+    assert list(t.parent) == [0, 0, 1]
+    assert list(t.paths()) == ['/top/sub', '/top/boss', '/top/sub/README.rst']
+    assert list(t.st_size) == [512, 20, 100]
+    assert list(t.st_mtime) == [d.st_mtime, l.st_mtime, f.st_mtime]
+    assert list(t.st_mode) == [d.st_mode, l.st_mode, f.st_mode]
+    assert list(t.st_nlink) == [3, 1, 1]
+    assert list(t.isdir()) == [1, 0, 0]
+    assert list(t.islink()) == [0, 1, 0]
+    assert t[2] == ('/top/sub/README.rst', 100, f.st_mtime)
+
+
+def test_MetadataCache(monkeypatch):
+    """Test expiration and eviction of cached metadata.
+    """
+    now = [100.0]
+    monkeypatch.setattr('hpsspy.util.time.monotonic', lambda: now[0])
+    c = MetadataCache(ttl=10, maxsize=3)
+    c.set('stat', '/a', 1)
+    c.set('stat', '/a/b/', 2)
+    c.set('listdir', '/a/b', 3)
+    assert c.get('stat', '/a') == 1
+    assert c.get('stat', '/a/b') == 2
+    c.set('stat', '/a/b/c', 4)
+    assert len(c) == 3
+    assert c.get('listdir', '/a/b') is None
+    now[0] = 105.0
+    c.set('stat', '/x', 5)
+    now[0] = 110.5
+    assert c.get('stat', '/a') is None
+    assert c.get('stat', '/x') == 5
+    assert (c.hits, c.misses) == (3, 2)
+    c.set('stat', '/a', 1)
+    c.set('listdir', '/a/b', 3)
+    c.invalidate('/a/b/c')
+    assert c.get('stat', '/a') == 1
+    assert c.get('listdir', '/a/b') is None
+    c.set('listdir', '/a/b', 3)
+    c.invalidate('/a/b/c', parents=True)
+    assert c.get('stat', '/a') is None
+    c.configure(ttl=None)
+    c.set('stat', '/a', 1)
+    now[0] = 1e9
+    assert c.get('stat', '/a') == 1
+    c.configure(enabled=False)
+    assert len(c) == 0
+    c.set('stat', '/a', 1)
+    assert c.get('stat', '/a') is None
+    c.clear()
+    assert (c.hits, c.misses) == (0, 0)
+
+
 def test_get_hpss_dir(monkeypatch):
     """Test searching for the HPSS_DIR variable.
     """
@@ -178,21 +346,282 @@ def test_get_tmpdir(monkeypatch):
     assert get_tmpdir() == '/tmp'
 
 
-def test_hsi(monkeypatch, tmp_path, mock_call):
+def test_hsi(monkeypatch, tmp_path):
     """Test passing arguments to the hsi command.
     """
-    m = mock_call([0])
+    commands = list()
+
+    def fake_call(command):
+        commands.append(command)
+        with open(command[2], 'w') as t:
+            t.write('This is a test.')
+        return 0
+
     monkeypatch.setenv('TMPDIR', str(tmp_path))
     monkeypatch.setenv('HPSS_DIR', '/foo/bar')
-    monkeypatch.setattr('hpsspy.util.call', m)
-    txt = tmp_path / 'hsi.txt'
-    with open(txt, 'w') as t:
-        t.write('This is a test.')
-    pre_command = ['-O', str(txt), '-s', 'archive']
+    monkeypatch.setattr('hpsspy.util.call', fake_call)
     command = ['ls', '-l', 'foo']
     out = hsi(*command)
     assert out.strip() == 'This is a test.'
-    assert m.args[0] == (['/foo/bar/bin/hsi'] + pre_command + command, )
+    assert commands[0][0] == '/foo/bar/bin/hsi'
+    assert commands[0][1] == '-O'
+    assert os.path.dirname(commands[0][2]) == str(tmp_path)
+    assert os.path.basename(commands[0][2]).startswith('hsi-')
+    assert commands[0][3:] == ['-s', 'archive'] + command
+    assert list(tmp_path.iterdir()) == []
+    out = hsi(*command)
+    assert commands[1][2] != commands[0][2]
+
+
+def test_hsi_concurrent(monkeypatch, tmp_path):
+    """Test that concurrent hsi calls do not share output files.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fake_call(command):
+        with open(command[2], 'w') as t:
+            t.write(command[-1])
+        return 0
+
+    monkeypatch.setenv('HPSS_DIR', '/foo/bar')
+    monkeypatch.setattr('hpsspy.util.call', fake_call)
+    with ThreadPoolExecutor(max_workers=8) as e:
+        results = list(e.map(lambda i: hsi('ls', str(i), tmpdir=str(tmp_path)),
+                             range(100)))
+    assert results == [str(i) for i in range(100)]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_hsi_iter(monkeypatch, tmp_path):
+    """Test reading hsi output line by line.
+    """
+    def fake_call(command):
+        with open(command[2], 'w') as t:
+            t.write('line 1\nline 2\n')
+        return 0
+
+    monkeypatch.setenv('TMPDIR', str(tmp_path))
+    monkeypatch.setenv('HPSS_DIR', '/foo/bar')
+    monkeypatch.setattr('hpsspy.util.call', fake_call)
+    lines = hsi_iter('ls', '-l', 'foo')
+    assert next(lines) == 'line 1\n'
+    assert len(list(tmp_path.iterdir())) == 1
+    assert list(lines) == ['line 2\n']
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_hsi_session(fake_hsi):
+    """Test running commands in a persistent hsi process.
+    """
+    s = HsiSession()
+    assert not s.running
+    s.start()
+    assert s.running
+    pid = s._process.pid
+    assert s.run('ls', '-l', 'foo') == 'ls -l foo\nfake: ls -l foo\n'
+    assert s.run('put', 'my file.txt', ':', 'foo.txt') == 'put "my file.txt" : foo.txt\nfake: put "my file.txt" : foo.txt\n'
+    assert s._process.pid == pid
+    s.close()
+    assert not s.running
+    s.close()
+
+
+def test_hsi_session_iterrun(fake_hsi):
+    """Test reading session output line by line.
+    """
+    with HsiSession() as s:
+        lines = s.iterrun('ls', 'foo')
+        assert next(lines) == 'ls foo\n'
+        lines.close()
+        assert s.run('ls', 'bar') == 'ls bar\nfake: ls bar\n'
+        assert list(hsi_iter('ls', 'baz')) == ['ls baz\n', 'fake: ls baz\n']
+
+
+def test_hsi_session_nested(fake_hsi, tmp_path):
+    """Test running a command while session output is still being read.
+    """
+    with HsiSession() as s:
+        lines = s.iterrun('ls', 'foo', tmpdir=str(tmp_path))
+        assert next(lines) == 'ls foo\n'
+        assert s.run('ls', 'bar') == 'ls bar\nfake: ls bar\n'
+        assert list(hsi_iter('ls', 'baz')) == ['ls baz\n', 'fake: ls baz\n']
+        assert next(lines) == 'fake: ls foo\n'
+        lines.close()
+
+
+def test_walk_session(fake_hsi):
+    """Test walk() on a directory containing a link, inside a session.
+    """
+    listing = recursive_listing.split('\n\n')
+    listings = {'ls -Da /home/b/bweaver': listing[0] + '\n',
+                'ls -Da /home/b/bweaver/sub': listing[1] + '\n',
+                'ls -Da /home/b/bweaver/sub/empty': '',
+                'ls -Dd /nersc/projects/cosmo': 'drwxrws---    6 nugent    cosmo            512 Tue Jun  4 11:06:43 2019 cosmo\n'}
+    (fake_hsi.parent / 'listings.json').write_text(json.dumps(listings))
+    with HsiSession():
+        w = list(walk('/home/b/bweaver'))
+    assert [x[0] for x in w] == ['/home/b/bweaver',
+                                 '/home/b/bweaver/sub',
+                                 '/home/b/bweaver/sub/empty']
+    assert [str(d) for d in w[0][1]] == ['cosmo', 'sub']
+    assert [str(f) for f in w[0][2]] == ['a.tar', 'a.tar.idx']
+
+
+def test_walk_recursive_session(fake_hsi):
+    """Test a recursive walk() containing a link, inside a session.
+    """
+    listings = {'ls -DaR /home/b/bweaver': recursive_listing,
+                'ls -Dd /nersc/projects/cosmo': 'drwxrws---    6 nugent    cosmo            512 Tue Jun  4 11:06:43 2019 cosmo\n'}
+    (fake_hsi.parent / 'listings.json').write_text(json.dumps(listings))
+    with HsiSession():
+        w = list()
+        for root, dirs, files in walk('/home/b/bweaver', recursive=True):
+            #
+            # The session is free while the caller examines each directory.
+            #
+            if root == '/home/b/bweaver':
+                assert hpss_stat('/nersc/projects/cosmo').isdir
+            w.append((root, dirs, files))
+    assert [x[0] for x in w] == ['/home/b/bweaver',
+                                 '/home/b/bweaver/sub',
+                                 '/home/b/bweaver/sub/empty']
+    assert [str(d) for d in w[0][1]] == ['cosmo', 'sub']
+    assert [str(f) for f in w[0][2]] == ['a.tar', 'a.tar.idx']
+
+
+def test_hsi_session_default(fake_hsi, monkeypatch, mock_call):
+    """Test routing hsi() through the active session.
+    """
+    m = mock_call([0])
+    monkeypatch.setattr('hpsspy.util.call', m)
+    assert current_session() is None
+    with HsiSession() as s:
+        assert current_session() is s
+        assert hsi('chmod', '664', 'foo') == 'chmod 664 foo\nfake: chmod 664 foo\n'
+    assert current_session() is None
+    assert not s.running
+    assert m.counter == 0
+
+
+def test_hsi_session_crash(fake_hsi):
+    """Test an hsi process that terminates unexpectedly.
+    """
+    with HsiSession() as s:
+        with pytest.raises(HpssError) as err:
+            s.run('crash')
+        assert err.value.args[0] == "hsi session terminated unexpectedly!"
+    assert not s.running
+
+
+def test_hsi_pool(fake_hsi, monkeypatch):
+    """Test dispatching commands to a pool of hsi sessions.
+    """
+    with pytest.raises(ValueError) as err:
+        p = HsiPool(workers=HsiPool.session_limit + 1)
+    assert err.value.args[0] == "Number of hsi sessions must be between 1 and 16!"
+    with HsiPool(workers=2) as p:
+        futures = [p.submit(hsi, 'ls', str(i)) for i in range(10)]
+        for i, f in enumerate(futures):
+            assert f.result() == f'ls {i:d}\nfake: ls {i:d}\n'
+        assert list(p.map(hsi, ('cd', 'cd'), ('a', 'b'))) == ['cd a\nfake: cd a\n', 'cd b\nfake: cd b\n']
+        assert p.chmod('foo', '664').result() is None
+        assert p.makedirs('foo/bar', mode='2770').result() is None
+        sessions = list(p._sessions)
+        assert 1 <= len(sessions) <= 2
+        assert all([s.running for s in sessions])
+        foo = 'drwxr-sr-x    3 bweaver   bweaver          512 Mon Oct  4 10:34:20 2010 test'
+        monkeypatch.setattr('hpsspy.os._os.hsi', lambda *args: foo)
+        assert p.stat('test').result().isdir
+        assert p.listdir('test').result()[0].name == 'test'
+    assert not any([s.running for s in sessions])
+    assert p._sessions == []
+
+
+def test_hsi_pool_shutdown_nowait(fake_hsi):
+    """Test that shutdown without waiting lets pending work finish.
+    """
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(i):
+        started.set()
+        release.wait(5)
+        return hsi('ls', str(i))
+
+    p = HsiPool(workers=2)
+    futures = [p.submit(slow, i) for i in range(4)]
+    started.wait(5)
+    p.shutdown(wait=False)
+    sessions = list(p._sessions)
+    release.set()
+    for i, f in enumerate(futures):
+        assert f.result(timeout=5) == f'ls {i:d}\nfake: ls {i:d}\n'
+    for t in threading.enumerate():
+        if t is not threading.main_thread():
+            t.join(5)
+    assert p._sessions == []
+    assert not any([s.running for s in sessions])
+
+
+def test_hsi_batch(monkeypatch, tmp_path):
+    """Test running several hsi commands from one command file.
+    """
+    calls = list()
+
+    def fake_call(command, stdout, stderr):
+        with open(command[-1]) as c:
+            lines = c.read().splitlines()
+        calls.append((command, lines))
+        #
+        # Pretend that hsi gives up after the third command.
+        #
+        n = 0
+        for line in lines:
+            if line.startswith('!echo '):
+                stdout.write((line[6:] + '\n').encode())
+                n += 1
+                if n == 3:
+                    break
+            elif line.startswith('chmod'):
+                stdout.write(b'*** hpss_Chmod: Access denied\n')
+            else:
+                stdout.write(b'OK\n')
+        return 0
+
+    monkeypatch.setenv('HPSS_DIR', '/foo/bar')
+    monkeypatch.setattr('hpsspy.util.call', fake_call)
+    b = HsiBatch(tmpdir=str(tmp_path))
+    assert b.run() == []
+    assert b.makedirs('/hpss/a', mode='2770') == 0
+    assert b.makedirs('/hpss/b') == 1
+    assert b.chmod('/hpss/a', 0o664) == 2
+    assert b.put('/disk/a b.txt', '/hpss/a/a b.txt') == 3
+    assert len(b) == 4
+    results = b.run()
+    assert len(b) == 0
+    assert calls[0][0][:4] == ['/foo/bar/bin/hsi', '-s', 'archive', 'in']
+    assert calls[0][1][::2] == ['mkdir -p -m 2770 /hpss/a',
+                                'mkdir -p /hpss/b',
+                                'chmod 436 /hpss/a',
+                                'put "/disk/a b.txt" : "/hpss/a/a b.txt"']
+    assert [r.ok for r in results] == [True, True, False, False]
+    assert results[0].command == ('mkdir', '-p', '-m', '2770', '/hpss/a')
+    assert results[1].output == 'OK\n'
+    assert results[2].output == '*** hpss_Chmod: Access denied\n'
+    assert results[3].output == ''
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_hsi_batch_session(fake_hsi):
+    """Test running a batch of commands in a session.
+    """
+    b = HsiBatch()
+    b.add('cd', 'foo')
+    b.put('bar', 'baz')
+    with HsiSession():
+        results = b.run()
+    assert [r.output for r in results] == ['cd foo\nfake: cd foo\n',
+                                           'put bar : baz\nfake: put bar : baz\n']
 
 
 def test_htar(monkeypatch, mock_call):
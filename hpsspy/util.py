@@ -9,11 +9,22 @@ Low-level utilities.
 import os
 import stat
 import re
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from subprocess import call
-from tempfile import TemporaryFile
+from functools import lru_cache
+from subprocess import call, Popen, PIPE, STDOUT, TimeoutExpired
+from tempfile import TemporaryFile, mkstemp
+from uuid import uuid4
 import pytz
-from . import HpssOSError
+from . import HpssError, HpssOSError
+
+
+_local = threading.local()
 
 
 class HpssFile(object):
@@ -65,29 +76,69 @@ class HpssFile(object):
                              (\S.*)$               # filename
                              """, re.VERBOSE)
     _file_modes = {'l': stat.S_IFLNK, 'd': stat.S_IFDIR, '-': stat.S_IFREG}
+    _days = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
     _months = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
                'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
     _pacific = pytz.timezone('US/Pacific')
+    #
+    # Millions of these objects may exist at once, so avoid a __dict__.
+    #
+    __slots__ = ('hpss_path', 'raw_type', 'raw_permission', 'st_nlink',
+                 'st_uid', 'st_gid', 'st_size', 'raw_name', 'ishtar',
+                 '_raw_time', '_contents', '_st_mtime', '_isdir')
 
     def __init__(self, *args):
-        self.hpss_path = args[0]
-        self.raw_type = args[1]
-        self.raw_permission = args[2]
+        self.hpss_path = sys.intern(args[0])
+        self.raw_type = sys.intern(args[1])
+        self.raw_permission = sys.intern(args[2])
         self.st_nlink = int(args[3])
-        self.st_uid = args[4]
-        self.st_gid = args[5]
+        self.st_uid = sys.intern(args[4])
+        self.st_gid = sys.intern(args[5])
         self.st_size = int(args[6])
-        self.raw_dow = args[7]
-        self.raw_month = args[8]
-        self.raw_day = int(args[9])
-        self.raw_hms = args[10]
-        self.raw_year = int(args[11])
+        #
+        # Pack the components of the modification time into one integer.
+        #
+        self._raw_time = (_pack_date(args[7], args[8], args[9], args[11]) |
+                          _pack_hms(args[10]))
         self.raw_name = args[12]
         self.ishtar = False
         self._contents = None  # placeholder for htar file contents.
-        self._property_cache = dict()
+        self._st_mtime = None
+        self._isdir = None
         return
 
+    @property
+    def raw_dow(self):
+        """Day-of-week of modification time.
+        """
+        return self._days[self._raw_time & 0x7]
+
+    @property
+    def raw_month(self):
+        """Month of modification time.
+        """
+        return self._months[(self._raw_time >> 25) & 0xf]
+
+    @property
+    def raw_day(self):
+        """Day of modification time.
+        """
+        return (self._raw_time >> 20) & 0x1f
+
+    @property
+    def raw_hms(self):
+        """H:M:S of modification time.
+        """
+        return '{0:02d}:{1:02d}:{2:02d}'.format((self._raw_time >> 15) & 0x1f,
+                                                (self._raw_time >> 9) & 0x3f,
+                                                (self._raw_time >> 3) & 0x3f)
+
+    @property
+    def raw_year(self):
+        """Year of modification time.
+        """
+        return self._raw_time >> 29
+
     def __repr__(self):
         return ("HpssFile('{0.hpss_path}', '{0.raw_type}', " +
                 "'{0.raw_permission}', {0.st_nlink:d}, '{0.st_uid}', " +
@@ -109,16 +160,30 @@ class HpssFile(object):
         """``True`` if the file is a directory or a symbolic link that
         points to a directory.
         """
-        from .os import stat as hpss_stat
         if self.islink:
-            new_path = self.readlink
-            if new_path.startswith('/'):
-                return hpss_stat(new_path).isdir
-            else:
-                return hpss_stat(os.path.join(self.hpss_path, new_path)).isdir
+            if self._isdir is None:
+                resolved = link_cache.get('link', self.path)
+                if resolved is None:
+                    self._isdir = self._target().isdir
+                else:
+                    self._isdir = resolved[1]
+            return self._isdir
         else:
             return self.raw_type == 'd'
 
+    def _target(self):
+        """Resolve a symbolic link.
+
+        Returns
+        -------
+        :class:`~hpsspy.util.HpssFile`
+            The current metadata of the final target of the link.  The path
+            to the target is shared by all objects describing the same
+            link, via :data:`link_cache`.
+        """
+        from .os._os import _follow
+        return _follow(self.path, self)
+
     @property
     def readlink(self):
         """Destination of symbolic link.
@@ -147,57 +212,25 @@ class HpssFile(object):
     def st_mode(self):
         """File permission mode.
         """
-        if 'st_mode' not in self._property_cache:
-            try:
-                mode = self._file_modes[self.raw_type]
-            except KeyError:
-                raise AttributeError(("Unknown file type, {0.raw_type}, " +
-                                      "for {0.name}!").format(self))
-            if self.raw_permission[0] == 'r':
-                mode |= stat.S_IRUSR
-            if self.raw_permission[1] == 'w':
-                mode |= stat.S_IWUSR
-            if self.raw_permission[2] == 'x':
-                mode |= stat.S_IXUSR
-            if self.raw_permission[2] == 'S':
-                mode |= stat.S_ISUID
-            if self.raw_permission[2] == 's':
-                mode |= (stat.S_IXUSR | stat.S_ISUID)
-            if self.raw_permission[3] == 'r':
-                mode |= stat.S_IRGRP
-            if self.raw_permission[4] == 'w':
-                mode |= stat.S_IWGRP
-            if self.raw_permission[5] == 'x':
-                mode |= stat.S_IXGRP
-            if self.raw_permission[5] == 'S':
-                mode |= stat.S_ISGID
-            if self.raw_permission[5] == 's':
-                mode |= (stat.S_IXGRP | stat.S_ISGID)
-            if self.raw_permission[6] == 'r':
-                mode |= stat.S_IROTH
-            if self.raw_permission[7] == 'w':
-                mode |= stat.S_IWOTH
-            if self.raw_permission[8] == 'x':
-                mode |= stat.S_IXOTH
-            if self.raw_permission[8] == 'T':
-                mode |= stat.S_ISVTX
-            if self.raw_permission[8] == 't':
-                mode |= (stat.S_IXOTH | stat.S_ISVTX)
-            self._property_cache['st_mode'] = mode
-        return self._property_cache['st_mode']
+        try:
+            return _file_mode(self.raw_type, self.raw_permission)
+        except KeyError:
+            raise AttributeError(("Unknown file type, {0.raw_type}, " +
+                                  "for {0.name}!").format(self))
 
     @property
     def st_mtime(self):
         """File modification time.
+
+        :command:`hsi` reports times in US/Pacific time, which is converted
+        to seconds since the Unix epoch.
         """
-        if 'st_mtime' not in self._property_cache:
-            # seconds = 0
-            month = self._months.index(self.raw_month) + 1
-            h, m, s = map(int, self.raw_hms.split(':'))
-            mtime = int(datetime(self.raw_year, month, self.raw_day,
-                                 h, m, s, tzinfo=self._pacific).strftime('%s'))
-            self._property_cache['st_mtime'] = mtime
-        return self._property_cache['st_mtime']
+        if self._st_mtime is None:
+            t = self._raw_time
+            self._st_mtime = (_pacific_hour(t >> 29, ((t >> 25) & 0xf) + 1,
+                                            (t >> 20) & 0x1f, (t >> 15) & 0x1f) +
+                              ((t >> 9) & 0x3f) * 60 + ((t >> 3) & 0x3f))
+        return self._st_mtime
 
     def htar_contents(self):
         """Return (and cache) the contents of an htar file.
@@ -220,6 +253,566 @@ class HpssFile(object):
             return None
 
 
+@lru_cache(maxsize=4096)
+def _file_mode(raw_type, raw_permission):
+    """Convert a file type and permission string to a file mode.
+
+    Only a few hundred distinct combinations appear in practice, so the
+    results are memoized and shared by all :class:`~hpsspy.util.HpssFile`
+    objects.
+
+    Parameters
+    ----------
+    raw_type : :class:`str`
+        Raw type string.
+    raw_permission : :class:`str`
+        Raw permission string.
+
+    Returns
+    -------
+    :class:`int`
+        The file mode.
+
+    Raises
+    ------
+    KeyError
+        If `raw_type` is unknown.
+    """
+    mode = HpssFile._file_modes[raw_type]
+    if raw_permission[0] == 'r':
+        mode |= stat.S_IRUSR
+    if raw_permission[1] == 'w':
+        mode |= stat.S_IWUSR
+    if raw_permission[2] == 'x':
+        mode |= stat.S_IXUSR
+    if raw_permission[2] == 'S':
+        mode |= stat.S_ISUID
+    if raw_permission[2] == 's':
+        mode |= (stat.S_IXUSR | stat.S_ISUID)
+    if raw_permission[3] == 'r':
+        mode |= stat.S_IRGRP
+    if raw_permission[4] == 'w':
+        mode |= stat.S_IWGRP
+    if raw_permission[5] == 'x':
+        mode |= stat.S_IXGRP
+    if raw_permission[5] == 'S':
+        mode |= stat.S_ISGID
+    if raw_permission[5] == 's':
+        mode |= (stat.S_IXGRP | stat.S_ISGID)
+    if raw_permission[6] == 'r':
+        mode |= stat.S_IROTH
+    if raw_permission[7] == 'w':
+        mode |= stat.S_IWOTH
+    if raw_permission[8] == 'x':
+        mode |= stat.S_IXOTH
+    if raw_permission[8] == 'T':
+        mode |= stat.S_ISVTX
+    if raw_permission[8] == 't':
+        mode |= (stat.S_IXOTH | stat.S_ISVTX)
+    return mode
+
+
+@lru_cache(maxsize=65536)
+def _pack_date(dow, month, day, year):
+    """Pack the date of a modification time into the bits used by
+    :class:`~hpsspy.util.HpssFile`.
+
+    Parameters
+    ----------
+    dow, month : :class:`str`
+        Day-of-week and month.
+    day, year : :class:`str` or :class:`int`
+        Day and year.
+
+    Returns
+    -------
+    :class:`int`
+        The packed date.
+
+    Raises
+    ------
+    ValueError
+        If any component is invalid.
+    """
+    return ((int(year) << 29) | (HpssFile._months.index(month) << 25) |
+            (int(day) << 20) | HpssFile._days.index(dow))
+
+
+@lru_cache(maxsize=131072)
+def _pack_hms(hms):
+    """Pack the time of day of a modification time into the bits used by
+    :class:`~hpsspy.util.HpssFile`.
+
+    Parameters
+    ----------
+    hms : :class:`str`
+        H:M:S.
+
+    Returns
+    -------
+    :class:`int`
+        The packed time.
+
+    Raises
+    ------
+    ValueError
+        If `hms` is invalid.
+    """
+    h, m, s = map(int, hms.split(':'))
+    return (h << 15) | (m << 9) | (s << 3)
+
+
+_epoch_ordinal = datetime(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=65536)
+def _pacific_hour(year, month, day, hour):
+    """Convert the start of an hour in US/Pacific time to a Unix timestamp.
+
+    Only a small number of distinct hours appear in a typical listing, so
+    the results are memoized.
+
+    Parameters
+    ----------
+    year, month, day, hour : :class:`int`
+        The local time.
+
+    Returns
+    -------
+    :class:`int`
+        Seconds since the Unix epoch.
+    """
+    local = HpssFile._pacific.localize(datetime(year, month, day, hour))
+    offset = int(local.utcoffset().total_seconds())
+    days = local.toordinal() - _epoch_ordinal
+    return days * 86400 + hour * 3600 - offset
+
+
+class HpssDirEntry(object):
+    """Describe one entry in an HPSS directory, similar to :class:`os.DirEntry`.
+
+    Objects of this class are normally produced by :func:`hpsspy.os.scandir`.
+    Questions about the entry are answered from the directory listing,
+    except for the targets of symbolic links, which are looked up when
+    first needed and then remembered.
+
+    Parameters
+    ----------
+    hpss_file : :class:`~hpsspy.util.HpssFile`
+        Metadata obtained from a directory listing.
+
+    Attributes
+    ----------
+    name : :class:`str`
+        Name of the entry.
+    path : :class:`str`
+        Full path to the entry.
+    """
+
+    def __init__(self, hpss_file):
+        self.name = hpss_file.name
+        self.path = hpss_file.path
+        self._file = hpss_file
+        self._isdir = None
+        self._stat = None
+        return
+
+    def __repr__(self):
+        return "<HpssDirEntry '{0}'>".format(self.name)
+
+    def __fspath__(self):
+        return self.path
+
+    def is_dir(self, follow_symlinks=True):
+        """``True`` if the entry is a directory.
+
+        Parameters
+        ----------
+        follow_symlinks : :class:`bool`, optional
+            If ``False``, a symbolic link to a directory is not a directory.
+
+        Returns
+        -------
+        :class:`bool`
+            ``True`` if the entry is a directory.
+        """
+        if self._file.islink:
+            if not follow_symlinks:
+                return False
+            if self._isdir is None:
+                self._isdir = self._file.isdir
+            return self._isdir
+        return self._file.isdir
+
+    def is_file(self, follow_symlinks=True):
+        """``True`` if the entry is a file.
+
+        Parameters
+        ----------
+        follow_symlinks : :class:`bool`, optional
+            If ``False``, a symbolic link to a file is not a file.
+
+        Returns
+        -------
+        :class:`bool`
+            ``True`` if the entry is a file.
+        """
+        if self._file.islink and not follow_symlinks:
+            return False
+        return not self.is_dir(follow_symlinks)
+
+    def is_symlink(self):
+        """``True`` if the entry is a symbolic link.
+
+        Returns
+        -------
+        :class:`bool`
+            ``True`` if the entry is a symbolic link.
+        """
+        return self._file.islink
+
+    def stat(self, follow_symlinks=True):
+        """Return the metadata for this entry.
+
+        Parameters
+        ----------
+        follow_symlinks : :class:`bool`, optional
+            If ``False``, return the metadata of a symbolic link itself,
+            rather than its target.
+
+        Returns
+        -------
+        :class:`~hpsspy.util.HpssFile`
+            The metadata.
+
+        Raises
+        ------
+        :class:`~hpsspy.HpssOSError`
+            If the target of a symbolic link could not be found.
+        """
+        if self._file.islink and follow_symlinks:
+            if self._stat is None:
+                self._stat = self._file._target()
+            return self._stat
+        return self._file
+
+
+class HpssFileTable(object):
+    """Store the metadata of many HPSS files in columns.
+
+    This is a compact alternative to a :class:`list` of
+    :class:`~hpsspy.util.HpssFile` objects, for bulk listings.  Numeric
+    metadata are stored in :class:`array.array` columns, and the names of
+    parent directories are only stored once.
+
+    Attributes
+    ----------
+    directories : :class:`list`
+        Names of parent directories.
+    names : :class:`list`
+        Names of files.
+    parent : :class:`array.array`
+        Index of each file's parent directory in `directories`.
+    st_size : :class:`array.array`
+        File sizes in bytes.
+    st_mtime : :class:`array.array`
+        File modification times.
+    st_mode : :class:`array.array`
+        File modes.
+    st_nlink : :class:`array.array`
+        Number of hard links.
+    ishtar : :class:`array.array`
+        Non-zero if the file is an htar file.
+    """
+
+    def __init__(self):
+        self.directories = list()
+        self.names = list()
+        self.parent = array('l')
+        self.st_size = array('q')
+        self.st_mtime = array('q')
+        self.st_mode = array('l')
+        self.st_nlink = array('l')
+        self.ishtar = array('b')
+        self._directory_index = dict()
+        return
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        return (self.path(i), self.st_size[i], self.st_mtime[i])
+
+    def append(self, f):
+        """Add one file to the table.
+
+        Parameters
+        ----------
+        f : :class:`~hpsspy.util.HpssFile`
+            Metadata to add.
+        """
+        try:
+            p = self._directory_index[f.hpss_path]
+        except KeyError:
+            p = self._directory_index[f.hpss_path] = len(self.directories)
+            self.directories.append(f.hpss_path)
+        self.names.append(f.name)
+        self.parent.append(p)
+        self.st_size.append(f.st_size)
+        self.st_mtime.append(f.st_mtime)
+        self.st_mode.append(f.st_mode)
+        self.st_nlink.append(f.st_nlink)
+        self.ishtar.append(f.ishtar)
+        return
+
+    def extend(self, files):
+        """Add several files to the table.
+
+        Parameters
+        ----------
+        files : iterable
+            :class:`~hpsspy.util.HpssFile` objects.
+        """
+        for f in files:
+            self.append(f)
+        return
+
+    def path(self, i):
+        """Full path to file `i`.
+
+        Parameters
+        ----------
+        i : :class:`int`
+            Row in the table.
+
+        Returns
+        -------
+        :class:`str`
+            The full path.
+        """
+        return os.path.join(self.directories[self.parent[i]], self.names[i])
+
+    def paths(self):
+        """Full paths to all files.
+
+        Returns
+        -------
+        iterable
+            The full path of every row in the table.
+        """
+        for i in range(len(self.names)):
+            yield self.path(i)
+
+    def isdir(self):
+        """Identify directories.
+
+        Returns
+        -------
+        :class:`array.array`
+            Non-zero for directories.  Symbolic links are not followed.
+        """
+        return array('b', map(stat.S_ISDIR, self.st_mode))
+
+    def islink(self):
+        """Identify symbolic links.
+
+        Returns
+        -------
+        :class:`array.array`
+            Non-zero for symbolic links.
+        """
+        return array('b', map(stat.S_ISLNK, self.st_mode))
+
+    @classmethod
+    def from_walk(cls, top, **kwargs):
+        """Build a table containing an entire directory tree.
+
+        Parameters
+        ----------
+        top : :class:`str`
+            Starting directory.
+        kwargs : :class:`dict`
+            Additional keyword arguments passed to :func:`hpsspy.os.walk`.
+
+        Returns
+        -------
+        :class:`~hpsspy.util.HpssFileTable`
+            Every file and directory below `top`.
+        """
+        from .os import walk
+        table = cls()
+        for root, dirs, files in walk(top, **kwargs):
+            table.extend(dirs)
+            table.extend(files)
+        return table
+
+
+class MetadataCache(object):
+    """Remember the results of :mod:`hpsspy.os` metadata lookups.
+
+    Entries expire after a fixed time, and the least recently used entries
+    are discarded when the cache is full.  The cache is safe to use from
+    many threads.
+
+    Directory listings are shared by :func:`hpsspy.os.listdir`,
+    :func:`hpsspy.os.iterdir`, :func:`hpsspy.os.scandir`, and therefore
+    :func:`hpsspy.os.walk`.  However, ``walk(recursive=True)`` obtains the
+    entire tree with one command, and neither reads nor fills the cache.
+
+    Parameters
+    ----------
+    ttl : :class:`float`, optional
+        Lifetime of an entry in seconds.  If ``None``, entries never expire.
+    maxsize : :class:`int`, optional
+        Maximum number of entries.
+    enabled : :class:`bool`, optional
+        If ``False``, nothing is stored and every lookup is a miss.
+
+    Attributes
+    ----------
+    hits : :class:`int`
+        Number of successful lookups.
+    misses : :class:`int`
+        Number of unsuccessful lookups.
+    """
+
+    def __init__(self, ttl=60.0, maxsize=100000, enabled=True):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._kinds = set()
+        self._lock = threading.Lock()
+        return
+
+    def __len__(self):
+        return len(self._data)
+
+    def configure(self, **kwargs):
+        """Change the `ttl`, `maxsize` or `enabled` settings.
+
+        Disabling the cache also empties it.
+        """
+        with self._lock:
+            for k in ('ttl', 'maxsize', 'enabled'):
+                if k in kwargs:
+                    setattr(self, k, kwargs[k])
+            if not self.enabled:
+                self._data.clear()
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return
+
+    def get(self, kind, path):
+        """Look up a cached value.
+
+        Parameters
+        ----------
+        kind : :class:`str`
+            The type of lookup, *e.g.* ``'stat'`` or ``'listdir'``.
+        path : :class:`str`
+            Path on HPSS.
+
+        Returns
+        -------
+        object
+            The cached value, or ``None`` if it is missing or expired.
+        """
+        key = (kind, os.path.normpath(path))
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, kind, path, value):
+        """Store a value.
+
+        Parameters
+        ----------
+        kind : :class:`str`
+            The type of lookup, *e.g.* ``'stat'`` or ``'listdir'``.
+        path : :class:`str`
+            Path on HPSS.
+        value : object
+            Value to store.
+        """
+        if not self.enabled:
+            return
+        if self.ttl is None:
+            expires = None
+        else:
+            expires = time.monotonic() + self.ttl
+        key = (kind, os.path.normpath(path))
+        with self._lock:
+            self._kinds.add(kind)
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return
+
+    def invalidate(self, path, parents=False):
+        """Forget everything known about `path`.
+
+        The directory containing `path` is also forgotten, since its
+        listing and modification time may have changed.
+
+        Parameters
+        ----------
+        path : :class:`str`
+            Path on HPSS.
+        parents : :class:`bool`, optional
+            If ``True``, also forget all ancestors of `path`, for example
+            after :func:`hpsspy.os.makedirs`.
+        """
+        path = os.path.normpath(path)
+        paths = [path]
+        d = os.path.dirname(path)
+        while d and d != paths[-1]:
+            paths.append(d)
+            if not parents:
+                break
+            d = os.path.dirname(d)
+        with self._lock:
+            for kind in self._kinds:
+                for p in paths:
+                    self._data.pop((kind, p), None)
+        return
+
+    def clear(self):
+        """Empty the cache and reset the counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+        return
+
+
+#
+# Shared by all hpsspy.os functions.  Disabled unless explicitly configured.
+#
+metadata_cache = MetadataCache(enabled=False)
+
+#
+# Final targets of symbolic links, as the path to the target and whether it
+# is a directory.  This is always enabled, but entries expire like
+# metadata_cache entries, and are invalidated along with them.
+#
+link_cache = MetadataCache()
+
+
 def get_hpss_dir():
     """Return the directory containing HPSS commands.
 
@@ -266,6 +859,512 @@ def get_tmpdir(**kwargs):
     return t
 
 
+def _hsi_command(args):
+    """Convert a sequence of arguments into a single :command:`hsi` command.
+
+    Parameters
+    ----------
+    args : iterable
+        Arguments to be passed to :command:`hsi`.
+
+    Returns
+    -------
+    :class:`str`
+        A command line, with arguments containing whitespace quoted.
+    """
+    quoted = list()
+    for a in args:
+        a = str(a)
+        if len(a) == 0 or len(a.split()) > 1:
+            a = '"{0}"'.format(a)
+        quoted.append(a)
+    return ' '.join(quoted)
+
+
+class HsiSession(object):
+    """A persistent, interactive :command:`hsi` process.
+
+    Commands are written to the standard input of a single :command:`hsi`
+    process, so authentication against the archive only happens once.
+    The end of each command's output is found by following every command
+    with a shell escape that echoes a unique marker.
+
+    When used as a context manager, the session becomes the default for
+    :func:`hpsspy.util.hsi` (and therefore all of :mod:`hpsspy.os`) in
+    the current thread.
+    """
+    _promptre = re.compile(r'^\[HSI\]\S*->\s?')
+
+    def __init__(self):
+        self.marker = 'HPSSPY-' + uuid4().hex
+        self._process = None
+        self._previous = None
+        self._lock = threading.Lock()
+        return
+
+    def __enter__(self):
+        self.start()
+        self._previous = current_session()
+        _local.session = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.session = self._previous
+        self._previous = None
+        self.close()
+        return False
+
+    @property
+    def running(self):
+        """``True`` if the underlying :command:`hsi` process is alive.
+        """
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        """Start the :command:`hsi` process, if it is not already running.
+
+        Raises
+        ------
+        KeyError
+            If the :envvar:`HPSS_DIR` environment variable has not been set.
+        """
+        if self.running:
+            return
+        path = get_hpss_dir()
+        command = [os.path.join(path, 'hsi'), '-s', 'archive']
+        self._process = Popen(command, stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+                              universal_newlines=True, bufsize=1)
+        #
+        # Discard any login banner.
+        #
+        self._send('')
+        for line in self._receive():
+            pass
+        return
+
+    def close(self):
+        """Terminate the :command:`hsi` process.
+        """
+        if self._process is None:
+            return
+        try:
+            if self._process.poll() is None:
+                self._process.stdin.write('quit\n')
+            self._process.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+        try:
+            self._process.wait(timeout=10)
+        except TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process.stdout.close()
+        self._process = None
+        return
+
+    def _send(self, command):
+        """Write `command` followed by the end-of-output marker.
+
+        Parameters
+        ----------
+        command : :class:`str`
+            A complete :command:`hsi` command line.
+
+        Raises
+        ------
+        :class:`~hpsspy.HpssError`
+            If the :command:`hsi` process has exited.
+        """
+        try:
+            if command:
+                self._process.stdin.write(command + '\n')
+            self._process.stdin.write('!echo ' + self.marker + '\n')
+            self._process.stdin.flush()
+        except BrokenPipeError:
+            raise HpssError("hsi session terminated unexpectedly!")
+        return
+
+    def _receive(self):
+        """Read output up to, but not including, the end-of-output marker.
+
+        Returns
+        -------
+        iterable
+            The lines of output, as they are produced.
+
+        Raises
+        ------
+        :class:`~hpsspy.HpssError`
+            If the :command:`hsi` process exits unexpectedly.
+        """
+        while True:
+            line = self._process.stdout.readline()
+            if not line:
+                raise HpssError("hsi session terminated unexpectedly!")
+            line = self._promptre.sub('', line)
+            if line.strip() == self.marker:
+                return
+            yield line
+
+    def run(self, *args):
+        """Run a single :command:`hsi` command in this session.
+
+        Parameters
+        ----------
+        args : :func:`tuple`
+            Arguments to be passed to :command:`hsi`.
+
+        Returns
+        -------
+        :class:`str`
+            The output from the command.
+        """
+        with self._lock:
+            self.start()
+            self._send(_hsi_command(args))
+            return ''.join(self._receive())
+
+    def iterrun(self, *args, tmpdir=None):
+        """Run a single :command:`hsi` command, yielding lines of output.
+
+        The output is copied to a temporary file as it is produced, and
+        the lines are read back from that file, so the output is never
+        held in memory all at once, and the session is free to run other
+        commands while the lines are being consumed.
+
+        Parameters
+        ----------
+        args : :func:`tuple`
+            Arguments to be passed to :command:`hsi`.
+        tmpdir : :class:`str`, optional
+            Write the temporary file to this directory.  Defaults to the
+            value returned by :func:`hpsspy.util.get_tmpdir`.
+
+        Returns
+        -------
+        iterable
+            The lines of output.
+        """
+        if tmpdir is None:
+            tmpdir = get_tmpdir()
+        with TemporaryFile('w+', newline='', dir=tmpdir) as t:
+            with self._lock:
+                self.start()
+                self._send(_hsi_command(args))
+                for line in self._receive():
+                    t.write(line)
+            t.seek(0)
+            for line in t:
+                yield line
+
+
+class HsiPool(object):
+    """A bounded pool of :class:`~hpsspy.util.HsiSession` workers.
+
+    Each worker thread owns one session, which is the default session
+    for any :func:`~hpsspy.util.hsi` call made in that thread.  Therefore
+    any function in :mod:`hpsspy.os` can be dispatched to the pool.
+
+    Parameters
+    ----------
+    workers : :class:`int`, optional
+        Number of concurrent :command:`hsi` sessions (default 8).
+
+    Raises
+    ------
+    ValueError
+        If `workers` is less than one or greater than
+        :attr:`session_limit`.
+    """
+    #: Maximum number of concurrent sessions permitted by the archive.
+    session_limit = 16
+
+    def __init__(self, workers=8):
+        if workers < 1 or workers > self.session_limit:
+            raise ValueError(("Number of hsi sessions must be between 1 " +
+                              "and {0:d}!").format(self.session_limit))
+        self.workers = workers
+        self._sessions = list()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            initializer=self._initialize)
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+    def _initialize(self):
+        """Create the session belonging to a new worker thread.
+        """
+        session = HsiSession()
+        with self._lock:
+            self._sessions.append(session)
+        _local.session = session
+        return
+
+    def submit(self, function, *args, **kwargs):
+        """Schedule ``function(*args, **kwargs)`` to run in the pool.
+
+        Parameters
+        ----------
+        function : callable
+            Function to run, typically one of the :mod:`hpsspy.os` functions.
+        args : :func:`tuple`
+            Positional arguments to `function`.
+        kwargs : :class:`dict`
+            Keyword arguments to `function`.
+
+        Returns
+        -------
+        :class:`concurrent.futures.Future`
+            A future representing the result of `function`.
+        """
+        return self._executor.submit(function, *args, **kwargs)
+
+    def map(self, function, *iterables):
+        """Apply `function` to every item of `iterables` in the pool.
+
+        Parameters
+        ----------
+        function : callable
+            Function to run, typically one of the :mod:`hpsspy.os` functions.
+        iterables : :func:`tuple`
+            Iterables of arguments to `function`.
+
+        Returns
+        -------
+        iterable
+            The results, in the same order as `iterables`.
+        """
+        return self._executor.map(function, *iterables)
+
+    def chmod(self, path, mode):
+        """Run :func:`hpsspy.os.chmod` in the pool.
+        """
+        from .os import chmod
+        return self.submit(chmod, path, mode)
+
+    def listdir(self, path):
+        """Run :func:`hpsspy.os.listdir` in the pool.
+        """
+        from .os import listdir
+        return self.submit(listdir, path)
+
+    def makedirs(self, path, mode=None):
+        """Run :func:`hpsspy.os.makedirs` in the pool.
+        """
+        from .os import makedirs
+        return self.submit(makedirs, path, mode=mode)
+
+    def stat(self, path, follow_symlinks=True):
+        """Run :func:`hpsspy.os.stat` in the pool.
+        """
+        from .os import stat
+        return self.submit(stat, path, follow_symlinks=follow_symlinks)
+
+    def shutdown(self, wait=True):
+        """Stop accepting work and close all sessions.
+
+        Sessions are only closed once all pending work has finished,
+        since it may still be using them.
+
+        Parameters
+        ----------
+        wait : :class:`bool`, optional
+            If ``True``, wait for pending work to finish and the sessions
+            to close.  Otherwise, return immediately, and close the
+            sessions in the background.
+        """
+        self._executor.shutdown(wait=False)
+        if wait:
+            self._close_sessions()
+        else:
+            threading.Thread(target=self._close_sessions).start()
+        return
+
+    def _close_sessions(self):
+        """Close all sessions, after every worker thread has finished.
+        """
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = list()
+        return
+
+
+#: The result of a single command in a :class:`~hpsspy.util.HsiBatch`.
+HsiResult = namedtuple('HsiResult', ['command', 'output', 'ok'])
+
+
+class HsiBatch(object):
+    """Collect :command:`hsi` commands and run them all at once.
+
+    The commands are written to a command file and executed with a single
+    ``hsi in <file>``, so the cost of connecting to the archive is paid
+    only once.  The output of each command is separated by the same
+    end-of-output marker used by :class:`~hpsspy.util.HsiSession`.
+
+    Parameters
+    ----------
+    tmpdir : :class:`str`, optional
+        Write the command file to this directory.  Defaults to the value
+        returned by :func:`hpsspy.util.get_tmpdir`.
+    """
+
+    def __init__(self, tmpdir=None):
+        self.tmpdir = tmpdir
+        self.commands = list()
+        self.marker = 'HPSSPY-' + uuid4().hex
+        return
+
+    def __len__(self):
+        return len(self.commands)
+
+    def add(self, *args):
+        """Add an arbitrary command to the batch.
+
+        Parameters
+        ----------
+        args : :func:`tuple`
+            Arguments to be passed to :command:`hsi`.
+
+        Returns
+        -------
+        :class:`int`
+            The index of the command's result in the list returned by
+            :meth:`run`.
+        """
+        self.commands.append(tuple([str(a) for a in args]))
+        return len(self.commands) - 1
+
+    def chmod(self, path, mode):
+        """Add the equivalent of :func:`hpsspy.os.chmod` to the batch.
+        """
+        return self.add('chmod', str(mode), path)
+
+    def makedirs(self, path, mode=None):
+        """Add the equivalent of :func:`hpsspy.os.makedirs` to the batch.
+        """
+        if mode is None:
+            return self.add('mkdir', '-p', path)
+        return self.add('mkdir', '-p', '-m', mode, path)
+
+    def put(self, source, destination):
+        """Add a file transfer to the batch.
+
+        Parameters
+        ----------
+        source : :class:`str`
+            File on disk.
+        destination : :class:`str`
+            File on HPSS.
+        """
+        return self.add('put', source, ':', destination)
+
+    def run(self, session=None):
+        """Run all commands and empty the batch.
+
+        Parameters
+        ----------
+        session : :class:`~hpsspy.util.HsiSession`, optional
+            Run the commands in this session instead of with a command
+            file.  Defaults to the session active in the current thread,
+            if any.
+
+        Returns
+        -------
+        :class:`list`
+            A :class:`~hpsspy.util.HsiResult` for every command, in the
+            order the commands were added.  Commands that were never
+            reached, for example because :command:`hsi` exited early,
+            have empty output and are not ``ok``.
+
+        Raises
+        ------
+        KeyError
+            If the :envvar:`HPSS_DIR` environment variable has not been set.
+        """
+        commands, self.commands = self.commands, list()
+        if not commands:
+            return list()
+        if session is None:
+            session = current_session()
+        if session is not None:
+            outputs = [session.run(*c) for c in commands]
+        else:
+            outputs = self._run_file(commands)
+        results = list()
+        for i, c in enumerate(commands):
+            try:
+                out = outputs[i]
+                ok = not out.startswith('**')
+            except IndexError:
+                out, ok = '', False
+            if c[0] in ('chmod', 'mkdir', 'put'):
+                metadata_cache.invalidate(c[-1], parents=(c[0] == 'mkdir'))
+                link_cache.invalidate(c[-1], parents=(c[0] == 'mkdir'))
+            results.append(HsiResult(c, out, ok))
+        return results
+
+    def _run_file(self, commands):
+        """Run `commands` with ``hsi in <file>``.
+
+        Parameters
+        ----------
+        commands : :class:`list`
+            Commands to run.
+
+        Returns
+        -------
+        :class:`list`
+            The output of each command that completed.
+        """
+        path = get_hpss_dir()
+        if self.tmpdir is None:
+            tmpdir = get_tmpdir()
+        else:
+            tmpdir = self.tmpdir
+        fd, cfile = mkstemp(prefix='hsi-', suffix='.in', dir=tmpdir)
+        with os.fdopen(fd, 'w') as c:
+            for args in commands:
+                c.write(_hsi_command(args) + '\n')
+                c.write('!echo ' + self.marker + '\n')
+        outfile = TemporaryFile()
+        command = [os.path.join(path, 'hsi'), '-s', 'archive', 'in', cfile]
+        try:
+            status = call(command, stdout=outfile, stderr=STDOUT)
+            outfile.seek(0)
+            out = outfile.read().decode('utf8')
+        finally:
+            outfile.close()
+            os.remove(cfile)
+        outputs = list()
+        lines = list()
+        for line in out.splitlines(True):
+            if line.strip() == self.marker:
+                outputs.append(''.join(lines))
+                lines = list()
+            else:
+                lines.append(line)
+        return outputs
+
+
+def current_session():
+    """Return the :class:`~hpsspy.util.HsiSession` active in this thread.
+
+    Returns
+    -------
+    :class:`~hpsspy.util.HsiSession`
+        The active session, or ``None`` if there is no active session.
+    """
+    return getattr(_local, 'session', None)
+
+
 def hsi(*args, **kwargs):
     """Run :command:`hsi` with arguments.
 
@@ -275,8 +1374,13 @@ def hsi(*args, **kwargs):
         Arguments to be passed to :command:`hsi`.
     tmpdir : :class:`str`, optional
         Write temporary files to this directory.  Defaults to the value
-        returned by :func:`hpsspy.util.get_tmpdir`. This option must be
-        passed as a keyword!
+        returned by :func:`hpsspy.util.get_tmpdir`. The output file name is
+        unique to each call, so concurrent calls may share a directory.
+        This option must be passed as a keyword!
+    session : :class:`~hpsspy.util.HsiSession`, optional
+        Run the command in this session instead of starting a new
+        :command:`hsi` process.  Defaults to the session active in the
+        current thread, if any. This option must be passed as a keyword!
 
     Returns
     -------
@@ -288,16 +1392,61 @@ def hsi(*args, **kwargs):
     KeyError
         If the :envvar:`HPSS_DIR` environment variable has not been set.
     """
+    session = kwargs.get('session', current_session())
+    if session is not None:
+        return session.run(*args)
+    return ''.join(hsi_iter(*args, **kwargs))
+
+
+def hsi_iter(*args, **kwargs):
+    """Run :command:`hsi` with arguments, yielding lines of output.
+
+    This is equivalent to :func:`~hpsspy.util.hsi`, but the output is never
+    held in memory all at once.
+
+    Parameters
+    ----------
+    args : :func:`tuple`
+        Arguments to be passed to :command:`hsi`.
+    tmpdir : :class:`str`, optional
+        Write temporary files to this directory.  Defaults to the value
+        returned by :func:`hpsspy.util.get_tmpdir`. This option must be
+        passed as a keyword!
+    session : :class:`~hpsspy.util.HsiSession`, optional
+        Run the command in this session instead of starting a new
+        :command:`hsi` process.  Defaults to the session active in the
+        current thread, if any. This option must be passed as a keyword!
+
+    Returns
+    -------
+    iterable
+        The lines of output, including line endings.
+
+    Raises
+    ------
+    KeyError
+        If the :envvar:`HPSS_DIR` environment variable has not been set.
+    """
+    session = kwargs.get('session', current_session())
+    if session is not None:
+        for line in session.iterrun(*args, tmpdir=get_tmpdir(**kwargs)):
+            yield line
+        return
     path = get_hpss_dir()
-    ofile = os.path.join(get_tmpdir(**kwargs), 'hsi.txt')
+    fd, ofile = mkstemp(prefix='hsi-', suffix='.txt',
+                        dir=get_tmpdir(**kwargs))
+    os.close(fd)
     base_command = [os.path.join(path, 'hsi'), '-O', ofile, '-s', 'archive']
     command = base_command + list(args)
-    status = call(command)
-    with open(ofile) as o:
-        out = o.read()
-    if os.path.exists(ofile):
-        os.remove(ofile)
-    return out
+    try:
+        call(command)
+        with open(ofile) as o:
+            for line in o:
+                yield line
+    finally:
+        if os.path.exists(ofile):
+            os.remove(ofile)
+    return
 
 
 def htar(*args):